@@ -388,6 +388,47 @@ class ForLoop(Statements):
             return ForLoop(self.var, self.iterable, self.body.filter(f))
 
 
+@dataclass
+@_dataclass_type_checker
+class FunctionDef(Statements):
+    '''Function definition and body.
+
+    Generates
+
+        @{decorators[0]}
+        @{decorators[1]}
+        ...
+        def {name}({args[0]}, {args[1]}, ...):
+            {body}
+
+    or nothing if `body` is empty.
+    '''
+
+    name: Variable
+    args: typing.Tuple[Variable, ...]
+    body: Statements
+    decorators: typing.Tuple[Expression, ...] = ()
+
+    @property
+    def lines(self) -> typing.Iterator[str]:
+        if self:
+            for decorator in self.decorators:
+                yield f'@{decorator.py_expr}'
+            args = ', '.join(arg.py_expr for arg in self.args)
+            yield f'def {self.name.py_expr}({args}):'
+            for line in self.body.lines:
+                yield '    ' + line
+
+    def __bool__(self):
+        return bool(self.body)
+
+    def filter(self, f):
+        if (filtered := f(self)) is not None:
+            return filtered
+        else:
+            return FunctionDef(self.name, self.args, self.body.filter(f), self.decorators)
+
+
 @dataclass
 @_dataclass_type_checker
 class With(Statements):
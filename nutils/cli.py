@@ -9,7 +9,7 @@ def run(f, *, argv=None):
     '''Command line interface for a single function.'''
 
     import treelog, bottombar
-    from . import _util as util, matrix, parallel, cache, warnings
+    from . import _util as util, evaluable, matrix, parallel, cache, warnings
 
     decorators = (
         util.trap_sigint(),
@@ -17,6 +17,10 @@ def run(f, *, argv=None):
         bottombar.add(util.memory(), label='memory', right=True, refresh=1), \
         util.in_context(cache.caching),
         util.in_context(parallel.maxprocs),
+        util.in_context(parallel.backend),
+        util.in_context(evaluable.batchsize),
+        util.in_context(evaluable.sparsebuffer),
+        util.in_context(evaluable.interntable),
         util.in_context(matrix.backend),
         util.in_context(util.set_stdoutlog),
         util.in_context(util.add_htmllog),
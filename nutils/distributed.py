@@ -0,0 +1,463 @@
+"""
+The distributed module provides tools for assembling sparse systems over
+processes that do not share memory. Every process, or *rank*, integrates a
+contiguous range of elements and sends the resulting sparse entries to the
+ranks that own the corresponding rows, such that no rank ever holds more than
+its own row block of the system. Note that only integration and assembly are
+partitioned: every rank still constructs the entire topology and sample, of
+which :func:`localsample` selects the local elements.
+
+Communication is delegated to a communicator object with attributes ``rank``
+and ``size`` and methods ``send(obj, dest)`` and ``recv(source)``. This
+protocol is a subset of that of the communicators of mpi4py, so that
+``mpi4py.MPI.COMM_WORLD`` can be used as is. For use on a single machine the
+:func:`pipes` context forks local processes that communicate via pipes.
+
+>>> from nutils import mesh, function
+>>> topo, geom = mesh.rectilinear([4])
+>>> basis = topo.basis('std', degree=1)
+>>> with pipes(2) as comm:
+...     sample = localsample(comm, topo.sample('gauss', 2))
+...     data = sample.integrate_sparse(function.outer(basis))
+...     A = assemble(comm, data)
+...     A.rows
+range(0, 5)
+"""
+
+from . import matrix, numeric, parallel, sparse
+import treelog
+import multiprocessing
+import contextlib
+import functools
+import builtins
+import numpy
+
+
+class PipeCommunicator:
+    '''Communicator between local processes that are connected via pipes.
+
+    Args
+    ----
+    rank : :class:`int`
+        Rank of the current process.
+    connections : :class:`dict`
+        Mapping from the ranks of all other processes to the corresponding
+        :class:`multiprocessing.connection.Connection` objects.
+    '''
+
+    def __init__(self, rank, connections):
+        self.rank = rank
+        self.size = len(connections) + 1
+        self._connections = connections
+
+    def send(self, obj, dest):
+        self._connections[dest].send(obj)
+
+    def recv(self, source):
+        return self._connections[source].recv()
+
+
+@contextlib.contextmanager
+def pipes(nprocs):
+    '''fork ``nprocs-1`` times and yield a :class:`PipeCommunicator`
+
+    Like :func:`nutils.parallel.fork`, the number of processes is capped by
+    :func:`nutils.parallel.maxprocs`, and the context is executed by a single
+    process if forking is not possible.'''
+
+    fork = parallel.fork(nprocs)
+    if not fork:
+        with fork as rank:
+            yield PipeCommunicator(rank, {})
+        return
+    nprocs = builtins.min(nprocs, parallel.maxprocs.current)
+    connections = {}
+    for i in builtins.range(nprocs):
+        for j in builtins.range(i+1, nprocs):
+            connections[i, j], connections[j, i] = multiprocessing.Pipe()
+    with fork as rank:
+        # Close the ends that belong to other ranks, such that a rank that
+        # exits prematurely causes its peers to receive EOF rather than block.
+        own = {}
+        for (i, j), connection in connections.items():
+            if i == rank:
+                own[j] = connection
+            else:
+                connection.close()
+        del connections
+        try:
+            yield PipeCommunicator(rank, own)
+        finally:
+            for connection in own.values():
+                connection.close()
+
+
+def localrange(comm, n):
+    '''Contiguous range of ``range(n)`` that is assigned to the current rank.'''
+
+    offsets = _offsets(n, comm.size)
+    return builtins.range(offsets[comm.rank], offsets[comm.rank+1])
+
+
+def localsample(comm, sample):
+    '''Subset of the elements of ``sample`` that is assigned to the current rank.'''
+
+    ielems = localrange(comm, sample.nelems)
+    return sample.take_elements(numpy.arange(ielems.start, ielems.stop))
+
+
+def assemble(comm, data):
+    '''Reduce the sparse contributions of all ranks into distributed form.
+
+    This is a collective operation: it must be called by all ranks, each with
+    the sparse data of its part of the domain, such as the result of
+    :meth:`nutils.sample.Sample.integrate_sparse` on :func:`localsample`.
+    Entries are sent to the rank that owns their row, following the same
+    partitioning as :func:`localrange`.
+
+    Args
+    ----
+    comm : communicator
+    data : sparse data of dimension 1 or 2
+
+    Returns
+    -------
+    :class:`numpy.ndarray` or :class:`RowBlockMatrix`
+        For one-dimensional data the dense segment of the vector that is owned
+        by the current rank, for two-dimensional data the distributed matrix.
+    '''
+
+    ndim = sparse.ndim(data)
+    if ndim not in (1, 2):
+        raise ValueError('assemble requires one or two dimensional sparse data')
+    shape = sparse.shape(data)
+    offsets = _offsets(shape[0], comm.size)
+    if ndim == 1:
+        (rows,), values = _redistribute(comm, data, offsets)
+        vector = numpy.zeros(offsets[comm.rank+1] - offsets[comm.rank], dtype=values.dtype)
+        vector[rows] = values  # indices are unique after dedup
+        return vector
+    return _rowblockmatrix(comm, data, offsets, _offsets(shape[1], comm.size))
+
+
+class RowBlockMatrix(matrix.Matrix):
+    '''Matrix that is distributed over ranks in blocks of contiguous rows.
+
+    Vectors that are multiplied with the matrix are likewise distributed: every
+    rank holds the segment of a vector that follows the partitioning of the
+    columns, and receives the segment of the product that follows the
+    partitioning of the rows. Both partitionings are those of
+    :func:`localrange`, unless the matrix is a submatrix or transpose of
+    another. All methods that communicate are collective operations, which
+    must be called by all ranks in the same order.
+
+    The arguments of :meth:`solve`, :meth:`submatrix` and the result of
+    :meth:`export` and :meth:`diagonal` are local segments as well. Systems
+    are solved by the Krylov methods 'cg' and 'bicgstab', of which the dot
+    products are summed over all ranks, with the optional 'diag'
+    preconditioner.
+
+    Args
+    ----
+    comm : communicator
+    block : :class:`nutils.matrix.Matrix`
+        The rows of the matrix that are owned by the current rank.
+    shape : :class:`tuple` of two integers
+        The shape of the entire matrix.
+    rowoffsets, coloffsets : :class:`numpy.ndarray` of integers or :any:`None`
+        Offsets of the row and column segments of all ranks, defaulting to the
+        partitioning of :func:`localrange`.
+    '''
+
+    def __init__(self, comm, block, shape, rowoffsets=None, coloffsets=None):
+        self.comm = comm
+        self.block = block
+        self._rowoffsets = _offsets(shape[0], comm.size) if rowoffsets is None else numpy.asarray(rowoffsets)
+        self._coloffsets = _offsets(shape[1], comm.size) if coloffsets is None else numpy.asarray(coloffsets)
+        self.rows = builtins.range(*self._rowoffsets[comm.rank:comm.rank+2])
+        self.cols = builtins.range(*self._coloffsets[comm.rank:comm.rank+2])
+        super().__init__(tuple(shape), block.dtype)
+        assert block.shape == (len(self.rows), shape[1])
+
+    def __reduce__(self):
+        raise TypeError('a distributed matrix cannot be pickled, use gather instead')
+
+    def _like(self, block):
+        return RowBlockMatrix(self.comm, block, self.shape, self._rowoffsets, self._coloffsets)
+
+    def __add__(self, other):
+        if not isinstance(other, RowBlockMatrix):
+            raise TypeError
+        if other.shape != self.shape or not numpy.array_equal(other._rowoffsets, self._rowoffsets) or not numpy.array_equal(other._coloffsets, self._coloffsets):
+            raise matrix.MatrixError('cannot add distributed matrices with different partitions')
+        return self._like(self.block + other.block)
+
+    def __mul__(self, other):
+        if not numeric.isnumber(other):
+            raise TypeError
+        return self._like(self.block * other)
+
+    def __neg__(self):
+        return self._like(-self.block)
+
+    def __matmul__(self, other):
+        '''Multiply with the local segment of a distributed vector.'''
+
+        if not isinstance(other, numpy.ndarray):
+            return NotImplemented
+        if len(other) != len(self.cols):
+            raise matrix.MatrixError('vector segment does not match the column partition')
+        compact, requested = self._exchange
+        return compact @ numpy.concatenate(_alltoall(self.comm, [other[indices] for indices in requested]))
+
+    @functools.cached_property
+    def _exchange(self):
+        # The local block with its columns restricted to those that have
+        # entries, and per rank the indices into the local vector segment
+        # that the rank needs for its own block. Like every method that
+        # communicates, this is a collective operation.
+        values, (rows, cols) = self.block.export('coo')
+        usedcols, cols = numpy.unique(cols, return_inverse=True)
+        compact = matrix.assemble(values, (rows, cols), (len(self.rows), len(usedcols)))
+        bounds = numpy.searchsorted(usedcols, self._coloffsets)
+        requested = _alltoall(self.comm, [usedcols[bounds[i]:bounds[i+1]] - self._coloffsets[i] for i in builtins.range(self.comm.size)])
+        return compact, requested
+
+    @property
+    def T(self):
+        values, (rows, cols) = self.block.export('coo')
+        data = numpy.empty(len(values), dtype=sparse.dtype(self.shape[::-1], values.dtype))
+        data['index']['i0'] = cols
+        data['index']['i1'] = rows + self.rows.start
+        data['value'] = values
+        return _rowblockmatrix(self.comm, data, self._coloffsets, self._rowoffsets)
+
+    def submatrix(self, rows, cols):
+        '''Create submatrix from the selected rows and columns.
+
+        Args
+        ----
+        rows : :class:`bool`/:class:`int` array selecting local rows for keeping
+        cols : :class:`bool`/:class:`int` array selecting local columns for keeping
+
+        Returns
+        -------
+        :class:`RowBlockMatrix`
+            Distributed matrix of reduced dimensions, partitioned such that every
+            rank owns the rows and columns that it kept.
+        '''
+
+        rows = numeric.asboolean(rows, len(self.rows))
+        cols = numeric.asboolean(cols, len(self.cols))
+        allcols = numpy.concatenate(_alltoall(self.comm, [cols] * self.comm.size))
+        nrows, ncols = numpy.array(_alltoall(self.comm, [(rows.sum(), cols.sum())] * self.comm.size)).T
+        rowoffsets = numpy.cumsum([0, *nrows])
+        coloffsets = numpy.cumsum([0, *ncols])
+        return RowBlockMatrix(self.comm, self.block.submatrix(rows, allcols), (int(rowoffsets[-1]), int(coloffsets[-1])), rowoffsets, coloffsets)
+
+    def export(self, form):
+        '''Export the local rows, with global column indices, to any of the
+        forms supported by :meth:`nutils.matrix.Matrix.export`.'''
+
+        return self.block.export(form)
+
+    def diagonal(self):
+        if not self._issquare:
+            raise matrix.MatrixError('failed to extract diagonal: matrix is not square')
+        data, indices, indptr = self.block.export('csr')
+        rows = numpy.arange(len(self.rows)).repeat(numpy.diff(indptr))
+        ondiag = indices == rows + self.rows.start
+        diag = numpy.zeros(len(self.rows), self.dtype)
+        diag[rows[ondiag]] = data[ondiag]
+        return diag
+
+    @property
+    def _issquare(self):
+        return numpy.array_equal(self._rowoffsets, self._coloffsets)
+
+    @treelog.withcontext
+    def solve(self, rhs=None, *, lhs0=None, constrain=None, solver='bicgstab', atol=0., rtol=0., **solverargs):
+        '''Solve system given right hand side vector and/or constraints.
+
+        Like :meth:`nutils.matrix.Matrix.solve`, except that ``rhs``,
+        ``lhs0``, ``constrain`` and the returned left hand side are the local
+        segments of distributed vectors, ``solver`` is 'cg' or 'bicgstab', and
+        the optional ``precon`` argument is 'diag' or :any:`None`. Row
+        constraints follow the column constraints.
+        '''
+
+        if not self._issquare:
+            raise matrix.MatrixError('matrix is not square: {}x{}'.format(*self.shape))
+        if rhs is None:
+            rhs = numpy.zeros(len(self.rows), self.dtype)
+        elif rhs.shape != (len(self.rows),):
+            raise matrix.MatrixError('right-hand side does not match the row partition')
+        lhs = numpy.zeros(len(self.cols), self.dtype) if lhs0 is None else numpy.array(lhs0, dtype=self.dtype)
+        if constrain is None:
+            return lhs + self._solver(rhs if lhs0 is None else rhs - self @ lhs, solver, atol=atol, rtol=rtol, **solverargs)
+        if constrain.dtype == bool:
+            J = ~constrain
+        else:
+            J = numpy.isnan(constrain)
+            lhs[~J] = constrain[~J]
+        lhs[J] += self.submatrix(J, J)._solver((rhs - self @ lhs)[J], solver, atol=atol, rtol=rtol, **solverargs)
+        return lhs
+
+    def _solver(self, rhs, solver, *, atol, rtol, precon=None, maxiter=None, **solverargs):
+        rhsnorm = self._norm(rhs)
+        atol = max(atol, rtol * rhsnorm)
+        if rhsnorm <= atol:
+            treelog.info('skipping solver because initial vector is within tolerance')
+            return numpy.zeros_like(rhs)
+        solver_method, solver_name = self._method('solver', solver)
+        precon = (lambda res: res) if precon is None else self.getprecon(precon)
+        treelog.info('solving {} dof system to {} using {} solver'.format(self.shape[0], 'tolerance {:.0e}'.format(atol) if atol else 'machine precision', solver_name))
+        lhs = solver_method(rhs, atol or numpy.finfo(float).eps * rhsnorm, precon, maxiter or 2 * self.shape[0], **solverargs)
+        resnorm = self._norm(rhs - self @ lhs)
+        treelog.info('solver returned with residual {:.0e}'.format(resnorm))
+        if resnorm > atol > 0:
+            raise matrix.ToleranceNotReached(lhs)
+        return lhs
+
+    def _solver_cg(self, rhs, atol, precon, maxiter):
+        lhs = numpy.zeros_like(rhs)
+        res = rhs.copy()
+        z = precon(res)
+        p = z.copy()
+        rz = self._dot(res, z)
+        for iiter in builtins.range(maxiter):
+            if self._norm(res) <= atol:
+                break
+            Ap = self @ p
+            alpha = rz / self._dot(p, Ap)
+            lhs += alpha * p
+            res -= alpha * Ap
+            z = precon(res)
+            rz, rzprev = self._dot(res, z), rz
+            p = z + (rz / rzprev) * p
+        return lhs
+
+    def _solver_bicgstab(self, rhs, atol, precon, maxiter):
+        lhs = numpy.zeros_like(rhs)
+        res = rhs.copy()
+        res0 = None
+        for iiter in builtins.range(maxiter):
+            resnorm = self._norm(res)
+            if resnorm <= atol:
+                # The updated residual drifts from the true residual, hence we
+                # verify convergence and restart from the true residual.
+                res = rhs - self @ lhs
+                resnorm = self._norm(res)
+                if resnorm <= atol:
+                    break
+                res0 = None
+            if res0 is not None:
+                rho, rhoprev = self._dot(res0, res), rho
+            if res0 is None or abs(rho) <= numpy.finfo(float).eps * res0norm * resnorm:
+                # (Re)start, which includes recovering from a breakdown.
+                res0 = res.conj()
+                res0norm = resnorm
+                rho, rhoprev = self._dot(res0, res), 1
+                alpha = omega = 1
+                p = v = numpy.zeros_like(rhs)
+            p = res + (rho / rhoprev * alpha / omega) * (p - omega * v)
+            phat = precon(p)
+            v = self @ phat
+            alpha = rho / self._dot(res0, v)
+            s = res - alpha * v
+            shat = precon(s)
+            t = self @ shat
+            tt = self._dot(t, t).real
+            omega = self._dot(t, s) / tt if tt else 0
+            lhs += alpha * phat + omega * shat
+            res = s - omega * t
+            if omega == 0:
+                res0 = None
+        return lhs
+
+    def _precon_diag(self):
+        diag = self.diagonal()
+        if _allsum(self.comm, int(not diag.all())):
+            raise matrix.MatrixError("building 'diag' preconditioner: diagonal has zero entries")
+        return numpy.reciprocal(diag).__mul__
+
+    def _dot(self, a, b):
+        return _allsum(self.comm, numpy.vdot(a, b))
+
+    def _norm(self, a):
+        return numpy.sqrt(self._dot(a, a).real)
+
+    def gather(self, root=0):
+        '''Collect the entire matrix on rank ``root``, returning ``None`` elsewhere.'''
+
+        values, (rows, cols) = self.block.export('coo')
+        coo = values, rows + self.rows.start, cols
+        if self.comm.rank != root:
+            self.comm.send(coo, dest=root)
+            return None
+        coos = [coo if rank == root else self.comm.recv(source=rank) for rank in builtins.range(self.comm.size)]
+        values, rows, cols = map(numpy.concatenate, zip(*coos))
+        return matrix.assemble(values, (rows, cols), self.shape)
+
+    def __repr__(self):
+        return '{}<{}x{}, rows {}:{}>'.format(type(self).__name__, *self.shape, self.rows.start, self.rows.stop)
+
+
+def _redistribute(comm, data, offsets):
+    '''helper function to send sparse entries to the ranks that own their row
+
+    Returns the deduplicated and pruned indices and values of the local rows,
+    with the row indices relative to the start of the local segment.'''
+
+    data = sparse.dedup(data)  # sorts entries by row
+    rowbounds = numpy.searchsorted(sparse.indices(data)[0], offsets)
+    received = _alltoall(comm, [data[rowbounds[i]:rowbounds[i+1]] for i in builtins.range(comm.size)])
+    data = sparse.prune(sparse.dedup(numpy.concatenate(received)), inplace=True)
+    indices, values, shape = sparse.extract(data)
+    rows, *others = (index.astype(int) for index in indices)
+    return (rows - offsets[comm.rank], *others), values
+
+
+def _rowblockmatrix(comm, data, rowoffsets, coloffsets):
+    '''helper function to form a :class:`RowBlockMatrix` from sparse data'''
+
+    shape = sparse.shape(data)
+    (rows, cols), values = _redistribute(comm, data, rowoffsets)
+    block = matrix.assemble(values, (rows, cols), (rowoffsets[comm.rank+1] - rowoffsets[comm.rank], shape[1]))
+    return RowBlockMatrix(comm, block, shape, rowoffsets, coloffsets)
+
+
+def _offsets(n, size):
+    '''helper function to partition ``range(n)`` into ``size`` contiguous blocks'''
+
+    return numpy.arange(size+1) * n // size
+
+
+def _alltoall(comm, objs):
+    '''helper function to send ``objs[i]`` to rank ``i`` and receive in turn
+
+    Pairs of ranks exchange their objects in lexicographical order of the
+    pair, the lower rank sending first, which rules out deadlocks regardless
+    of the buffering of the underlying communicator.'''
+
+    assert len(objs) == comm.size
+    received = list(objs)
+    for other in builtins.range(comm.size):
+        if other < comm.rank:
+            received[other] = comm.recv(source=other)
+            comm.send(objs[other], dest=other)
+        elif other > comm.rank:
+            comm.send(objs[other], dest=other)
+            received[other] = comm.recv(source=other)
+    return received
+
+
+def _allsum(comm, value):
+    '''helper function to sum ``value`` over all ranks
+
+    The values are summed in the order of the ranks, such that all ranks
+    obtain the identical result.'''
+
+    return builtins.sum(_alltoall(comm, [value] * comm.size))
+
+# vim:sw=4:sts=4:et
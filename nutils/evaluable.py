@@ -52,11 +52,65 @@ import subprocess
 import os
 import multiprocessing
 import hashlib
+import importlib
 import linecache
+import tracemalloc
+import json
+import weakref
 from io import StringIO
 
 graphviz = os.environ.get('NUTILS_GRAPHVIZ')
 
+@util.set_current
+@util.defaults_from_env
+def batchsize(batchsize: int = 1):
+    '''Number of loop iterations that :func:`compile` evaluates at once.
+
+    If larger than one, the bodies of :class:`LoopSum` and
+    :class:`LoopConcatenate` are vectorized, where supported, over batches of
+    this many iterations, which replaces per-iteration interpreter overhead by
+    larger numpy operations at the cost of memory.
+    '''
+
+    if not isinstance(batchsize, int) or batchsize < 1:
+        raise ValueError('batchsize requires a positive integer argument')
+    return batchsize
+
+
+@util.set_current
+@util.defaults_from_env
+def sparsebuffer(sparsebuffer: int = 0x10000000):
+    '''Number of bytes of sparse data that :func:`eval_sparse` deduplicates at once.
+
+    Sparse results larger than this many bytes are deduplicated while they are
+    assembled, in slabs of this size, such that the memory of the assembly is
+    bounded by the size of the deduplicated result plus one slab. These results
+    are returned sorted and deduplicated. Zero disables deduplication. See
+    :func:`nutils.sparse.fromchunks`.
+    '''
+
+    if not isinstance(sparsebuffer, int) or sparsebuffer < 0:
+        raise ValueError('sparsebuffer requires a non-negative integer argument')
+    return sparsebuffer
+
+
+@util.set_current
+@util.defaults_from_env
+def interntable(internsize: int = 0):
+    '''Number of recently constructed evaluables that are kept alive.
+
+    If nonzero, the ``.current`` attribute holds a :class:`nutils.types.InternTable`
+    of this size, such that graphs that are rebuilt, e.g. in every step of a
+    time stepping loop, reuse the nodes and hence the memoized simplifications
+    of the previous build. The kept nodes are released when the context exits.
+    Zero, the default, disables the table.
+    '''
+
+    if not isinstance(internsize, int) or internsize < 0:
+        raise ValueError('internsize requires a non-negative integer argument')
+    return types.InternTable(internsize) if internsize else None
+
+
 isevaluable = lambda arg: isinstance(arg, Evaluable)
 
 
@@ -137,6 +191,10 @@ class ExpensiveEvaluationWarning(warnings.NutilsInefficiencyWarning):
 class Evaluable(types.DataClass):
     'Base class'
 
+    @staticmethod
+    def __interntable__():
+        return interntable.current
+
     dependencies = util.abstract_property()
 
     @staticmethod
@@ -646,6 +704,7 @@ class Array(Evaluable):
     _unravel = lambda self, axis, shape: None
     _ravel = lambda self, axis: None
     _loopsum = lambda self, loop_index: None  # NOTE: type of `loop_index` is `_LoopIndex`
+    _vectorize = lambda self, loop_index, vectorize: None  # NOTE: see function `_vectorize`
     _real = lambda self: None
     _imag = lambda self: None
     _conjugate = lambda self: None
@@ -1039,6 +1098,10 @@ class InsertAxis(Array):
     def _loopsum(self, index):
         return InsertAxis(loop_sum(self.func, index), self.length)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose.to_end(InsertAxis(func, self.length), -2)
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -1233,6 +1296,10 @@ class Transpose(Array):
     def _loopsum(self, index):
         return Transpose(loop_sum(self.func, index), self.axes)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose(func, self.axes + (self.ndim,))
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -1284,6 +1351,10 @@ class Product(Array):
     def _takediag(self, axis1, axis2):
         return product(_takediag(self.func, axis1, axis2), self.ndim-2)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Product(Transpose.to_end(func, -2))
+
 
 class Inverse(Array):
     '''
@@ -1343,6 +1414,10 @@ class Inverse(Array):
         if axis < self.ndim-2:
             return Inverse(unravel(self.func, axis, shape))
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose.to_end(Inverse(Transpose.from_end(func, self.ndim-2)), self.ndim-2)
+
 
 class Determinant(Array):
 
@@ -1381,6 +1456,10 @@ class Determinant(Array):
     def _takediag(self, axis1, axis2):
         return determinant(_takediag(self.func, axis1, axis2), (self.ndim-2, self.ndim-1))
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose.to_end(Determinant(Transpose.from_end(func, self.ndim)), self.ndim)
+
 
 class Multiply(Array):
 
@@ -1568,6 +1647,11 @@ class Multiply(Array):
         extrema = [b1 and b2 and b1 * b2 for b1 in func1._intbounds for b2 in func2._intbounds]
         return min(extrema), max(extrema)
 
+    def _vectorize(self, index, vectorize):
+        funcs = tuple(map(vectorize, self.funcs))
+        if all(func is not None for func in funcs):
+            return Multiply(types.frozenmultiset(funcs))
+
 
 class Add(Array):
 
@@ -1718,6 +1802,11 @@ class Add(Array):
         lowers, uppers = zip(*[f._intbounds for f in self._terms])
         return builtins.sum(lowers), builtins.sum(uppers)
 
+    def _vectorize(self, index, vectorize):
+        funcs = tuple(map(vectorize, self.funcs))
+        if all(func is not None for func in funcs):
+            return Add(types.frozenmultiset(funcs))
+
 
 class Einsum(Array):
 
@@ -1778,6 +1867,27 @@ class Einsum(Array):
                 continue
             return Einsum(self.args[:i]+(arg.func,)+self.args[i+1:], self.args_idx[:i]+(idx,)+self.args_idx[i+1:], self.out_idx)
 
+    def _intbounds_impl(self):
+        # Bounds of the product of all arguments, multiplied by the bounds of
+        # the number of summed terms.
+        bounds = 1, 1
+        for arg in self.args:
+            extrema = [b1 and b2 and b1 * b2 for b1 in bounds for b2 in arg._intbounds]
+            bounds = min(extrema), max(extrema)
+        lengths = {i: length for idx, arg in zip(self.args_idx, self.args) for i, length in zip(idx, arg.shape)}
+        for i, length in lengths.items():
+            if i not in self.out_idx:
+                lower_length, upper_length = length._intbounds
+                extrema = [b1 and b2 and b1 * b2 for b1 in bounds for b2 in (lower_length, upper_length)]
+                bounds = min(0, *extrema) if lower_length == 0 else min(extrema), max(0, *extrema) if lower_length == 0 else max(extrema)
+        return bounds
+
+    def _vectorize(self, index, vectorize):
+        args = tuple(map(vectorize, self.args))
+        batch_idx = builtins.max(itertools.chain(self.out_idx, *self.args_idx), default=-1) + 1
+        if all(arg is not None for arg in args) and batch_idx < 26:
+            return Einsum(args, tuple((*idx, batch_idx) for idx in self.args_idx), (*self.out_idx, batch_idx))
+
 
 class Sum(Array):
 
@@ -1863,6 +1973,10 @@ class Sum(Array):
     def _takediag(self, axis1, axis2):
         return sum(_takediag(self.func, axis1, axis2), -2)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Sum(Transpose.to_end(func, -2))
+
 
 class TakeDiag(Array):
 
@@ -1918,6 +2032,10 @@ class TakeDiag(Array):
         if axis != self.ndim - 1 and (simple := self.func._sum(axis)):
             return TakeDiag(simple)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose.to_end(TakeDiag(Transpose.from_end(func, self.ndim-1)), self.ndim-1)
+
     def _intbounds_impl(self):
         return self.func._intbounds
 
@@ -1979,6 +2097,19 @@ class Take(Array):
         if axis < self.func.ndim - 1 and (simple := self.func._sum(axis)):
             return Take(simple, self.indices)
 
+    def _vectorize(self, index, vectorize):
+        if index not in self.indices.arguments:
+            if (func := vectorize(self.func)) is not None:
+                return _take(func, self.indices, self.func.ndim-1)
+        elif index not in self.func.arguments:
+            if (indices := vectorize(self.indices)) is not None:
+                return Take(self.func, indices)
+        elif (func := vectorize(self.func)) is not None and (indices := vectorize(self.indices)) is not None:
+            # Take from the raveled batch and take axes, offsetting the
+            # indices of every batch by the length of the take axis.
+            offsets = prependaxes(Range(func.shape[-1]) * self.func.shape[-1], self.indices.shape)
+            return Take(Ravel(Transpose.to_end(func, -2)), indices + offsets)
+
     def _intbounds_impl(self):
         return self.func._intbounds
 
@@ -2057,6 +2188,12 @@ class Power(Array):
     def _unravel(self, axis, shape):
         return Power(unravel(self.func, axis, shape), unravel(self.power, axis, shape))
 
+    def _vectorize(self, index, vectorize):
+        func = vectorize(self.func)
+        power = vectorize(self.power)
+        if func is not None and power is not None:
+            return Power(func, power)
+
 
 class Pointwise(Array):
     '''
@@ -2125,6 +2262,11 @@ class Pointwise(Array):
     def _unravel(self, axis, shape):
         return self._newargs(*[unravel(arg, axis, shape) for arg in self.dependencies])
 
+    def _vectorize(self, index, vectorize):
+        args = tuple(map(vectorize, self.dependencies))
+        if all(arg is not None for arg in args):
+            return self._newargs(*args)
+
 
 class Holomorphic(Pointwise):
     '''
@@ -2799,6 +2941,10 @@ class Sign(Array):
     def _unravel(self, axis, shape):
         return Sign(unravel(self.func, axis, shape))
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Sign(func)
+
     def _derivative(self, var, seen):
         return Zeros(self.shape + var.shape, dtype=self.dtype)
 
@@ -3201,6 +3347,18 @@ class Inflate(Array):
         if self.dofmap.isconstant and _isunique(self.dofmap.eval()):
             return Inflate(Sign(self.func), self.dofmap, self.length)
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is None:
+            return
+        keep_dim = self.func.ndim - self.dofmap.ndim
+        if index not in self.dofmap.arguments:
+            return Transpose.to_end(Inflate(Transpose.from_end(func, keep_dim), self.dofmap, self.length), keep_dim)
+        if (dofmap := vectorize(self.dofmap)) is not None:
+            # Inflate into the raveled lengths and batch axes, such that every
+            # batch has its own target range.
+            nbatch = dofmap.shape[-1]
+            return Unravel(Inflate(func, dofmap * nbatch + prependaxes(Range(nbatch), self.dofmap.shape), self.length * nbatch), self.length, nbatch)
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -3374,6 +3532,10 @@ class Diagonalize(Array):
     def _loopsum(self, index):
         return Diagonalize(loop_sum(self.func, index))
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return Transpose.to_end(Diagonalize(Transpose.to_end(func, -2)), self.ndim-2)
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -3410,6 +3572,10 @@ class Guard(Array):
     def _derivative(self, var, seen):
         return Guard(derivative(self.fun, var, seen))
 
+    def _vectorize(self, index, vectorize):
+        if (fun := vectorize(self.fun)) is not None:
+            return Guard(fun)
+
 
 class Find(Array):
     'indices of boolean index vector'
@@ -3713,6 +3879,10 @@ class Ravel(Array):
     def _loopsum(self, index):
         return Ravel(loop_sum(self.func, index))
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return ravel(func, self.ndim-1)
+
     @property
     def _unaligned(self):
         unaligned, where = unalign(self.func, naxes=self.ndim - 1)
@@ -3777,6 +3947,10 @@ class Unravel(Array):
         if axis < self.ndim - 2:
             return Unravel(sum(self.func, axis), *self.shape[-2:])
 
+    def _vectorize(self, index, vectorize):
+        if (func := vectorize(self.func)) is not None:
+            return unravel(func, self.ndim-2, self.shape[-2:])
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -3834,6 +4008,19 @@ class RavelIndex(Array):
         else:
             return RavelIndex(self.ia, unravel(self.ib, axis-self.ia.ndim, shape), self.na, self.nb)
 
+    def _vectorize(self, index, vectorize):
+        if index in self.na.arguments or index in self.nb.arguments:
+            return
+        if index not in self.ia.arguments:
+            if (ib := vectorize(self.ib)) is not None:
+                return RavelIndex(self.ia, ib, self.na, self.nb)
+        elif index not in self.ib.arguments:
+            if (ia := vectorize(self.ia)) is not None:
+                return Transpose.to_end(RavelIndex(ia, self.ib, self.na, self.nb), self.ia.ndim)
+        elif (ia := vectorize(self.ia)) is not None and (ib := vectorize(self.ib)) is not None:
+            ia = Transpose.to_end(appendaxes(ia, self.ib.shape), self.ia.ndim)
+            return ia * self.nb + prependaxes(ib, self.ia.shape)
+
     def _intbounds_impl(self):
         nbmin, nbmax = self.nb._intbounds
         iamin, iamax = self.ia._intbounds
@@ -3917,6 +4104,10 @@ class InRange(Array):
         upper = min(upper_index, max(0, upper_length - 1))
         return max(0, min(lower_index, upper)), upper
 
+    def _vectorize(self, index, vectorize):
+        if index not in self.length.arguments and (indices := vectorize(self.index)) is not None:
+            return InRange(indices, self.length)
+
 
 class Polyval(Array):
     '''Evaluate a polynomial
@@ -3990,6 +4181,16 @@ class Polyval(Array):
             where = *where_points, *(axis + self.points.ndim - 1 for axis in where_coeffs)
             return align(Polyval(coeffs, points), where, self.shape)
 
+    def _vectorize(self, index, vectorize):
+        # The leading axes of `points` and `coeffs` form an outer product, hence
+        # only one of both can carry the batch axis.
+        if index not in self.coeffs.arguments:
+            if (points := vectorize(self.points)) is not None:
+                return Transpose.to_end(Polyval(self.coeffs, Transpose.to_end(points, -2)), self.points.ndim-1)
+        elif index not in self.points.arguments:
+            if (coeffs := vectorize(self.coeffs)) is not None:
+                return Polyval(Transpose.to_end(coeffs, -2), self.points)
+
 
 class PolyDegree(Array):
     '''Returns the degree of a polynomial given the number of coefficients and number of variables
@@ -4467,16 +4668,20 @@ class TransformCoords(Array):
         return *self.coords.shape[:-1], constant(target_dim)
 
     def evalf(self, index, coords):
-        chain = self.source[index.__index__()]
-        if self.target is not None:
-            _, chain = self.target.index_with_tail(chain)
-        return functools.reduce(lambda c, t: t.apply(c), reversed(chain), coords)
+        _, linear, offset = self.source.affine(index.__index__(), self.target)
+        return numpy.dot(coords, linear.T) + offset
 
     def _derivative(self, var, seen):
         linear = TransformLinear(self.target, self.source, self.index)
         dcoords = derivative(self.coords, var, seen)
         return einsum('ij,AjB->AiB', linear, dcoords, A=self.coords.ndim - 1, B=var.ndim)
 
+    def _vectorize(self, index, vectorize):
+        if (indices := vectorize(self.index)) is not None and (coords := vectorize(self.coords)) is not None:
+            linear = _TransformAffines(self.target, self.source, indices, 'linear')
+            offset = _TransformAffines(self.target, self.source, indices, 'offset')
+            return einsum('ijk,Ajk->Aik', linear, coords, A=coords.ndim - 2) + prependaxes(offset, coords.shape[:-2])
+
     def _simplified(self):
         if self.target == self.source:
             return self.coords
@@ -4517,7 +4722,7 @@ class TransformIndex(Array):
 
     def evalf(self, index):
         if self.target is not None:
-            index, _ = self.target.index_with_tail(self.source[index.__index__()])
+            index, _, _ = self.source.affine(index.__index__(), self.target)
         else:
             index = 0
         return numpy.array(index)
@@ -4532,6 +4737,10 @@ class TransformIndex(Array):
         elif self.target == self.source:
             return self.index
 
+    def _vectorize(self, index, vectorize):
+        if self.target is not None and (indices := vectorize(self.index)) is not None:
+            return _TransformAffines(self.target, self.source, indices, 'index')
+
 
 class TransformLinear(Array):
     '''Linear part of a coordinate transformation
@@ -4567,18 +4776,54 @@ class TransformLinear(Array):
         return constant(target_dim), constant(self.source.fromdims)
 
     def evalf(self, index):
-        chain = self.source[index.__index__()]
-        if self.target is not None:
-            _, chain = self.target.index_with_tail(chain)
-        if chain:
-            return functools.reduce(lambda r, i: i @ r, (item.linear for item in reversed(chain)))
-        else:
-            return numpy.eye(self.source.fromdims)
+        _, linear, _ = self.source.affine(index.__index__(), self.target)
+        return linear.copy()
 
     def _simplified(self):
         if self.target == self.source:
             return diagonalize(ones((constant(self.source.fromdims),), dtype=float))
 
+    def _vectorize(self, index, vectorize):
+        if (indices := vectorize(self.index)) is not None:
+            return _TransformAffines(self.target, self.source, indices, 'linear')
+
+
+class _TransformAffines(Array):
+    # The `part` 'index', 'linear' or 'offset' of the composed affine maps of
+    # the transforms at a vector of indices, with the indices as last axis:
+    # the vectorized form of TransformIndex, TransformLinear and the offset of
+    # TransformCoords, gathered from the tables of `Transforms.affines`.
+
+    target: typing.Optional['transformseq.Transforms']
+    source: 'transformseq.Transforms'
+    indices: Array
+    part: str
+
+    def __post_init__(self):
+        assert self.indices.dtype == int and self.indices.ndim == 1 and self.part in ('index', 'linear', 'offset')
+
+    @property
+    def dependencies(self):
+        return self.indices,
+
+    @property
+    def dtype(self):
+        return int if self.part == 'index' else float
+
+    @cached_property
+    def shape(self):
+        target_dim = constant(self.source.todims if self.target is None else self.target.fromdims)
+        return dict(index=(), linear=(target_dim, constant(self.source.fromdims)), offset=(target_dim,))[self.part] + self.indices.shape
+
+    def evalf(self, indices):
+        tindices, linear, offset = self.source.affines(indices, self.target)
+        return numpy.moveaxis(dict(index=tindices, linear=linear, offset=offset)[self.part], 0, -1)
+
+    def _intbounds_impl(self):
+        if self.part == 'index':
+            return 0, (1 if self.target is None else len(self.target)) - 1
+        return super()._intbounds_impl()
+
 
 class TransformBasis(Array):
     '''Vector basis for the root and a source coordinate system
@@ -4798,7 +5043,17 @@ class LoopSum(Loop):
         index_block_id = builder.get_block_id(self.index)
         body_block_id = builtins.max(index_block_id, builder.get_block_id(self.func))
         assert body_block_id[:-1] == index_block_id[:-1]
-        builder.compile_with_out(self.func, out, body_block_id, 'iadd')
+        if builder.is_shared(out) and (worker_blocks := builder.get_worker_blocks_for_evaluable(self, self.index)) is not None:
+            # The loop is distributed over workers that share `out`. Rather
+            # than synchronizing every update of `out`, every worker
+            # accumulates a private partial sum which is added to `out` once,
+            # when the worker exits.
+            worker_init, worker_exit = worker_blocks
+            partial = worker_init.eval(_pyast.Variable('numpy').get_attr('zeros').call(builder.compile(self.shape), dtype=_pyast.Variable(self.dtype.__name__)))
+            builder.compile_with_out(self.func, partial, body_block_id, 'iadd')
+            worker_exit.array_iadd(out, partial)
+        else:
+            builder.compile_with_out(self.func, out, body_block_id, 'iadd')
 
     def _derivative(self, var, seen):
         return loop_sum(derivative(self.func, var, seen), self.index)
@@ -4841,6 +5096,10 @@ class LoopSum(Loop):
         if self.index not in other.arguments:
             return loop_sum(self.func * other, self.index)
 
+    def _vectorize(self, index, vectorize):
+        if index not in self.length.arguments and (func := vectorize(self.func)) is not None:
+            return LoopSum(self.loop_id, self.length, func, func.shape)
+
     @cached_property
     @verify_sparse_chunks
     def _assparse(self):
@@ -5141,18 +5400,20 @@ def _make_loop_ids_unique(funcs: typing.Tuple[Evaluable, ...]) -> typing.Tuple[E
 
 class _Stats:
 
-    def __init__(self, ncalls: int = 0, time: int = 0) -> None:
+    def __init__(self, ncalls: int = 0, time: int = 0, nbytes: int = 0, peak: int = 0) -> None:
         self.ncalls = ncalls
         self.time = time
+        self.nbytes = nbytes
+        self.peak = peak
         self._start = None
 
     def __repr__(self):
-        return '_Stats(ncalls={}, time={})'.format(self.ncalls, self.time)
+        return '_Stats(ncalls={}, time={}, nbytes={}, peak={})'.format(self.ncalls, self.time, self.nbytes, self.peak)
 
     def __add__(self, other):
         if not isinstance(other, _Stats):
             return NotImplemented
-        return _Stats(self.ncalls+other.ncalls, self.time+other.time)
+        return type(self)(self.ncalls+other.ncalls, self.time+other.time, self.nbytes+other.nbytes, builtins.max(self.peak, other.peak))
 
     def __enter__(self) -> None:
         self._start = time.perf_counter_ns()
@@ -5161,6 +5422,74 @@ class _Stats:
         self.time += time.perf_counter_ns() - self._start
         self.ncalls += 1
 
+    def record(self, value) -> None:
+        # Accumulates the size of the output `value` of an evaluable.
+        self.nbytes += getattr(value, 'nbytes', 0)
+
+
+class _MemoryStats(_Stats):
+    # Like `_Stats`, but additionally measures the peak temporary allocation
+    # with `tracemalloc`, which must be tracing, and requires
+    # `tracemalloc.reset_peak`, which is available as of Python 3.9. Since
+    # the traced memory and its peak are global to the process, the peak is
+    # unreliable if evaluables are evaluated concurrently in threads.
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._memory = None
+
+    def __enter__(self) -> None:
+        if hasattr(tracemalloc, 'reset_peak'):
+            self._memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        super().__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        super().__exit__(*exc_info)
+        if self._memory is not None:
+            self.peak = builtins.max(self.peak, tracemalloc.get_traced_memory()[1] - self._memory)
+            self._memory = None
+
+
+class _WorkerStats:
+    # Accumulator for the `_Stats` of the workers of a parallel loop. The
+    # stats are stored in shared memory, such that the stats of forked workers
+    # survive the workers. The workers should call `add` while holding a lock.
+
+    def __init__(self, keys: typing.Sequence[Evaluable]) -> None:
+        self._keys = keys
+        self._data = parallel.shzeros((len(keys), 4), dtype=numpy.int64)
+
+    def add(self, stats: typing.Mapping[Evaluable, _Stats]) -> None:
+        for row, key in zip(self._data, self._keys):
+            if (s := stats.get(key)) is not None:
+                row[:3] += s.ncalls, s.time, s.nbytes
+                row[3] = builtins.max(row[3], s.peak)
+
+    def merge_into(self, stats: typing.MutableMapping[Evaluable, _Stats]) -> None:
+        for row, key in zip(self._data, self._keys):
+            if row.any():
+                stats[key] += _Stats(*map(int, row))
+
+
+@contextlib.contextmanager
+def _profile(memory: bool = False):
+    # Yields an empty mapping of evaluables to `_Stats`, or, if `memory` is
+    # true, to `_MemoryStats` while `tracemalloc` is tracing memory
+    # allocations. Tracing slows down evaluation considerably, hence it is
+    # limited to `compile(..., stats='profile')`.
+    if not memory:
+        yield collections.defaultdict(_Stats)
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        yield collections.defaultdict(_MemoryStats)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
 # FUNCTIONS
 
 
@@ -5556,6 +5885,81 @@ def loop_concatenate(func, index):
     return LoopConcatenate(index.loop_id, index.length, func, start, stop, concat_length)
 
 
+_vectorize_loop_ids = itertools.count()
+
+
+def _vectorize(func: Array, index: _LoopIndex, batch: Array) -> typing.Optional[Array]:
+    # Returns `func` with `index` replaced by every entry of the vector `batch`,
+    # stacked along a new last axis, or `None` if `func` cannot be vectorized.
+    # The batch axis is propagated through the graph by the `_vectorize`
+    # methods of the evaluables, which receive a memoized version of this
+    # function to vectorize their dependencies. Evaluables that do not
+    # support a batch axis are evaluated in a loop over the batch, such that
+    # only these evaluables pay the per-iteration overhead.
+
+    cache = {}
+
+    def vectorize(func):
+        if func in cache:
+            return cache[func]
+        if any(index in n.arguments for n in func.shape):
+            vectorized = None
+        elif index not in func.arguments:
+            vectorized = InsertAxis(func, batch.shape[0])
+        elif func == index:
+            vectorized = batch
+        else:
+            vectorized = func._vectorize(index, vectorize)
+            if vectorized is None and not isinstance(func, Loop) and all(isinstance(arg, Array) for arg in func.dependencies):
+                args = {arg: vectorize(arg) for arg in func.dependencies}
+                if all(arg is not None for arg in args.values()):
+                    batch_index = _LoopIndex(_LoopId(f'{index.loop_id}/vectorize{next(_vectorize_loop_ids)}'), batch.shape[0])
+                    body = util.shallow_replace(lambda arg: Take(args[arg], batch_index) if isinstance(arg, Array) and arg in args else None, func)
+                    vectorized = loop_concatenate(InsertAxis(body, constant(1)), batch_index)
+        cache[func] = vectorized
+        return vectorized
+
+    return vectorize(func)
+
+
+@util.shallow_replace
+def _batch_loops(obj, batchsize: int):
+    # Replaces every `LoopSum` and `LoopConcatenate` in `obj` of which the
+    # body can be vectorized by a loop over batches of `batchsize` iterations,
+    # followed by a single batch for the remaining iterations. Nested loops
+    # that are not vectorized along with their parent are batched
+    # individually.
+
+    if not isinstance(obj, (LoopSum, LoopConcatenate)):
+        return
+    func = _batch_loops(obj.func, batchsize)
+    length = obj.length
+    if isinstance(obj, LoopSum):
+        unbatched = LoopSum(obj.loop_id, length, func, obj.shape)
+    else:
+        unbatched = LoopConcatenate(obj.loop_id, length, func, obj.start, obj.stop, obj.concat_length)
+    batch_length = constant(batchsize)
+    nbatches = FloorDivide(length, batch_length)
+    remainder = length % batch_length
+    batch_index = _LoopIndex(_LoopId(f'{obj.loop_id}/batch'), nbatches)
+    batches = []
+    if not length.isconstant or int(length) >= batchsize:
+        batches.append((Range(batch_length) + batch_index * batch_length, batch_index))
+    if not length.isconstant or int(length) % batchsize:
+        batches.append((Range(remainder) + (length - remainder), None))
+    parts = []
+    for batch, batch_index in batches:
+        if (vectorized := _vectorize(func, obj.index, batch)) is None:
+            return unbatched
+        part = Sum(vectorized) if isinstance(obj, LoopSum) else Ravel(Transpose.to_end(vectorized, -2))
+        if batch_index is not None:
+            part = loop_sum(part, batch_index) if isinstance(obj, LoopSum) else loop_concatenate(part, batch_index)
+        parts.append(part)
+    if isinstance(obj, LoopSum):
+        return util.sum(parts)
+    return parts[0] if len(parts) == 1 else concatenate(parts, axis=-1)
+
+
 @util.shallow_replace
 def replace_arguments(value, arguments):
     '''Replace :class:`Argument` objects in ``value``.
@@ -5691,27 +6095,21 @@ def eval_sparse(funcs: AsEvaluableArray, **arguments: typing.Mapping[str, numpy.
     Returns
     -------
     results : :class:`tuple` of sparse data arrays
+        Sparse data larger than :func:`sparsebuffer` is sorted and
+        deduplicated, smaller sparse data may contain duplicate indices.
     '''
 
     funcs = [func.as_evaluable_array for func in funcs]
     shape_chunks = compile(tuple(builtins.sum(func.simplified._assparse, func.shape) for func in funcs))
-    for func, args in zip(funcs, shape_chunks(**arguments)):
+    results = list(shape_chunks(**arguments))
+    for ifunc, func in enumerate(funcs):
+        args, results[ifunc] = results[ifunc], None
         shape = tuple(map(int, args[:func.ndim]))
         chunks = [args[i:i+func.ndim+1] for i in range(func.ndim, len(args), func.ndim+1)]
-        length = builtins.sum(values.size for *indices, values in chunks)
-        data = numpy.empty((length,), dtype=sparse.dtype(shape, func.dtype))
-        start = 0
-        for *indices, values in chunks:
-            stop = start + values.size
-            d = data[start:stop].reshape(values.shape)
-            d['value'] = values
-            for idim, ii in enumerate(indices):
-                d['index']['i'+str(idim)] = ii
-            start = stop
-        yield data
+        del args
+        yield sparse.fromchunks(chunks, shape, func.dtype, sparsebuffer.current)
 
 
-@functools.lru_cache(32)
 def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = None, cache_const_intermediates: bool = True):
     '''Returns a callable that evaluates ``func``.
 
@@ -5724,18 +6122,38 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
     the callable using keywords arguments. Arguments that are unknown to
     ``func`` are silently ignored.
 
+    If caching is enabled via :func:`nutils.cache.enable`, the generated code
+    and its constants are stored in the cache directory, keyed by the hash of
+    ``func`` and the compilation options, such that a subsequent compilation
+    of an equal ``func`` skips simplification and code generation.
+
+    If :func:`batchsize` is set larger than one, loops of which the body
+    supports an additional batch axis are evaluated for that many iterations
+    at once.
+
     Args
     ----
     func : :class:`Evaluable` or (possibly nested) tuples of :class:`Evaluable`\\s
         The function or functions to compile.
     simplify : :class:`bool`
         If true, ``func`` will be simplified before compilation.
-    stats : ``'log'`` or ``None``
-        If ``'log'`` the compiled function will log the durations of individual
-        :class:`Evaluable`\\s referenced by ``func``.
+    stats : ``'log'``, ``'profile'`` or ``None``
+        If ``'log'`` the compiled function will log the durations, the number
+        of calls and the size of the outputs of individual
+        :class:`Evaluable`\\s referenced by ``func``. If ``'profile'`` the
+        compiled function additionally measures the peak temporary allocation
+        using :mod:`tracemalloc`, which slows down the evaluation, and writes
+        these statistics for every :class:`Evaluable` to ``stats.json`` and,
+        in the folded stack format of flame graph tools, to ``stats.folded``.
+        Since :mod:`tracemalloc` measures the memory of the entire process,
+        the peak allocation is unreliable for parallel loops evaluated with
+        :func:`nutils.parallel.backend` ``'thread'``.
     cache_const_intermediates : :class:`bool`
         If true, the returned callable caches parts of ``func`` that can be
-        reused for a second call.
+        reused for a second call. The cached results are shared with other
+        compiled callables that contain the same constant parts, such that
+        these are evaluated only once. The generated code is not shared: every
+        compilation simplifies and generates code for all of ``func``.
 
     Returns
     -------
@@ -5763,6 +6181,255 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
     (3, (6, 4))
     '''
 
+    if stats is None:
+        stats = 'log' if graphviz else False
+    elif stats not in ('log', 'profile', False):
+        raise ValueError(f'`stats` must be `None`, `False`, `"log"` or `"profile"` but got {stats!r}')
+
+    # The generated script depends on `parallel.maxprocs` via the decision to
+    # parallelize the outer-most loops and on `batchsize`, hence we pass these
+    # on explicitly such that they become part of the key of both the memory
+    # and the persistent cache.
+    return _compile(func, simplify, stats, cache_const_intermediates, parallel.maxprocs.current > 1, batchsize.current)
+
+
+# The modules and helpers that the generated code refers to by name, as
+# `name: (module, attribute)` with attribute `None` for the module itself. Both
+# the globals of `compile` and the imports of `compile_module` are derived from
+# this mapping.
+_script_imports = {
+    'collections': ('collections', None),
+    'log_stats': (__name__, '_log_stats'),
+    'multiprocessing': ('multiprocessing', None),
+    'numeric': (numeric.__name__, None),
+    'numpy': ('numpy', None),
+    'parallel': (parallel.__name__, None),
+    'poly': ('nutils_poly', None),
+    'profile': (__name__, '_profile'),
+    'Stats': (__name__, '_Stats'),
+    'MemoryStats': (__name__, '_MemoryStats'),
+    'WorkerStats': (__name__, '_WorkerStats'),
+    'shared_intermediates': (__name__, '_shared_intermediates'),
+    'treelog': ('treelog', None),
+}
+
+
+@functools.lru_cache(32)
+def _compile(func, simplify: bool, stats, cache_const_intermediates: bool, allow_parallel: bool, batchsize: int):
+    name, script, constants = _compile_script(func, simplify, stats, cache_const_intermediates, allow_parallel, batchsize)
+
+    if debug_flags.compile:
+        print(script)
+
+    # Make sure we can see `script` in tracebacks and `pdb`.
+    # From: https://stackoverflow.com/a/39625821
+    linecache.cache[name] = (len(script), None, [line+'\n' for line in script.splitlines()], name)
+
+    # Compile.
+    globals = dict(constants)
+    for key, (module, attr) in _script_imports.items():
+        globals[key] = importlib.import_module(module) if attr is None else getattr(importlib.import_module(module), attr)
+    eval(builtins.compile(script, name, 'exec'), globals)
+    return globals['compiled']
+
+
+compile.cache_clear = _compile.cache_clear
+
+
+def compile_module(func, path, /, *, simplify: bool = True, stats: typing.Optional[str] = False, cache_const_intermediates: bool = True):
+    '''Writes the code that evaluates ``func`` to an importable Python module.
+
+    The generated module at ``path`` defines a function ``compiled`` that
+    behaves like the callable returned by :func:`compile`: it takes the values
+    of the :class:`Argument`\\s of ``func`` as keyword arguments and returns a
+    result that matches the structure of ``func``. The constants of ``func``
+    are stored next to the module, in a file with the same name and suffix
+    ``.npz``, and are loaded when the module is imported. Importing the module
+    thus avoids the construction, simplification and compilation of ``func``.
+    Evaluables that the generated code calls are reconstructed on import from
+    the arguments they were constructed with. If these contain objects that
+    cannot be written as data, a :class:`ValueError` is raised.
+
+    The generated module depends on :mod:`nutils` and can only be expected to
+    work with the version of :mod:`nutils` that generated it.
+
+    Args
+    ----
+    func : :class:`Evaluable` or (possibly nested) tuples of :class:`Evaluable`\\s
+        The function or functions to compile.
+    path : :class:`str` or :class:`os.PathLike`
+        The path of the module, typically with suffix ``.py``.
+    simplify : :class:`bool`
+        If true, ``func`` will be simplified before compilation.
+    stats : ``'log'``, ``'profile'`` or ``False``
+        See :func:`compile`.
+    cache_const_intermediates : :class:`bool`
+        If true, the function ``compiled`` caches parts of ``func`` that can
+        be reused for a second call.
+
+    Examples
+    --------
+
+    >>> import importlib.util, os, tempfile
+    >>> arg = Argument('arg', (), int)
+    >>> f = arg + constant(1)
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     path = os.path.join(tmpdir, 'kernel.py')
+    ...     compile_module(f, path)
+    ...     spec = importlib.util.spec_from_file_location('kernel', path)
+    ...     kernel = importlib.util.module_from_spec(spec)
+    ...     spec.loader.exec_module(kernel)
+    >>> kernel.compiled(arg=1)
+    2
+    '''
+
+    if stats not in ('log', 'profile', False):
+        raise ValueError(f'`stats` must be `False`, `"log"` or `"profile"` but got {stats!r}')
+
+    name, script, globals = _compile_script(func, simplify, stats, cache_const_intermediates, parallel.maxprocs.current > 1, batchsize.current)
+
+    # Collect the names that are referenced by the script, including those in
+    # nested functions, and drop the unused globals.
+    names = set()
+    codes = [builtins.compile(script, name, 'exec')]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if isinstance(const, builtin_types.CodeType))
+
+    # Plain Python scalars are written as literals and arrays are stored in
+    # the npz file. Evaluables that are called by the script, and the tuples of
+    # evaluables that key the shared intermediates and statistics, are
+    # reconstructed from their constructor arguments. Other objects are
+    # rejected.
+    writer = _ModuleWriter()
+    for key, value in sorted(globals.items()):
+        if key in names:
+            writer.assign(key, value)
+
+    path = os.fspath(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    lines = [f'# Generated by nutils.evaluable.compile_module from {name}.', 'import os']
+    for key, (module, attr) in _script_imports.items():
+        if attr is not None:
+            lines.append(f'from {module} import {attr} as {key}')
+        elif key != module:
+            lines.append(f'import {module} as {key}')
+        else:
+            lines.append(f'import {module}')
+    lines.extend(f'import {module}' for module in sorted(writer.modules))
+    if writer.arrays:
+        lines.append(f'with numpy.load(os.path.join(os.path.dirname(__file__), {stem + ".npz"!r})) as _constants:')
+        for key in writer.arrays:
+            lines.append(f'    {key} = _constants[{key!r}]')
+            lines.append(f'    {key}.setflags(write=False)')
+    lines.extend(writer.lines)
+
+    if writer.arrays:
+        numpy.savez(os.path.join(os.path.dirname(path), stem + '.npz'), **writer.arrays)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n\n\n' + script)
+
+
+class _ModuleWriter:
+    # Writes the globals of a generated script as Python statements for
+    # `compile_module`. Arrays are collected in `arrays`, to be stored in an
+    # npz file and loaded under their key. Evaluables and other data classes
+    # and immutables, such as transforms, are reconstructed in dependency
+    # order from the constructor arguments that define them.
+
+    def __init__(self):
+        self.modules = set()
+        self.arrays = {}
+        self.lines = []
+        self._array_keys = {}
+        self._objects = {}
+
+    def assign(self, key, value):
+        self.lines.append(f'{key} = {self._expr(value)}')
+
+    def _expr(self, value):
+        if value is None or type(value) in (bool, int, str):
+            return repr(value)
+        if type(value) in (float, complex):
+            return repr(value) if numpy.isfinite(value) else f'{type(value).__name__}({str(value)!r})'
+        if isinstance(value, type) and value in (bool, int, float, complex):
+            return value.__name__
+        if isinstance(value, tuple):
+            return '(' + ''.join(self._expr(item) + ', ' for item in value) + ')'
+        if isinstance(value, types.frozenmultiset):
+            return f'{self._ref(types.frozenmultiset)}({self._expr(tuple(value))})'
+        if isinstance(value, types.arraydata):
+            return f'{self._ref(types.arraydata)}({self._array(value, numpy.asarray(value))})'
+        if isinstance(value, numpy.ndarray):
+            return self._array(value.base if isinstance(value.base, types.arraydata) else value, value)
+        if isinstance(value, numpy.generic):
+            return self._array(value, numpy.array(value)) + '[()]'
+        if isinstance(value, poly.MulVar):
+            return self._ref(poly.MulVar) + '.' + next(name for name in ('Left', 'Right', 'Both') if value == getattr(poly.MulVar, name))
+        if isinstance(value, (types.DataClass, types.Immutable)):
+            self._define(value)
+            return self._objects[value]
+        raise ValueError(f'cannot write an object of type {type(value).__qualname__} to a module')
+
+    def _ref(self, cls):
+        if isinstance(cls, builtin_types.MethodType):
+            return f'{self._ref(cls.__self__)}.{cls.__name__}'
+        if '<locals>' in cls.__qualname__:
+            raise ValueError(f'cannot write a reference to local class {cls.__qualname__} to a module')
+        if cls.__module__ == 'builtins':
+            return cls.__qualname__
+        self.modules.add(cls.__module__)
+        return f'{cls.__module__}.{cls.__qualname__}'
+
+    def _array(self, obj, array):
+        # Returns the key of `array`, where `obj` is the object that owns the
+        # data, such that arrays that share their data are stored only once.
+        entry = self._array_keys.get(id(obj))
+        if entry is None:
+            if array.dtype.hasobject:
+                raise ValueError('cannot write an array of objects to a module')
+            entry = self._array_keys[id(obj)] = obj, f'_a{len(self._array_keys)}'
+            self.arrays[entry[1]] = array
+        return entry[1]
+
+    def _define(self, obj):
+        # Defines `obj` and all data classes and immutables in its constructor
+        # arguments, as returned by `__reduce__`, children first.
+        stack = [obj]
+        while stack:
+            obj = stack[-1]
+            if obj in self._objects:
+                stack.pop()
+                continue
+            constructor, args = obj.__reduce__()
+            pending = [item for item in _flatten_args(args) if isinstance(item, (types.DataClass, types.Immutable)) and not isinstance(item, types.arraydata) and item not in self._objects]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            key = f'_o{len(self._objects)}'
+            self.lines.append(f'{key} = {self._ref(constructor)}({", ".join(map(self._expr, args))})')
+            self._objects[obj] = key
+
+
+def _flatten_args(args):
+    for arg in args:
+        if isinstance(arg, (tuple, types.frozenmultiset)):
+            yield from _flatten_args(arg)
+        else:
+            yield arg
+
+
+@cache.function
+def _compile_script(func, simplify: bool, stats, cache_const_intermediates: bool, allow_parallel: bool, batchsize: int):
+    # Generates the Python source of the function that evaluates `func` and
+    # returns the name of the script, the script and the constants (the
+    # picklable part of the globals) that the script depends on. The result
+    # depends only on the arguments, which makes it suitable for persistent
+    # caching via `cache.function`: if caching is enabled, a warm start skips
+    # simplification and code generation altogether.
+    #
     # Compiles `Evaluable`s to Python code. Every `Loop` is assigned a unique
     # loop id with `_define_loop_block_structure` and based on these loop ids
     # every `Evaluable` defines a block id where the Python code for that
@@ -5841,11 +6508,6 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
     #         # e0 exit
     #         return v0
 
-    if stats is None:
-        stats = 'log' if graphviz else False
-    elif stats not in ('log', False):
-        raise ValueError(f'`stats` must be `None`, `False` or `"log"` but got {stats!r}')
-
     # Build return value format string `ret` with the same structure as `func`
     # and convert `func` to a flat list.
     stack = [func]
@@ -5870,23 +6532,19 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
     # Simplify and optimize `funcs`.
     if simplify:
         funcs = [func.simplified for func in funcs]
+    if batchsize > 1:
+        funcs = [_batch_loops(func, batchsize) for func in funcs]
+        if simplify:
+            funcs = [func.simplified for func in funcs]
     funcs = [func._optimized_for_numpy1 for func in funcs]
     funcs = _define_loop_block_structure(tuple(funcs))
     assert not any(isinstance(arg, _LoopIndex) for func in funcs for arg in func.arguments)
 
-    # The globals of the compiled function.
+    # The constant globals of the compiled function. The modules and helper
+    # functions are added by `compile`.
     globals = dict(
-        collections=collections,
         first_run=True,
-        log_stats=_log_stats,
-        multiprocessing=multiprocessing,
-        numeric=numeric,
-        numpy=numpy,
-        parallel=parallel,
-        poly=poly,
         ret_tuple=Tuple(funcs),
-        Stats=_Stats,
-        treelog=log,
     )
     # Counter for generating unique indices, e.g. for creating variables.
     new_index = itertools.count()
@@ -5941,9 +6599,15 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
         blocks[(*loop_id, 0)] = _pyast.Block()
         blocks[(*loop_id[:-1], loop_id[-1] + 1)] = _pyast.Block()
 
-    compile_parallel = parallel.maxprocs.current > 1 and any(loop_length_index) and not stats
+    compile_parallel = allow_parallel and any(loop_length_index)
+
+    # If `compile_parallel` is true, the outer-most loops are distributed over
+    # workers using `parallel.distribute`. Every worker executes the contents
+    # of the worker init block before and the worker exit block after its
+    # share of the loop, e.g. to allocate and reduce partial sums.
+    worker_blocks = {loop_id: (_pyast.Block(), _pyast.Block()) for loop_id in loop_length_index if len(loop_id) == 1} if compile_parallel else {}
 
-    builder = _BlockTreeBuilder(blocks, evaluable_block_ids, globals, evaluables, new_index, cache, stats, compile_parallel, ndependents, evaluable_block_map, evaluable_deps)
+    builder = _BlockTreeBuilder(blocks, evaluable_block_ids, globals, evaluables, new_index, cache, stats, compile_parallel, worker_blocks, ndependents, evaluable_block_map, evaluable_deps)
 
     # Compile `funcs`.
     py_funcs = builder.compile(funcs)
@@ -5958,15 +6622,28 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
         py_range = builder.new_var()
         py_range_numpy_int = _pyast.Variable('map').call(_pyast.Variable('numpy').get_attr('int_'), py_range)
         loop_block = _pyast.ForLoop(py_loop_index, py_range_numpy_int, body)
-        if len(loop_id) == 1 and compile_parallel:
-            iter_context = _pyast.Variable('parallel').get_attr('ctxrange').call(loop_name, py_length)
+        if (worker_init_exit := worker_blocks.pop(loop_id, None)) is not None:
+            worker_init, worker_exit = worker_init_exit
+            py_distribute = _pyast.Variable('parallel').get_attr('distribute').call(loop_name, py_length)
+            if stats:
+                # Every worker collects stats in a local `stats`, which
+                # shadows the `stats` of the compiled function, and adds
+                # these to `py_worker_stats` on exit.
+                py_stats = _pyast.Variable('stats')
+                py_worker_stats = builder.new_var()
+                worker_init = _pyast.Block([_pyast.Assign(py_stats, _pyast.Variable('collections').get_attr('defaultdict').call(_pyast.Variable('MemoryStats' if stats == 'profile' else 'Stats'))), worker_init])
+                worker_exit = _pyast.Block([worker_exit, _pyast.With(_pyast.Variable('lock'), _pyast.Exec(py_worker_stats.get_attr('add').call(py_stats)))])
+                blocks[loop_id].append(_pyast.Assign(py_worker_stats, _pyast.Variable('WorkerStats').call(_pyast.Variable('stats_keys'))))
+            loop_block = _pyast.FunctionDef(builder.new_var(), (py_range,), _pyast.Block([worker_init, loop_block, worker_exit]), (py_distribute,))
+            if stats:
+                loop_block = _pyast.Block([loop_block, _pyast.Exec(py_worker_stats.get_attr('merge_into').call(py_stats))])
         else:
             iter_context = _pyast.Variable('treelog').get_attr('iter').get_attr('wrap').call(_pyast.Variable('parallel').get_attr('_pct').call(loop_name, py_length), _pyast.Variable('range').call(py_length))
-        loop_block = _pyast.With(iter_context, as_=py_range, body=loop_block, omit_if_body_is_empty=True)
+            loop_block = _pyast.With(iter_context, as_=py_range, body=loop_block, omit_if_body_is_empty=True)
         blocks[loop_id].append(loop_block)
         blocks[loop_id].append(blocks.pop((*loop_id[:-1], loop_id[-1] + 1)))
     main = blocks.pop((0,))
-    assert not blocks
+    assert not blocks and not worker_blocks
 
     if cache_const_intermediates:
         # Collect all evaluables that are to be recomputed on a rerun in
@@ -5994,10 +6671,29 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
         # Make all cached results immutable.
         for v in cache_vars:
             main.append(_pyast.Exec(v.get_attr('setflags').call(write=_pyast.LiteralBool(False))))
+        preamble = _pyast.Block([_pyast.Global((first_run,) + cache_vars)])
+        shared_evaluables = tuple(evaluable for evaluable in cache_evaluables if not isinstance(evaluable, Constant))
+        if shared_evaluables:
+            # Share the cached results, except for constants, with other
+            # compiled functions via `shared_intermediates`. If all results
+            # are known already, for instance because another function that
+            # was compiled earlier contains the same constant subgraphs, the
+            # first run is skipped.
+            globals['cache_keys'] = shared_evaluables
+            py_shared_intermediates = _pyast.Variable('shared_intermediates')
+            py_cache_keys = _pyast.Variable('cache_keys')
+            py_cache_vars = _pyast.Tuple(tuple(cache[evaluable] for evaluable in shared_evaluables))
+            main.append(_pyast.Assign(py_cache_vars, py_shared_intermediates.get_attr('register').call(py_cache_keys, py_cache_vars)))
+            py_shared = _pyast.Variable('shared')
+            preamble.append(_pyast.If(first_run, _pyast.Block([
+                _pyast.Assign(py_shared, py_shared_intermediates.get_attr('lookup').call(py_cache_keys)),
+                _pyast.Assign(first_run, _pyast.BinOp(py_shared, 'is', _pyast.Raw('None'))),
+                _pyast.If(_pyast.UnaryOp('not ', first_run), _pyast.Assign(py_cache_vars, py_shared)),
+            ])))
         # Combine `main` (for the first run) and `main_rerun` into `main`.
         main.append(_pyast.Assign(first_run, _pyast.LiteralBool(False)))
         main = _pyast.Block([
-            _pyast.Global((first_run,) + cache_vars),
+            preamble,
             _pyast.If(first_run, main, main_rerun),
         ])
 
@@ -6007,11 +6703,11 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
             main,
         ])
 
-    if stats == 'log':
+    if stats:
+        globals['stats_keys'] = tuple(evaluables)
         main = _pyast.Block([
-            _pyast.Assign(_pyast.Variable('stats'), _pyast.Variable('collections').get_attr('defaultdict').call(_pyast.Variable('Stats'))),
-            main,
-            _pyast.Exec(_pyast.Variable('log_stats').call(_pyast.Variable('ret_tuple'), _pyast.Variable('stats'))),
+            _pyast.With(_pyast.Variable('profile').call(memory=_pyast.LiteralBool(stats == 'profile')), main, as_=_pyast.Variable('stats')),
+            _pyast.Exec(_pyast.Variable('log_stats').call(_pyast.Variable('ret_tuple'), _pyast.Variable('stats'), export=_pyast.LiteralBool(stats == 'profile'))),
         ])
 
     script = StringIO()
@@ -6022,17 +6718,36 @@ def compile(func, /, *, simplify: bool = True, stats: typing.Optional[str] = Non
     script = script.getvalue()
 
     name = 'compiled_{}'.format(hashlib.sha256(script.encode('utf-8')).hexdigest())
+    return name, script, globals
 
-    if debug_flags.compile:
-        print(script)
 
-    # Make sure we can see `script` in tracebacks and `pdb`.
-    # From: https://stackoverflow.com/a/39625821
-    linecache.cache[name] = (len(script), None, [line+'\n' for line in script.splitlines()], name)
+class _SharedIntermediates:
+    # Registry of the cached constant intermediates of all compiled functions,
+    # keyed by the `Evaluable` that produced them. Since evaluables are unique
+    # by their arguments, compiled functions that share constant subgraphs
+    # find each other's results here. An entry lives as long as its key, which
+    # is kept alive by the globals of the compiled functions that use it.
+
+    def __init__(self):
+        self._values = weakref.WeakKeyDictionary()
+        self.hits = 0
+
+    def lookup(self, keys):
+        # Returns the values for all `keys`, or `None` if any is unknown.
+        try:
+            values = tuple(self._values[key] for key in keys)
+        except KeyError:
+            return None
+        self.hits += 1
+        return values
+
+    def register(self, keys, values):
+        # Stores `values` for `keys` and returns the registered values, which
+        # are the earlier registered values for known keys.
+        return tuple(self._values.setdefault(key, value) for key, value in zip(keys, values))
 
-    # Compile.
-    eval(builtins.compile(script, name, 'exec'), globals)
-    return globals['compiled']
+
+_shared_intermediates = _SharedIntermediates()
 
 
 def _define_loop_block_structure(targets: typing.Tuple[Evaluable, ...]) -> typing.Tuple[Evaluable, ...]:
@@ -6092,16 +6807,59 @@ def _define_loop_block_structure(targets: typing.Tuple[Evaluable, ...]) -> typin
     return tuple(util.shallow_replace(id_map.get, target) for target in unique_targets)
 
 
-def _log_stats(func, stats):
+def _log_stats(func, stats, export=False):
     node = func._node({}, None, stats, True)
     maxtime = builtins.max(n.metadata[1].time for n in node.walk(set()))
     tottime = builtins.sum(n.metadata[1].time for n in node.walk(set()))
-    aggstats = tuple((key, builtins.sum(v.time for v in values), builtins.sum(v.ncalls for v in values)) for key, values in util.gather(n.metadata for n in node.walk(set())))
+    aggstats = tuple((key, util.sum(values)) for key, values in util.gather(n.metadata for n in node.walk(set())))
     fill_color = (lambda node: '0,{:.2f},1'.format(node.metadata[1].time/maxtime)) if maxtime else None
     if graphviz:
         node.export_graphviz(fill_color=fill_color, dot_path=graphviz)
-    log.info('total time: {:.0f}ms\n'.format(tottime/1e6) + '\n'.join('{:4.0f} {} ({} calls, avg {:.3f} per call)'.format(t / 1e6, k, n, t / (1e6*n))
-                                                                      for k, t, n in sorted(aggstats, reverse=True, key=lambda item: item[1]) if n))
+    # The peak allocation is measured only if the stats are exported.
+    fmt = '{:4.0f} {} ({} calls, avg {:.3f} per call, {} output, {} peak)' if export else '{:4.0f} {} ({} calls, avg {:.3f} per call, {} output)'
+    log.info('total time: {:.0f}ms\n'.format(tottime/1e6) + '\n'.join(fmt.format(s.time / 1e6, k, s.ncalls, s.time / (1e6*s.ncalls), _format_nbytes(s.nbytes), _format_nbytes(s.peak))
+                                                      for k, s in sorted(aggstats, reverse=True, key=lambda item: item[1].time) if s.ncalls))
+    if export:
+        records, stacks = _stats_records(func, stats)
+        with log.infofile('stats.json', 'w') as f:
+            json.dump(records, f)
+        with log.infofile('stats.folded', 'w') as f:
+            f.writelines(f'{stack} {time}\n' for stack, time in stacks)
+
+
+def _stats_records(func, stats):
+    # Returns a list of records, one for every evaluable in `func` in
+    # depth-first order, and a list of pairs of a stack and a time in
+    # microseconds, in the folded stack format of flame graph tools. The
+    # records and the stack frames identify evaluables by their index in
+    # depth-first order. Since the same evaluable may be an argument of
+    # several evaluables, the stack of an evaluable is the first path from
+    # `func` to the evaluable that is encountered in depth-first order.
+    records = []
+    stacks = []
+    indices = {}
+    def visit(evaluable, parent_stack):
+        if (index := indices.get(evaluable)) is not None:
+            return index
+        indices[evaluable] = index = len(records)
+        s = stats.get(evaluable) or _Stats()
+        record = dict(index=index, type=type(evaluable).__name__, details=evaluable._node_details, ncalls=s.ncalls, time=s.time, nbytes=s.nbytes, peak=s.peak)
+        records.append(record)
+        stack = f'{parent_stack};{record["type"]}#{index}' if parent_stack else f'{record["type"]}#{index}'
+        if s.time:
+            stacks.append((stack, s.time // 1000))
+        record['args'] = [visit(arg, stack) for arg in evaluable.dependencies]
+        return index
+    visit(func, '')
+    return records, stacks
+
+
+def _format_nbytes(nbytes):
+    for unit in 'B', 'KiB', 'MiB':
+        if nbytes < 1024:
+            return f'{nbytes:.0f}{unit}' if unit == 'B' else f'{nbytes:.1f}{unit}'
+        nbytes /= 1024
+    return f'{nbytes:.1f}GiB'
 
 
 class _BlockTreeBuilder:
@@ -6116,6 +6874,7 @@ class _BlockTreeBuilder:
         compiled_cache: dict,
         stats: bool,
         parallel: bool,
+        worker_blocks: typing.Mapping[_BlockId, typing.Tuple[_pyast.Block, _pyast.Block]],
         ndependents: typing.Mapping[Evaluable, int],
         evaluable_block_map: typing.Mapping[Evaluable, typing.List[_pyast.Block]],
         evaluable_deps: typing.Mapping[typing.Optional[Evaluable], typing.Set[Evaluable]],
@@ -6129,6 +6888,7 @@ class _BlockTreeBuilder:
         self._compiled_cache = compiled_cache
         self._stats = stats
         self._parallel = parallel
+        self._worker_blocks = worker_blocks
         self.ndependents = ndependents
         self._evaluable_block_map = evaluable_block_map
         self._evaluable_deps = evaluable_deps
@@ -6152,11 +6912,15 @@ class _BlockTreeBuilder:
                 self._compiled_cache,
                 self._stats,
                 self._parallel,
+                self._worker_blocks,
                 self.ndependents,
                 self._evaluable_block_map,
                 self._evaluable_deps,
                 evaluable)
             self._compiled_cache[evaluable] = out = evaluable._compile(evaluable_builder)
+            if self._stats and isinstance(evaluable, Array) and not isinstance(evaluable, Constant):
+                block = evaluable_builder.get_block(self.get_block_id(evaluable))
+                block.exec(_pyast.Variable('stats').get_item(self.get_evaluable_expr(evaluable)).get_attr('record').call(out))
             if debug_flags.evalf and isinstance(evaluable, Array):
                 block = self.get_block(self.get_block_id(evaluable))
                 block.assert_equal(out.get_attr('dtype').get_attr('kind'), _pyast.LiteralStr(_array_dtype_to_kind[evaluable.dtype]))
@@ -6232,9 +6996,21 @@ class _BlockTreeBuilder:
         # Appends a comment identifying `evaluable` to the block with the given
         # id, or `self.get_block_id(evaluable)` if absent, optionally suffixed
         # with `comment`, and returns the block.
-        eid = 'e{}'.format(self._get_evaluable_index(evaluable))
         if block_id is None:
             block_id = self.get_block_id(evaluable)
+        return self._new_block_for_evaluable(evaluable, self._blocks[block_id], comment)
+
+    def get_worker_blocks_for_evaluable(self, evaluable: Evaluable, loop_index: '_LoopIndex') -> typing.Optional[typing.Tuple['_BlockBuilder', '_BlockBuilder']]:
+        # Returns the worker init and exit blocks, each with a comment
+        # identifying `evaluable`, if the loop with index `loop_index` is
+        # distributed over workers, otherwise `None`.
+        if (worker_blocks := self._worker_blocks.get(self.get_block_id(loop_index)[:-1])) is None:
+            return None
+        worker_init, worker_exit = worker_blocks
+        return self._new_block_for_evaluable(evaluable, worker_init, 'worker init'), self._new_block_for_evaluable(evaluable, worker_exit, 'worker exit')
+
+    def _new_block_for_evaluable(self, evaluable: Evaluable, parent: _pyast.Block, comment: str) -> '_BlockBuilder':
+        eid = 'e{}'.format(self._get_evaluable_index(evaluable))
         block = _pyast.Block()
         block_builder = _BlockBuilder(self, block)
 
@@ -6248,11 +7024,16 @@ class _BlockTreeBuilder:
         if self._stats:
             block = _pyast.With(_pyast.Variable('stats').get_item(_pyast.Variable(eid)), block, omit_if_body_is_empty=True)
 
-        self._blocks[block_id].append(block)
+        parent.append(block)
         if self._origin:
             self._evaluable_block_map.setdefault(self._origin, []).append(block)
         return block_builder
 
+    def is_shared(self, /, *args: _pyast.Expression) -> bool:
+        # Returns true if any of the arguments references arrays that are
+        # shared among workers.
+        return not self._shared_arrays.isdisjoint(frozenset().union(*(arg.variables for arg in args)))
+
     def get_variable_for_evaluable(self, evaluable: Evaluable) -> _pyast.Variable:
         # Returns the variable `v{id}` where `id` is the unique index of `evaluable`.
         #
@@ -6313,8 +7094,7 @@ class _BlockBuilder:
     def _needs_lock(self, /, *args, **kwargs):
         # Returns true if any of the arguments references variables that
         # require a lock.
-        variables = frozenset().union(*(arg.variables for arg in args), *(arg.variables for arg in kwargs.values()))
-        return not self._parent._shared_arrays.isdisjoint(variables)
+        return self._parent.is_shared(*args, *kwargs.values())
 
     def _block_for(self, /, *args, **kwargs):
         # If any of the arguments references variables that require a lock,
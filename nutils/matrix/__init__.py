@@ -11,8 +11,8 @@ import numpy
 import importlib
 import os
 
-from ._base import Matrix, MatrixError, BackendNotAvailable, ToleranceNotReached
-for cls in Matrix, MatrixError, BackendNotAvailable, ToleranceNotReached:
+from ._base import Matrix, BlockMatrix, LinearOperator, MatrixError, BackendNotAvailable, ToleranceNotReached
+for cls in Matrix, BlockMatrix, LinearOperator, MatrixError, BackendNotAvailable, ToleranceNotReached:
     cls.__module__ = __name__  # make it appear as if cls was defined here
 del cls  # clean up for sphinx
 
@@ -37,6 +37,47 @@ def fromsparse(data, inplace=False):
     return backend.current.assemble(values, indices, shape)
 
 
+class Assembler:
+    '''Repeated assembly of matrices with a fixed sparsity pattern.
+
+    Calling an assembler with a sparse object is equivalent to
+    :func:`fromsparse`, except that the sorted sparsity pattern and the mapping
+    from sparse entries to pattern positions are retained. Subsequent calls with
+    identical indices skip the sort and sum the values directly into the
+    pattern, which is what makes repeated assembly of a jacobian cheap. Explicit
+    zeros are retained such that all matrices share the same structure, as well
+    as the symbolic analysis of direct solvers that support reusing it.
+
+    >>> from nutils import matrix, sparse
+    >>> from numpy import array
+    >>> A = array([((0,1),.1), ((1,0),.2), ((0,1),.3)], dtype=sparse.dtype([2,2]))
+    >>> assemble = matrix.Assembler()
+    >>> assemble(A).export('dense').tolist()
+    [[0.0, 0.4], [0.2, 0.0]]
+    >>> A['value'] = 1, 0, 2
+    >>> assemble(A).export('dense').tolist()
+    [[0.0, 3.0], [0.0, 0.0]]
+    '''
+
+    def __init__(self):
+        self._index = None
+
+    def __call__(self, data):
+        if self._index is None or self._index.dtype != data.dtype['index'] or not numpy.array_equal(self._index, data['index']):
+            self._index = data['index'].copy()
+            pattern, self._inverse = sparse.unique(data)
+            self._pattern = tuple(pattern[i] for i in pattern.dtype.names)
+            self._symbolic = {}
+        values = data['value']
+        if numpy.iscomplexobj(values):
+            values = numpy.bincount(self._inverse, values.real, len(self._pattern[0])) + 1j * numpy.bincount(self._inverse, values.imag, len(self._pattern[0]))
+        elif len(values):
+            values = numpy.bincount(self._inverse, values, len(self._pattern[0])).astype(values.dtype, copy=False)
+        matrix = backend.current.assemble(values, self._pattern, sparse.shape(data))
+        matrix._symbolic = self._symbolic
+        return matrix
+
+
 def empty(shape):
     return backend.current.assemble(data=numpy.empty([0], dtype=float), index=numpy.empty([len(shape), 0], dtype=int), shape=shape)
 
@@ -1,4 +1,4 @@
-from .. import numeric
+from .. import numeric, sparse
 import abc
 import treelog
 import functools
@@ -39,6 +39,7 @@ class Matrix:
         self.dtype = dtype
         self._precon_args = None
         self._cached_submatrix = None
+        self._symbolic = {}  # symbolic analyses of direct solvers, shared by matrices with the same pattern
 
     def __reduce__(self):
         from . import assemble
@@ -92,10 +93,11 @@ class Matrix:
     def rowsupp(self, tol=0):
         'return row indices with nonzero/non-small entries'
 
-        data, (row, col) = self.export('coo')
-        supp = numpy.zeros(self.shape[0], dtype=bool)
-        supp[row[abs(data) > tol]] = True
-        return supp
+        data, indices, indptr = self.export('csr')
+        nonzero = numpy.greater(abs(data), tol)
+        # reduceat yields the entry at the offset for empty rows, hence the
+        # mask, which requires an entry past the end for trailing empty rows
+        return numpy.logical_or.reduceat(numpy.append(nonzero, False), indptr[:-1]) & (indptr[:-1] < indptr[1:])
 
     @treelog.withcontext
     def solve(self, rhs=None, *, lhs0=None, constrain=None, rconstrain=None, solver='arnoldi', atol=0., rtol=0., **solverargs):
@@ -169,6 +171,7 @@ class Matrix:
         else:
             assert rconstrain.shape == (nrows,) and constrain.dtype == bool
             I = ~rconstrain
+        solverargs = _restrictprolongation(solverargs, J)
         lhs[J] += self.submatrix(I, J)._solver((rhs - self @ lhs)[I], solver, atol=atol, rtol=rtol, **solverargs)
         return lhs
 
@@ -233,7 +236,7 @@ class Matrix:
             k = solve(res)
             v = self @ k
             for k_, v_, v2_ in krylov:  # orthogonolize v (modified Gramm-Schmidt)
-                c = _vdot(v, v_) / v2_
+                c = _vdot(v_, v) / v2_
                 k -= k_ * c
                 v -= v_ * c
             v2 = _vdot(v)
@@ -275,6 +278,7 @@ class Matrix:
             self._cached_rows = rows
             self._cached_cols = cols
             self._cached_submatrix = self._submatrix(rows, cols)
+            self._cached_submatrix._symbolic = self._submatrix_symbolic(rows, cols)
 
         return self._cached_submatrix
 
@@ -282,6 +286,25 @@ class Matrix:
     def _submatrix(self, rows, cols):
         raise NotImplementedError
 
+    def _submatrix_symbolic(self, rows, cols):
+        # Symbolic analyses of the submatrix of the given rows and columns, among
+        # which the kept entries of the sparsity pattern. As submatrices of the
+        # same pattern are typically formed repeatedly, for instance in every
+        # Newton iteration, those of the last selection are kept with the
+        # analyses of this matrix, such that the matrices of an assembler share
+        # them.
+        key = numpy.packbits(rows).tobytes(), numpy.packbits(cols).tobytes()
+        cached = self._symbolic.get('submatrix')
+        if cached is None or cached[0] != key:
+            cached = self._symbolic['submatrix'] = key, {}
+        return cached[1]
+
+    def _cached_submatrix_pattern(self, indptr, indices, rows, cols):
+        symbolic = self._submatrix_symbolic(rows, cols)
+        if 'pattern' not in symbolic:
+            symbolic['pattern'] = _submatrix_pattern(indptr, indices, rows, cols)
+        return symbolic['pattern']
+
     def export(self, form):
         '''Export matrix data to any of supported forms.
 
@@ -300,15 +323,14 @@ class Matrix:
         if nrows != ncols:
             raise MatrixError('failed to extract diagonal: matrix is not square')
         data, indices, indptr = self.export('csr')
-        diag = numpy.empty(nrows, self.dtype)
-        for irow in range(nrows):
-            icols = indices[indptr[irow]:indptr[irow+1]]
-            idiag = numpy.searchsorted(icols, irow)
-            diag[irow] = data[indptr[irow]+idiag] if idiag < len(icols) and icols[idiag] == irow else 0
+        rows = numpy.arange(nrows).repeat(numpy.diff(indptr))
+        ondiag = indices == rows
+        diag = numpy.zeros(nrows, self.dtype)
+        diag[rows[ondiag]] = data[ondiag]
         return diag
 
     def getprecon(self, precon, **args):
-        if (precon, args) == self._precon_args:
+        if self._precon_args is not None and _equal((precon, args), self._precon_args):
             return self._precon_object
         if self.shape[0] != self.shape[1]:
             raise MatrixError('matrix must be square')
@@ -335,10 +357,591 @@ class Matrix:
             raise MatrixError("building 'diag' preconditioner: diagonal has zero entries")
         return numpy.reciprocal(diag).__mul__
 
+    def _precon_multigrid(self, prolongation, **args):
+        '''Geometric multigrid V-cycle.
+
+        The ``prolongation`` argument is a matrix or a sequence of matrices,
+        ordered from fine to coarse, that map the coefficients of each level to
+        those of the next finer level, as obtained by
+        :meth:`nutils.topology.Topology.prolongation`. The operators of the
+        coarser levels follow from the Galerkin product ``P.T @ A @ P``, where
+        coarse dofs that do not connect to the finer level are dropped. In a
+        constrained solve, :meth:`solve` restricts the rows of the finest
+        prolongation to the free dofs. Every level is smoothed by ``nsmooth`` damped Jacobi
+        iterations or Chebyshev steps before and after the coarse correction, and
+        the coarsest level is solved by the ``coarse`` preconditioner. The Jacobi
+        ``damping`` defaults to 2/3; if it is None, it is set per level to 4/3
+        over the estimated spectral radius of the Jacobi scaled operator.'''
+
+        if isinstance(prolongation, Matrix):
+            prolongation = prolongation,
+        prolongations = _restricted(prolongation)
+        return _multigrid(self, lambda A: next(prolongations, None), **args)
+
+    def _precon_amg(self, nodes=None, nullspace=None, theta=.08, maxcoarse=100, maxlevels=10, damping=None, **args):
+        '''Smoothed aggregation algebraic multigrid V-cycle.
+
+        The levels are formed by aggregating strongly connected nodes, where
+        ``nodes`` assigns every dof to a node such that the components of
+        vector-valued unknowns are aggregated together, and defaults to one node
+        per dof. Two nodes are strongly connected if the norm of their coupling
+        block exceeds ``theta`` times the geometric mean of the norms of their
+        diagonal blocks. The tentative prolongation interpolates the columns of
+        ``nullspace``, which defaults to a constant per component of the nodes
+        and can be extended by, for instance, rigid body rotations. The
+        prolongation follows from smoothing it by a damped Jacobi step.
+        Coarsening stops at ``maxcoarse`` dofs or ``maxlevels`` levels; the
+        remaining arguments are those of the multigrid preconditioner, except
+        that the Jacobi ``damping`` defaults to None, as the spectrum of an
+        algebraic problem is not known beforehand.'''
+
+        nodes = numpy.arange(self.shape[0]) if nodes is None else numpy.asarray(nodes)
+        if nodes.shape != self.shape[:1]:
+            raise MatrixError('nodes should be an array of length {}'.format(self.shape[0]))
+        if nullspace is None:
+            order = numpy.argsort(nodes, kind='stable')
+            component = numpy.empty_like(order)
+            component[order] = numpy.arange(len(order)) - numpy.searchsorted(nodes[order], nodes[order])
+            nullspace = numpy.equal.outer(component, numpy.arange(component.max(initial=0)+1)).astype(float)
+        else:
+            nullspace = numpy.asarray(nullspace, dtype=float).reshape(self.shape[0], -1)
+        nlevels = 1
+
+        def prolongate(A):
+            nonlocal nodes, nullspace, nlevels
+            if A.shape[0] <= maxcoarse or nlevels >= maxlevels:
+                return
+            values, rows, cols, nodes, nullspace = _aggregation(A, nodes, nullspace, theta)
+            if len(nodes) > .9 * A.shape[0]:  # insufficient coarsening
+                return
+            nlevels += 1
+            return values, rows, cols, (A.shape[0], len(nodes))
+
+        return _multigrid(self, prolongate, damping=damping, **args)
+
     def __repr__(self):
         return '{}<{}x{}>'.format(type(self).__qualname__, *self.shape)
 
 
+class BlockMatrix(Matrix):
+    '''Square matrix with a block structure.
+
+    Wraps a matrix of the active backend, of which the rows and columns are
+    partitioned in consecutive blocks of sizes ``blocks``, such as the velocity
+    and pressure unknowns of a flow problem. All operations are forwarded to
+    the wrapped matrix, including its solvers and preconditioners, while the
+    block structure enables the 'blockdiag' and 'blocktriangular'
+    preconditioners, each of which uses a preconditioner per block.'''
+
+    def __init__(self, matrix, blocks):
+        self.matrix = matrix
+        self.blocks = tuple(map(int, blocks))
+        if matrix.shape[0] != matrix.shape[1] or sum(self.blocks) != matrix.shape[0]:
+            raise MatrixError('blocks of sizes {} do not match matrix of shape {}x{}'.format(self.blocks, *matrix.shape))
+        super().__init__(matrix.shape, matrix.dtype)
+
+    def __reduce__(self):
+        return BlockMatrix, (self.matrix, self.blocks)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_precon_'):
+            return getattr(self.matrix, attr)
+        if attr.startswith('_solver_'):
+            return functools.partial(self._solver_wrapped, getattr(self.matrix, attr))
+        raise AttributeError(attr)
+
+    def _solver_wrapped(self, solver, rhs, atol, **args):
+        # Solver of the wrapped matrix with preconditioners taken from self.
+        name = args.get('precon')
+        if isinstance(name, str):
+            def precon(matrix, **preconargs):
+                return self.getprecon(name, **preconargs)
+            precon.__name__ = name
+            args['precon'] = precon
+        return solver(rhs, atol, **args)
+
+    def __add__(self, other):
+        return BlockMatrix(self.matrix + (other.matrix if isinstance(other, BlockMatrix) else other), self.blocks)
+
+    def __mul__(self, other):
+        return BlockMatrix(self.matrix * other, self.blocks)
+
+    def __matmul__(self, other):
+        return self.matrix @ other
+
+    def __neg__(self):
+        return BlockMatrix(-self.matrix, self.blocks)
+
+    @property
+    def T(self):
+        return BlockMatrix(self.matrix.T, self.blocks)
+
+    def export(self, form):
+        return self.matrix.export(form)
+
+    def diagonal(self):
+        return self.matrix.diagonal()
+
+    def block(self, i, j):
+        'return the submatrix of block row i and block column j'
+
+        return self.matrix._submatrix(self._mask(i), self._mask(j))
+
+    def _mask(self, i, stop=None):
+        # Boolean mask of the dofs of blocks i up to stop, or of block i only.
+        offsets = numpy.cumsum((0,) + self.blocks)
+        mask = numpy.zeros(self.shape[0], dtype=bool)
+        mask[offsets[i]:offsets[i+1 if stop is None else stop]] = True
+        return mask
+
+    def _submatrix(self, rows, cols):
+        matrix = self.matrix.submatrix(rows, cols)
+        offsets = numeric.overlapping(numpy.cumsum((0,) + self.blocks))
+        rowblocks = [rows[n:m].sum() for n, m in offsets]
+        if rowblocks != [cols[n:m].sum() for n, m in offsets]:
+            return matrix
+        return BlockMatrix(matrix, [n for n in rowblocks if n])
+
+    def _blockprecons(self, block, blockargs, schur):
+        # Preconditioners of the approximate Schur complements of the diagonal
+        # blocks, with block and blockargs given once or per block.
+        from . import fromsparse
+        n = len(self.blocks)
+        precons = [block] * n if isinstance(block, str) or callable(block) else list(block)
+        blockargs = [blockargs] * n if isinstance(blockargs, collections.abc.Mapping) else list(blockargs)
+        if len(precons) != n or len(blockargs) != n:
+            raise MatrixError('expected {} block preconditioners'.format(n))
+        solves = []
+        dinvs = []
+        for i in range(n):
+            if i == n-1 and schur is not None:
+                if schur.shape != (self.blocks[i],) * 2:
+                    raise MatrixError('schur complement of shape {}x{} does not match last block of size {}'.format(*schur.shape, self.blocks[i]))
+                S = schur
+            elif i == 0:
+                S = self.block(0, 0)
+            else:
+                s, (si, sj) = self.block(i, i).export('coo')
+                values = [s]
+                rows = [si]
+                cols = [sj]
+                for j, dinv in enumerate(dinvs):
+                    a, (ai, aj) = self.block(i, j).export('coo')
+                    b, (bi, bj) = self.block(j, i).export('coo')
+                    ci, cj, c = _matmul(ai, aj, a, dinv[bi] * b, bi, bj, self.blocks[j])
+                    values.append(-c)
+                    rows.append(ci)
+                    cols.append(cj)
+                S = fromsparse(_coo(numpy.concatenate(values), numpy.concatenate(rows), numpy.concatenate(cols), (self.blocks[i],) * 2), inplace=True)
+            if i < n-1:
+                diag = S.diagonal()
+                if not diag.all():
+                    raise MatrixError('building block preconditioner: diagonal of block {} has zero entries'.format(i))
+                dinvs.append(numpy.reciprocal(diag))
+            with treelog.context('block {}'.format(i)):
+                solves.append(S.getprecon(precons[i], **blockargs[i]))
+        return solves
+
+    def _precon_blockdiag(self, block='direct', blockargs={}, schur=None):
+        '''Block diagonal preconditioner.
+
+        Inverts the diagonal blocks independently, where every block is replaced
+        by the approximate Schur complement ``S_i = A_ii - sum_j<i A_ij
+        diag(S_j)^-1 A_ji``. For a saddle point system this is the SIMPLE
+        approximation ``-B diag(A)^-1 B^T`` of the pressure Schur complement.
+        Alternatively, ``schur`` is a matrix that replaces the approximation of
+        the last block, for instance a scaled pressure mass matrix. The blocks
+        are preconditioned by ``block`` with arguments ``blockargs``, either of
+        which may be a sequence with an entry per block.'''
+
+        solves = self._blockprecons(block, blockargs, schur)
+        return functools.partial(_blocksolve, self.dtype, numpy.cumsum((0,) + self.blocks), solves, [None] * len(solves))
+
+    def _precon_blocktriangular(self, block='direct', blockargs={}, schur=None):
+        '''Block upper triangular preconditioner.
+
+        Applies the inverse of the upper block triangular part of the matrix,
+        with the diagonal blocks replaced by the approximate Schur complements
+        of the 'blockdiag' preconditioner, which takes the same arguments. With
+        exact Schur complements a Krylov solver converges in two iterations.'''
+
+        solves = self._blockprecons(block, blockargs, schur)
+        n = len(self.blocks)
+        upper = [self.matrix._submatrix(self._mask(i), self._mask(i+1, n)) for i in range(n-1)] + [None]
+        return functools.partial(_blocksolve, self.dtype, numpy.cumsum((0,) + self.blocks), solves, upper)
+
+
+def _blocksolve(dtype, offsets, solves, upper, rhs):
+    # Backward substitution of the block upper triangular system of which the
+    # diagonal blocks are inverted by solves and the off-diagonal block rows
+    # are upper, or None to ignore.
+    lhs = numpy.empty(rhs.shape, dtype=numpy.result_type(dtype, rhs.dtype))
+    for i in reversed(range(len(solves))):
+        n, m = offsets[i:i+2]
+        lhs[n:m] = solves[i](rhs[n:m] if upper[i] is None else rhs[n:m] - upper[i] @ lhs[m:])
+    return lhs
+
+
+class LinearOperator(Matrix):
+    '''Matrix defined by its action on vectors.
+
+    The product with a vector is computed by ``matvec`` rather than from
+    stored entries, which suffices for the arnoldi solver. Preconditioners are
+    those of ``matrix``, an assembled approximation of the operator if
+    available, such that a preconditioner is reused for as long as the
+    approximation is. The iterative solvers of the approximation's backend,
+    such as scipy's ``gmres``, are applied to the operator itself. If
+    ``rmatvec`` computes the product with the transpose, the operator can be
+    transposed, which allows solvers such as scipy's ``bicg``.'''
+
+    def __init__(self, matvec, shape, dtype=float, matrix=None, rmatvec=None):
+        if matrix is not None and matrix.shape != tuple(shape):
+            raise MatrixError('approximation of shape {}x{} does not match operator of shape {}x{}'.format(*matrix.shape, *shape))
+        self.matvec = matvec
+        self.rmatvec = rmatvec
+        self.matrix = matrix
+        super().__init__(tuple(shape), dtype)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_solver_') and self.matrix is not None:
+            return functools.partial(getattr(type(self.matrix), attr), self)
+        raise AttributeError(attr)
+
+    def __add__(self, other):
+        if not isinstance(other, Matrix):
+            raise TypeError
+        if self.shape != other.shape:
+            raise MatrixError('non-matching shapes')
+        other_matrix = other.matrix if isinstance(other, LinearOperator) else other
+        transposable = self.rmatvec is not None and (not isinstance(other, LinearOperator) or other.rmatvec is not None)
+        return LinearOperator(functools.partial(_addmatvec, self, other), self.shape, numpy.result_type(self.dtype, other.dtype),
+                              None if self.matrix is None or other_matrix is None else self.matrix + other_matrix,
+                              functools.partial(_addrmatvec, self, other) if transposable else None)
+
+    def __mul__(self, other):
+        if not numeric.isnumber(other):
+            raise TypeError
+        return LinearOperator(functools.partial(_scalematvec, self.matvec, other), self.shape, numpy.result_type(self.dtype, other),
+                              None if self.matrix is None else self.matrix * other,
+                              None if self.rmatvec is None else functools.partial(_scalematvec, self.rmatvec, other))
+
+    def __matmul__(self, other):
+        if not isinstance(other, numpy.ndarray):
+            raise TypeError
+        if other.shape[:1] != self.shape[1:]:
+            raise MatrixError('matrix-vector shapes do not match')
+        if other.ndim == 1:
+            return self.matvec(other)
+        return numpy.stack([self @ x for x in numpy.moveaxis(other, 1, 0)], axis=1)
+
+    def __neg__(self):
+        return self * -1
+
+    @property
+    def T(self):
+        if self.rmatvec is None:
+            raise NotImplementedError('cannot transpose {} without rmatvec'.format(self.__class__.__name__))
+        return LinearOperator(self.rmatvec, self.shape[::-1], self.dtype, None if self.matrix is None else self.matrix.T, self.matvec)
+
+    def getprecon(self, precon, **args):
+        if self.matrix is None:
+            return super().getprecon(precon, **args)
+        return self.matrix.getprecon(precon, **args)
+
+    def _submatrix(self, rows, cols):
+        return LinearOperator(functools.partial(_submatvec, self.matvec, rows, cols), (rows.sum(), cols.sum()), self.dtype,
+                              None if self.matrix is None else self.matrix.submatrix(rows, cols),
+                              None if self.rmatvec is None else functools.partial(_submatvec, self.rmatvec, cols, rows))
+
+
+def _addmatvec(a, b, x):
+    return a @ x + b @ x
+
+
+def _addrmatvec(a, b, x):
+    return a.T @ x + b.T @ x
+
+
+def _scalematvec(matvec, scale, x):
+    return matvec(x) * scale
+
+
+def _submatvec(matvec, rows, cols, x):
+    y = numpy.zeros(len(cols), dtype=x.dtype)
+    y[cols] = x
+    return matvec(y)[rows]
+
+
+def _multigrid(A, prolongate, smoother='jacobi', nsmooth=2, damping=2/3, coarse='direct', coarseargs={}):
+    # V-cycle on the hierarchy formed by successive prolongations, which
+    # prolongate(A) returns in coordinate format for a level with operator A,
+    # or None for the coarsest level.
+    from . import fromsparse
+    levels = []
+    while True:
+        P = prolongate(A)
+        if P is None:
+            break
+        values, rows, cols, shape = P
+        if shape[0] != A.shape[0]:
+            raise MatrixError('prolongation of shape {}x{} does not match level of size {}'.format(*shape, A.shape[0]))
+        levels.append((A, _smoother(A, smoother, nsmooth, damping),
+                       functools.partial(_spmv, values, rows, cols, shape[0]),
+                       functools.partial(_spmv, values, cols, rows, shape[1])))
+        A = fromsparse(_galerkin(A, values, rows, cols, shape), inplace=True)
+    treelog.info('multigrid with {} levels of {} dofs'.format(len(levels)+1, ', '.join(str(level[0].shape[0]) for level in levels + [(A,)])))
+    return functools.partial(_vcycle, tuple(levels), A.getprecon(coarse, **coarseargs))
+
+
+def _restrictprolongation(args, free):
+    # Solver arguments with the rows of the finest multigrid prolongation, if
+    # given for all dofs, restricted to the free dofs of a constrained system.
+    args = dict(args)
+    if 'preconargs' in args:
+        args['preconargs'] = _restrictprolongation(args['preconargs'], free)
+    prolongation = args.get('prolongation')
+    if prolongation is not None and not free.all():
+        P, *coarse = (prolongation,) if isinstance(prolongation, Matrix) else prolongation
+        if P.shape[0] == len(free):
+            args['prolongation'] = [P.submatrix(free, numpy.ones(P.shape[1], dtype=bool)), *coarse]
+    return args
+
+
+def _restricted(prolongation):
+    # Prolongation matrices in coordinate format with coarse dofs dropped that
+    # do not connect to the rows of the finer level.
+    keep = None
+    for P in prolongation:
+        if keep is None:
+            keep = numpy.ones(P.shape[0], dtype=bool)
+        elif P.shape[0] != len(keep):
+            raise MatrixError('prolongation of shape {}x{} does not match level of size {}'.format(*P.shape, len(keep)))
+        data, (rows, cols) = P.export('coo')
+        select = keep[rows] & (data != 0)
+        rows = (numpy.cumsum(keep) - 1)[rows[select]]
+        nrows = int(keep.sum())
+        keep = numpy.zeros(P.shape[1], dtype=bool)
+        keep[cols[select]] = True
+        cols = (numpy.cumsum(keep) - 1)[cols[select]]
+        yield data[select], rows, cols, (nrows, int(keep.sum()))
+
+
+def _aggregation(A, nodes, nullspace, theta):
+    # Smoothed aggregation prolongation in coordinate format, and the node
+    # index and near null space of the coarse dofs.
+    a, (i, j) = A.export('coo')
+    unique, nodes = numpy.unique(nodes, return_inverse=True)
+    nnodes = len(unique)
+    S = sparse.dedup(_coo(numpy.square(abs(a)), nodes[i], nodes[j], (nnodes, nnodes)), inplace=True)
+    si = S['index']['i0'].astype(int)
+    sj = S['index']['i1'].astype(int)
+    snorm = numpy.sqrt(S['value'])
+    sdiag = numpy.zeros(nnodes)
+    sdiag[si[si == sj]] = snorm[si == sj]
+    strong = (si != sj) & (snorm >= theta * numpy.sqrt(sdiag[si] * sdiag[sj]))
+    aggregate = _aggregate(nnodes, si[strong], sj[strong])[nodes]
+    # tentative prolongation by orthonormalization of the near null space per
+    # aggregate, batched over aggregates of equal size
+    naggregates = aggregate.max() + 1
+    order = numpy.argsort(aggregate, kind='stable')
+    sizes = numpy.bincount(aggregate, minlength=naggregates)
+    offsets = numpy.cumsum(sizes) - sizes
+    ncols = numpy.empty(naggregates, dtype=int)
+    batches = []
+    for size in numpy.unique(sizes):
+        iaggregates, = numpy.equal(sizes, size).nonzero()
+        dofs = order[offsets[iaggregates,numpy.newaxis] + numpy.arange(size)]
+        Q, s, Vh = numpy.linalg.svd(nullspace[dofs], full_matrices=False)
+        select = s > 1e-10 * s.max(axis=1, initial=0)[:,numpy.newaxis]
+        ncols[iaggregates] = select.sum(axis=1)
+        batches.append((iaggregates, dofs, Q, s[...,numpy.newaxis] * Vh, select))
+    coarsenodes = numpy.arange(naggregates).repeat(ncols)
+    coarseoffsets = numpy.cumsum(ncols) - ncols
+    coarsenullspace = numpy.empty((len(coarsenodes), nullspace.shape[1]))
+    rows = []
+    cols = []
+    values = []
+    for iaggregates, dofs, Q, R, select in batches:
+        ibatch, icol = select.nonzero()
+        icoarse = coarseoffsets[iaggregates[ibatch]] + numpy.cumsum(select, axis=1)[ibatch,icol] - 1
+        rows.append(dofs[ibatch].ravel())
+        cols.append(icoarse.repeat(dofs.shape[1]))
+        values.append(Q[ibatch,:,icol].ravel())
+        coarsenullspace[icoarse] = R[ibatch,icol]
+    rows = numpy.concatenate(rows)
+    cols = numpy.concatenate(cols)
+    values = numpy.concatenate(values)
+    shape = A.shape[0], len(coarsenodes)
+    # jacobi smoothing of the tentative prolongation
+    diag = A.diagonal()
+    if not diag.all():
+        raise MatrixError("building 'amg' preconditioner: diagonal has zero entries")
+    dinv = numpy.reciprocal(diag)
+    omega = 4 / 3 / _spectral_radius(A, dinv)
+    i, k, v = _matmul(i, j, a, values, rows, cols, shape[0])
+    P = sparse.prune(sparse.dedup(_coo(numpy.concatenate([values, -omega * dinv[i] * v]), numpy.concatenate([rows, i]), numpy.concatenate([cols, k]), shape), inplace=True), inplace=True)
+    return P['value'], P['index']['i0'].astype(int), P['index']['i1'].astype(int), coarsenodes, coarsenullspace
+
+
+def _aggregate(nnodes, rows, cols):
+    # Aggregation of the nodes of a graph in coordinate format: the roots of the
+    # aggregates form a maximal independent set of the squared graph, which is
+    # found in vectorized rounds in which undecided nodes join the set if their
+    # priority is the largest within distance two, and leave it if a node
+    # within distance two has joined. The neighbours of every root join its
+    # aggregate, after which remaining nodes join a neighbouring aggregate.
+    diagonal = numpy.arange(nnodes)
+    order = numpy.lexsort([numpy.concatenate([cols, diagonal]), numpy.concatenate([rows, diagonal])])
+    neighbours = numpy.concatenate([cols, diagonal])[order]
+    rowptr = numpy.searchsorted(numpy.concatenate([rows, diagonal])[order], diagonal)
+    # undecided nodes have their priority as key, roots a key of at least
+    # nnodes and non-roots a key of -1
+    key = numpy.random.RandomState(0).permutation(nnodes)
+    undecided = numpy.ones(nnodes, dtype=bool)
+    while undecided.any():
+        near = numpy.maximum.reduceat(key[neighbours], rowptr)
+        near = numpy.maximum.reduceat(near[neighbours], rowptr)
+        root = undecided & (near == key)
+        key[root] = nnodes + diagonal[root]
+        key[undecided & ~root & (near >= nnodes)] = -1
+        undecided = (key >= 0) & (key < nnodes)
+    roots, = (key >= nnodes).nonzero()
+    aggregate = numpy.full(nnodes, -1)
+    aggregate[roots] = numpy.arange(len(roots))
+    select = (aggregate[cols] >= 0) & (aggregate[rows] < 0)
+    aggregate[rows[select]] = aggregate[cols[select]]
+    select = (aggregate[rows] < 0) & (aggregate[cols] >= 0)
+    free, first = numpy.unique(rows[select], return_index=True)
+    aggregate[free] = aggregate[cols[select][first]]
+    assert (aggregate >= 0).all()
+    return aggregate
+
+
+def _coo(values, rows, cols, shape):
+    data = numpy.empty(len(values), dtype=sparse.dtype(shape, values.dtype))
+    data['index']['i0'] = rows
+    data['index']['i1'] = cols
+    data['value'] = values
+    return data
+
+
+def _spmv(values, rows, cols, n, x):
+    # Product of the coordinate matrix and vector or array x, summing the
+    # products per row with `numpy.bincount`, which is much faster than
+    # `numpy.add.at`. Trailing axes of x are flattened into the bins.
+    products = (values.reshape(values.shape+(1,)*(x.ndim-1)) * x[cols]).reshape(len(values), -1)
+    m = products.shape[1]
+    bins = rows if m == 1 else (rows[:, numpy.newaxis] * m + numpy.arange(m)).ravel()
+    if numpy.iscomplexobj(products):
+        y = numpy.bincount(bins, products.real.ravel(), n*m) + 1j * numpy.bincount(bins, products.imag.ravel(), n*m)
+    else:
+        y = numpy.bincount(bins, products.ravel(), n*m)
+    return y.reshape((n,)+x.shape[1:])
+
+
+def _matmul(i, j, v, values, rows, cols, nrows):
+    # Coordinate entries of the product of coordinate matrices (i, j, v) and
+    # (rows, cols, values), the latter with nrows rows.
+    order = numpy.argsort(rows, kind='stable')
+    rowptr = numpy.searchsorted(rows[order], numpy.arange(nrows+1))
+    count = rowptr[1:][j] - rowptr[:-1][j]
+    offsets = order[numpy.repeat(rowptr[j] - count.cumsum() + count, count) + numpy.arange(count.sum())]
+    return numpy.repeat(i, count), cols[offsets], numpy.repeat(v, count) * values[offsets]
+
+
+def _galerkin(A, values, rows, cols, shape):
+    # Sparse object of P.T @ A @ P with P the coordinate matrix of given shape.
+    a, (i, j) = A.export('coo')
+    i, k, v = _matmul(i, j, a, values, rows, cols, shape[0])
+    AP = sparse.dedup(_coo(v, i, k, shape), inplace=True)
+    k, l, v = _matmul(AP['index']['i1'], AP['index']['i0'], AP['value'], values, rows, cols, shape[0])
+    return _coo(v, l, k, (shape[1], shape[1]))
+
+
+def _smoother(A, name, nsmooth, damping):
+    diag = A.diagonal()
+    if not diag.all():
+        raise MatrixError("building 'multigrid' preconditioner: diagonal has zero entries")
+    dinv = numpy.reciprocal(diag)
+    if name == 'jacobi':
+        if damping is None:
+            damping = 4 / 3 / _spectral_radius(A, dinv)
+        return functools.partial(_jacobi, A, damping * dinv, nsmooth)
+    if name == 'chebyshev':
+        upper = 1.1 * _spectral_radius(A, dinv)
+        return functools.partial(_chebyshev, A, dinv, nsmooth, upper / 4, upper)
+    raise MatrixError('invalid smoother {!r}'.format(name))
+
+
+def _spectral_radius(A, dinv, niter=20):
+    # Power iteration estimate of the largest eigenvalue of dinv A.
+    x = numpy.random.RandomState(0).uniform(size=len(dinv))
+    radius = 0.
+    for i in range(niter):
+        x = dinv * (A @ x)
+        radius = numpy.linalg.norm(x)
+        x /= radius
+    return radius
+
+
+def _jacobi(A, dinv, nsmooth, rhs, lhs):
+    dinv = dinv.reshape(dinv.shape+(1,)*(rhs.ndim-1))
+    for i in range(nsmooth):
+        lhs = lhs + dinv * (rhs - A @ lhs)
+    return lhs
+
+
+def _chebyshev(A, dinv, nsmooth, lower, upper, rhs, lhs):
+    # Chebyshev iteration for the Jacobi preconditioned system with eigenvalues
+    # assumed in [lower, upper], see Saad, Iterative Methods for Sparse Linear
+    # Systems, algorithm 12.1.
+    dinv = dinv.reshape(dinv.shape+(1,)*(rhs.ndim-1))
+    theta = (upper + lower) / 2
+    delta = (upper - lower) / 2
+    sigma = theta / delta
+    rho = 1 / sigma
+    res = dinv * (rhs - A @ lhs)
+    d = res / theta
+    for i in range(nsmooth):
+        lhs = lhs + d
+        res = res - dinv * (A @ d)
+        rho, rhoprev = 1 / (2 * sigma - rho), rho
+        d = rho * rhoprev * d + 2 * rho / delta * res
+    return lhs
+
+
+def _vcycle(levels, coarsesolve, rhs):
+    if not levels:
+        return coarsesolve(rhs)
+    (A, smooth, prolong, restrict), *coarser = levels
+    lhs = smooth(rhs, numpy.zeros(rhs.shape, dtype=numpy.result_type(A.dtype, rhs.dtype)))
+    lhs += prolong(_vcycle(coarser, coarsesolve, restrict(rhs - A @ lhs)))
+    return smooth(rhs, lhs)
+
+
+def _submatrix_pattern(indptr, indices, rows, cols):
+    '''Entries of a CSR pattern that are kept in a submatrix.
+
+    Returns the boolean mask of kept entries, or None if all entries are kept,
+    and the index pointer and column indices of the submatrix.'''
+
+    keep = rows.repeat(numpy.diff(indptr))
+    keep &= cols[indices]
+    count = numpy.concatenate([[0], keep.cumsum()])
+    return None if count[-1] == len(keep) else keep, count[indptr[numpy.concatenate([[True], rows])]], (cols.cumsum()-1)[indices[keep]]
+
+
+def _equal(a, b):
+    # Equality of preconditioner arguments, which may contain arrays.
+    if isinstance(a, numpy.ndarray) or isinstance(b, numpy.ndarray):
+        return isinstance(a, numpy.ndarray) and isinstance(b, numpy.ndarray) and numpy.array_equal(a, b)
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, (tuple, list)):
+        return type(a) == type(b) and len(a) == len(b) and all(map(_equal, a, b))
+    return a == b
+
+
 def _vdot(a, b=None):
     # Complex dot product that uses numpy.sum rather than a direct reduction for
     # slightly higher accuracy due to partial pairwise summation, see
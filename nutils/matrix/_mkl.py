@@ -3,6 +3,7 @@ from .. import numeric, _util as util, warnings
 from contextlib import contextmanager
 from ctypes import c_int, byref, CDLL
 import treelog as log
+import functools
 import os
 import numpy
 
@@ -49,7 +50,7 @@ class Pardiso:
         -12: 'pardiso_64 called from 32-bit library',
     }
 
-    def __init__(self, mtype, a, ia, ja, verbose=False, iparm={}):
+    def __init__(self, mtype, a, ia, ja, verbose=False, iparm=None):
         self.dtype = a.dtype
         self.pt = numpy.zeros(64, numpy.int64)  # handle to data structure
         self.maxfct = c_int(1)
@@ -62,17 +63,36 @@ class Pardiso:
         self.perm = None
         self.iparm = numpy.zeros(64, dtype=numpy.int32)  # https://software.intel.com/en-us/mkl-developer-reference-c-pardiso-iparm-parameter
         self.msglvl = c_int(verbose)
+        self.pattern = ia, ja, verbose, dict(iparm or {})
         libmkl.pardisoinit(self.pt.ctypes, byref(self.mtype), self.iparm.ctypes)  # initialize iparm based on mtype
         if self.iparm[0] != 1:
             raise MatrixError('pardiso init failed')
-        for n, v in iparm.items():
+        for n, v in self.pattern[3].items():
             self.iparm[n] = v
         self.iparm[10] = 1 # enable scaling (default for nonsymmetric matrices, recommended for highly indefinite symmetric matrices)
         self.iparm[12] = 1 # enable matching (default for nonsymmetric matrices, recommended for highly indefinite symmetric matrices)
         self.iparm[27] = 0 # double precision data
         self.iparm[34] = 0 # one-based indexing
         self.iparm[36] = 0 # csr matrix format
-        self._phase(12)  # analysis, numerical factorization
+        self.factorized = None
+        self._phase(11)  # analysis
+        self.factorize(a)
+
+    def matches(self, mtype, ia, ja, verbose=False, iparm=None):
+        '''Test if the analysis applies to a matrix of given type and pattern.'''
+
+        ia_, ja_, verbose_, iparm_ = self.pattern
+        return self.mtype.value == mtype and numpy.array_equal(ia_, ia) and numpy.array_equal(ja_, ja) and verbose_ == verbose and iparm_ == (iparm or {})
+
+    def factorize(self, a):
+        '''Numerical factorization of values with the analysed pattern.'''
+
+        if a.dtype != self.dtype or len(a) != self.pattern[0][-1]-1:
+            raise MatrixError('values do not match analysed pattern')
+        self.a = a.ctypes
+        self.factorized = None
+        self._phase(22)  # numerical factorization
+        self.factorized = a
         log.debug('peak memory use {:,d}k'.format(max(self.iparm[14], self.iparm[15]+self.iparm[16])))
 
     def __call__(self, rhs):
@@ -95,6 +115,30 @@ class Pardiso:
             warnings.warn('Pardiso failed to release its internal memory')
 
 
+def _pardiso(symbolic, mtype, a, ia, ja, **args):
+    '''Direct solver based on the Pardiso analysis in ``symbolic`` if applicable.
+
+    The symbolic analysis, which includes the fill-reducing reordering, depends
+    only on the sparsity pattern of the matrix. Matrices with the same pattern,
+    such as the jacobians of consecutive Newton iterations assembled by one
+    :class:`nutils.matrix.Assembler` and their submatrices of the same rows and
+    columns, share the ``symbolic`` mapping of the matrix, in which the Pardiso instance is retained per matrix type and only
+    numerically refactorized if the pattern and arguments match. The instance
+    is released with the last matrix or preconditioner that refers to it.'''
+
+    pardiso = symbolic.get(mtype)
+    if pardiso is None or not pardiso.matches(mtype, ia, ja, **args):
+        symbolic[mtype] = None  # release internal memory prior to the new analysis
+        pardiso = symbolic[mtype] = Pardiso(mtype, a, ia, ja, **args)
+    return functools.partial(_pardiso_solve, pardiso, a)
+
+
+def _pardiso_solve(pardiso, a, rhs):
+    if pardiso.factorized is not a:  # shared instance was refactorized for another matrix
+        pardiso.factorize(a)
+    return pardiso(rhs)
+
+
 class MKLMatrix(Matrix):
     '''matrix implementation based on sorted coo data'''
 
@@ -186,17 +230,9 @@ class MKLMatrix(Matrix):
         return MKLMatrix(data, rowptr, colidx, self.shape[1])
 
     def _submatrix(self, rows, cols):
-        keep = rows.repeat(numpy.diff(self.rowptr))
-        keep &= cols[self.colidx-1]
-        if keep.all():  # all nonzero entries are kept
-            rowptr = self.rowptr[numpy.hstack([True, rows])]
-            keep = slice(None)  # avoid array copies
-        else:
-            rowptr = numpy.cumsum([1] + [keep[i:j].sum() for i, j in numeric.overlapping(self.rowptr-1)[rows]], dtype=numpy.int32)
-        data = self.data[keep]
-        assert rowptr[-1] == len(data)+1
-        colidx = (self.colidx if cols.all() else cols.cumsum(dtype=numpy.int32)[self.colidx-1])[keep]
-        return MKLMatrix(data, rowptr, colidx, cols.sum())
+        keep, rowptr, colidx = self._cached_submatrix_pattern(self.rowptr-1, self.colidx-1, rows, cols)
+        data = self.data if keep is None else self.data[keep]  # avoid array copies if all entries are kept
+        return MKLMatrix(data, rowptr+1, colidx+1, cols.sum())
 
     def export(self, form):
         if form == 'dense':
@@ -265,7 +301,7 @@ class MKLMatrix(Matrix):
         return x
 
     def _precon_direct(self, **args):
-        return Pardiso(mtype=dict(f=11, c=13)[self.dtype.kind], a=self.data, ia=self.rowptr, ja=self.colidx, **args)
+        return _pardiso(self._symbolic, mtype=dict(f=11, c=13)[self.dtype.kind], a=self.data, ia=self.rowptr, ja=self.colidx, **args)
 
     def _precon_sym_direct(self, **args):
         upper = numpy.zeros(len(self.data), dtype=bool)
@@ -282,6 +318,6 @@ class MKLMatrix(Matrix):
             mtype = dict(f=2, c=4)
         else:
             mtype = dict(f=-2, c=6)
-        return Pardiso(mtype=mtype[self.dtype.kind], a=self.data[upper], ia=rowptr, ja=self.colidx[upper], **args)
+        return _pardiso(self._symbolic, mtype=mtype[self.dtype.kind], a=self.data[upper], ia=rowptr, ja=self.colidx[upper], **args)
 
 # vim:sw=4:sts=4:et
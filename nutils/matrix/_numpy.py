@@ -67,6 +67,11 @@ class NumpyMatrix(Matrix):
     def rowsupp(self, tol=0):
         return numpy.greater(abs(self.core), tol).any(axis=1)
 
+    def diagonal(self):
+        if self.shape[0] != self.shape[1]:
+            raise MatrixError('failed to extract diagonal: matrix is not square')
+        return self.core.diagonal().copy()
+
     def _precon_direct(self):
         return functools.partial(numpy.linalg.solve, self.core)
 
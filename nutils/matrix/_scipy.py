@@ -1,6 +1,7 @@
 from ._base import Matrix, MatrixError, BackendNotAvailable
 from .. import numeric
 import treelog as log
+import functools
 import numpy
 try:
     import scipy.sparse.linalg
@@ -73,6 +74,15 @@ class ScipyMatrix(Matrix):
 
     def _solver_scipy(self, rhs, method, atol, callback=None, precon=None, preconargs={}, **solverargs):
         solverfun = getattr(scipy.sparse.linalg, method)
+        # operators other than scipy matrices, such as a matrix.LinearOperator
+        # that borrows this method, are applied through their matmul, and
+        # through the conjugate of their transpose if that is available
+        if isinstance(self, ScipyMatrix):
+            A = self.core
+        elif getattr(self, 'rmatvec', None) is None:
+            A = scipy.sparse.linalg.LinearOperator(self.shape, self.__matmul__, dtype=self.dtype)
+        else:
+            A = scipy.sparse.linalg.LinearOperator(self.shape, self.__matmul__, rmatvec=functools.partial(_adjointmatvec, self.T), dtype=self.dtype)
         if precon is not None:
             precon = scipy.sparse.linalg.LinearOperator(self.shape, self.getprecon(precon, **preconargs), dtype=self.dtype)
         with log.context(method + ' {:.0f}%', 0) as reformat:
@@ -82,7 +92,7 @@ class ScipyMatrix(Matrix):
                 if callback:
                     callback(res)
                 reformat(100 * numpy.log10(max(atol, res)) / numpy.log10(atol))
-            lhs, status = solverfun(self.core, rhs, M=precon, tol=0., atol=atol, callback=mycallback, **solverargs)
+            lhs, status = solverfun(A, rhs, M=precon, tol=0., atol=atol, callback=mycallback, **solverargs)
         if status != 0:
             raise Exception('status {}'.format(status))
         return lhs
@@ -100,9 +110,15 @@ class ScipyMatrix(Matrix):
         return self._precon_spilu(fill_factor=1., **kwargs)
 
     def _submatrix(self, rows, cols):
-        return ScipyMatrix(self.core[rows, :][:, cols])
+        csr = self.core.tocsr()
+        keep, indptr, indices = self._cached_submatrix_pattern(csr.indptr, csr.indices, rows, cols)
+        return ScipyMatrix(scipy.sparse.csr_matrix((csr.data if keep is None else csr.data[keep], indices, indptr), shape=(rows.sum(), cols.sum())))
 
     def diagonal(self):
         return self.core.diagonal()
 
+
+def _adjointmatvec(T, x):
+    return (T @ x.conj()).conj()
+
 # vim:sw=4:sts=4:et
@@ -1,8 +1,10 @@
 """
-The parallel module provides tools aimed at parallel computing. At this point
-all parallel solutions use the ``fork`` system call and are supported on limited
+The parallel module provides tools aimed at parallel computing. By default
+parallel solutions use the ``fork`` system call and are supported on limited
 platforms, notably excluding Windows. On unsupported platforms parallel features
-will disable and a warning is printed.
+will disable and a warning is printed. Alternatively, :func:`distribute` can
+be configured via :func:`backend` to use a pool of threads, which benefits
+from numerical kernels that release the global interpreter lock.
 """
 
 from . import numeric, warnings, _util as util
@@ -11,6 +13,8 @@ import multiprocessing
 import mmap
 import signal
 import contextlib
+import concurrent.futures
+import threading
 import builtins
 import numpy
 import treelog
@@ -24,6 +28,14 @@ def maxprocs(nprocs: int = 1):
     return nprocs
 
 
+@util.set_current
+@util.defaults_from_env
+def backend(parallel: str = 'fork'):
+    if parallel not in ('fork', 'thread'):
+        raise ValueError(f'parallel requires either "fork" or "thread" but got {parallel!r}')
+    return parallel
+
+
 def fork(nprocs=None):
     '''Returns a context manager that forks ``nprocs-1`` times when entered.
 
@@ -108,7 +120,7 @@ def shempty(shape, dtype=float):
         shape = tuple(sh.__index__() for sh in shape)
     dtype = numpy.dtype(dtype)
     size = util.product(shape, int(dtype.itemsize))
-    if size == 0 or maxprocs.current == 1:
+    if size == 0 or maxprocs.current == 1 or backend.current == 'thread':
         return numpy.empty(shape, dtype)
     # `mmap(-1,...)` will allocate *anonymous* memory.  Although linux' man page
     # mmap(2) states that anonymous memory is initialized to zero, we can't rely
@@ -126,22 +138,35 @@ def shzeros(shape, dtype=float):
 
 
 class range:
-    '''a shared range-like iterable that yields every index exactly once'''
+    '''a shared range-like iterable that yields every index exactly once
+
+    Indices are claimed in chunks following a guided schedule: every claim
+    takes a fraction ``1/(2*nprocs)`` of the remaining indices, with
+    ``nprocs`` the value of :func:`maxprocs` at construction. This keeps lock
+    contention low while there is plenty of work left, and balances the load
+    as the work runs out.
+    '''
 
     def __init__(self, stop):
         self._stop = stop
+        self._nprocs = maxprocs.current
         self._index = multiprocessing.RawValue('i', 0)
         self._lock = multiprocessing.Lock()  # lock to avoid race conditions in incrementing index
+        self._chunk = threading.local()  # the current chunk is private to each thread and, after forking, to each process
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        with self._lock:
-            iiter = self._index.value  # claim next value
-            if iiter >= self._stop:
-                raise StopIteration
-            self._index.value = iiter + 1
+        iiter, stop = getattr(self._chunk, 'bounds', (0, 0))
+        if iiter == stop:
+            with self._lock:
+                iiter = self._index.value  # claim next chunk
+                if iiter >= self._stop:
+                    raise StopIteration
+                stop = iiter + builtins.max((self._stop - iiter) // (2 * self._nprocs), 1)
+                self._index.value = stop
+        self._chunk.bounds = iiter + 1, stop
         return iiter
 
 
@@ -154,6 +179,47 @@ def ctxrange(name, nitems):
         yield wrprng
 
 
+def distribute(name, nitems):
+    '''Returns a decorator that distributes ``nitems`` over concurrent calls.
+
+    The decorated function is called immediately and concurrently, in forked
+    processes or in a pool of threads depending on :func:`backend`, with a
+    shared range-like iterable that yields every index exactly once. The
+    decorator returns ``None``.
+
+    >>> a = shzeros([4], dtype=int)
+    >>> @distribute('test', len(a))
+    ... def worker(r):
+    ...     for i in r:
+    ...         a[i] = i
+    >>> a.tolist()
+    [0, 1, 2, 3]
+    '''
+
+    def decorator(worker):
+        if backend.current == 'thread':
+            _threadpool(name, nitems, worker)
+        else:
+            with ctxrange(name, nitems) as rng:
+                worker(rng)
+
+    return decorator
+
+
+def _threadpool(name, nitems, worker):
+    '''helper function for distribute'''
+
+    nthreads = builtins.min(maxprocs.current, nitems)
+    rng = range(nitems)  # shared range, thread safe by virtue of its lock
+    with maxprocs(1), concurrent.futures.ThreadPoolExecutor(builtins.max(nthreads-1, 1)) as executor:
+        futures = [executor.submit(worker, rng) for ithread in builtins.range(1, nthreads)]
+        # The main thread is the only one that logs progress.
+        with treelog.iter.wrap(_pct(name, nitems), rng) as wrprng:
+            worker(wrprng)
+        for future in futures:
+            future.result()
+
+
 def _pct(name, n):
     '''helper function for ctxrange'''
 
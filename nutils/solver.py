@@ -180,9 +180,41 @@ class MedianBased:
         return min(max(scale, self.minscale), self.maxscale), scale >= self.acceptscale
 
 
+# JACOBIAN REFRESH
+
+@dataclass(eq=True, frozen=True)
+class RateBased:
+    '''
+    Jacobian refresh abstraction for modified Newton iterations, reusing the
+    jacobian for as long as every update reduces the residual norm by at least
+    a constant factor.
+
+    Parameters
+    ----------
+    rate : :class:`float`
+        Largest ratio of the residual norms after and before an update for
+        which the jacobian is reused. Must be strictly greater than zero. A
+        value of one or larger reuses the jacobian for ``maxage`` updates
+        regardless of convergence.
+    maxage : :class:`int`
+        Maximum number of updates per jacobian. Must be at least one.
+    '''
+
+    rate: float = .1
+    maxage: int = 10
+
+    def __post_init__(self):
+        assert isinstance(self.rate, float), f'rate={self.rate!r}'
+        assert isinstance(self.maxage, int), f'maxage={self.maxage!r}'
+        assert self.rate > 0 and self.maxage >= 1
+
+    def __call__(self, resnorm0, resnorm1, age):
+        return age >= self.maxage or not resnorm1 <= self.rate * resnorm0
+
+
 # SOLVERS
 
-def solve_linear(target, residual, *, constrain = None, lhs0: types.arraydata = None, arguments = {}, **kwargs):
+def solve_linear(target, residual, *, constrain = None, lhs0: types.arraydata = None, arguments = {}, matrixfree: bool = False, **kwargs):
     '''solve linear problem
 
     Parameters
@@ -192,47 +224,100 @@ def solve_linear(target, residual, *, constrain = None, lhs0: types.arraydata =
     residual : :class:`nutils.evaluable.AsEvaluableArray`
         Residual integral, depends on ``target``
     constrain : :class:`numpy.ndarray` with dtype :class:`float`
-        Defines the fixed entries of the coefficient vector
-    arguments : :class:`collections.abc.Mapping`
+        Defines the fixed entries of the coefficient vector. In case
+        ``arguments`` is a list, this can be a list of the same length that
+        defines the values per problem, which must fix the same entries.
+    arguments : :class:`collections.abc.Mapping` or :class:`list` of mappings
         Defines the values for :class:`nutils.function.Argument` objects in
         `residual`.  The ``target`` should not be present in ``arguments``.
-        Optional.
+        Optional. A list of mappings defines a batch of problems, such as load
+        cases, that share the jacobian: it is assembled and factorized once,
+        and all right hand sides are solved for in a single multi-column
+        solve, which uses the direct solver unless ``linsolver`` specifies
+        otherwise. The jacobian must therefore not depend on arguments that
+        vary within the batch.
+    matrixfree : :class:`bool`
+        If true, solve without assembling the jacobian, by evaluating its
+        products with vectors as directional derivatives of the residual. Only
+        the diagonal is assembled, which serves as the approximation that
+        defines the preconditioners; the default solver and preconditioner
+        therefore amount to Jacobi preconditioned arnoldi iterations. Defaults
+        to false.
 
     Returns
     -------
     :class:`numpy.ndarray`
-        Array of ``target`` values for which ``residual == 0``'''
+        Array of ``target`` values for which ``residual == 0``, or a list
+        thereof in case ``arguments`` is a list.'''
 
+    batch = isinstance(arguments, (list, tuple))
+    constrains = batch and isinstance(constrain, (list, tuple))
+    if constrains and len(constrain) != len(arguments):
+        raise ValueError('constrain and arguments should be lists of the same length')
     if isinstance(target, str) and ',' not in target and ':' not in target:
-        return solve_linear([target], [residual], constrain={} if constrain is None else {target: constrain},
-            lhs0=lhs0, arguments=arguments if lhs0 is None else {**arguments, target: lhs0}, **kwargs)[target]
+        if lhs0 is not None:
+            arguments = [{**a, target: lhs0} for a in arguments] if batch else {**arguments, target: lhs0}
+        if constrain is not None:
+            constrain = [{target: c} for c in constrain] if constrains else {target: constrain}
+        lhs = solve_linear([target], [residual], constrain=constrain,
+            arguments=arguments, matrixfree=matrixfree, **kwargs)
+        return [l[target] for l in lhs] if batch else lhs[target]
     if lhs0 is not None:
         raise ValueError('lhs0 argument is invalid for a non-string target; define the initial guess via arguments instead')
     target, residual = _target_helper(target, residual)
     solveargs = _strip(kwargs, 'lin')
     if kwargs:
         raise TypeError('unexpected keyword arguments: {}'.format(', '.join(kwargs)))
-    return _solve_linear(target, residual,
-        types.frozendict((k, types.arraydata(v)) for k, v in (constrain or {}).items()),
-        types.frozendict((k, types.arraydata(v)) for k, v in (arguments or {}).items()),
-        types.frozendict(solveargs))
+    if not batch:
+        arguments = [arguments]
+    lhs = _solve_linear(target, residual,
+        tuple(types.frozendict((k, types.arraydata(v)) for k, v in (c or {}).items()) for c in (constrain if constrains else [constrain] * len(arguments))),
+        tuple(types.frozendict((k, types.arraydata(v)) for k, v in (a or {}).items()) for a in arguments),
+        matrixfree, types.frozendict(solveargs))
+    return list(lhs) if batch else lhs[0]
 
 
 @cache.function
-def _solve_linear(target, residual: tuple, constraints: dict, arguments: dict, solveargs: dict):
-    arguments, constraints = _parse_lhs_cons(constraints, target, _argobjs(residual), arguments)
+def _solve_linear(target, residual: tuple, constraints: tuple, batch: tuple, matrixfree: bool, solveargs: dict):
+    if not batch:
+        return ()
+    argobjs = _argobjs(residual)
     jacobians = _derivative(residual, target)
-    if not set(target).isdisjoint(_argobjs(jacobians)):
+    jacargs = _argobjs(jacobians)
+    if not set(target).isdisjoint(jacargs):
         raise SolverError('problem is not linear')
-    dtype = _determine_dtype(target, residual, arguments, constraints)
-    lhs, vlhs = _redict(arguments, target, dtype)
+    batch = [_parse_lhs_cons(constrain, target, argobjs, arguments) for constrain, arguments in zip(constraints, batch)]
+    reference, constraints = batch[0]
+    if not all(numpy.array_equal(constrain[t], constraints[t]) for _, constrain in batch for t in target):
+        raise SolverError('constraints fix different entries within the batch')
+    varying = {name for arguments, _ in batch for name in {*arguments, *reference}
+        if name not in arguments or name not in reference or not numpy.array_equal(arguments[name], reference[name])}
+    if not varying.isdisjoint(jacargs):
+        raise SolverError('jacobian depends on arguments that vary within the batch: {}'.format(', '.join(sorted(varying.intersection(jacargs)))))
+    dtype = complex if any(_determine_dtype(target, residual, arguments, constrain) == complex for arguments, constrain in batch) else float
+    batch = [_redict(arguments, target, dtype) for arguments, _ in batch]
     mask, vmask = _invert(constraints, target)
-    res, jac = _integrate_blocks(residual, jacobians, arguments=lhs, mask=mask)
-    vlhs[vmask] -= jac.solve(res, **solveargs)
-    return lhs
-
-
-def newton(target, residual, *, jacobian = None, lhs0 = None, relax0: float = 1., constrain = None, linesearch=NormBased(), failrelax: float = 1e-6, arguments = {}, **kwargs):
+    lhs, vlhs = batch[0]
+    if matrixfree:
+        res, diag = _integrate_vectors(residual, _diagonal(jacobians, mask), arguments=lhs, mask=mask)
+        matvec = functools.partial(_directional_eval, _directional(residual, target), target, lhs, mask)
+        jac = matrix.LinearOperator(matvec, (len(diag), len(diag)), diag.dtype, matrix.diag(diag))
+    else:
+        res, jac = _integrate_blocks(residual, jacobians, arguments=lhs, mask=mask)
+    if len(batch) == 1:
+        vlhs[vmask] -= jac.solve(res, **solveargs)
+    else:
+        res = numpy.stack([res] + [_integrate_vectors(residual, arguments=lhs, mask=mask)[0] for lhs, vlhs in batch[1:]], axis=1)
+        if matrixfree:  # krylov iterations do not benefit from multiple columns
+            dlhs = [jac.solve(r, **solveargs) for r in res.T]
+        else:  # all columns are solved for with a single factorization
+            dlhs = jac.solve(res, **{'solver': 'direct', **solveargs}).T
+        for (lhs, vlhs), d in zip(batch, dlhs):
+            vlhs[vmask] -= d
+    return tuple(lhs for lhs, vlhs in batch)
+
+
+def newton(target, residual, *, jacobian = None, lhs0 = None, relax0: float = 1., constrain = None, linesearch=NormBased(), failrelax: float = 1e-6, arguments = {}, matrixfree: int = 0, refresh=None, **kwargs):
     '''iteratively solve nonlinear problem by gradient descent
 
     Generates targets such that residual approaches 0 using Newton procedure with
@@ -264,12 +349,29 @@ def newton(target, residual, *, jacobian = None, lhs0 = None, relax0: float = 1.
         candidate residual and directional derivative, with derivatives
         normalized to unit length; and returns the optimal scaling and a
         boolean flag that marks whether the candidate should be accepted.
+        Candidates that follow a rejection are evaluated without assembling
+        the jacobian, by computing the directional derivative in forward mode.
     failrelax : :class:`float`
         Fail with exception if relaxation reaches this lower limit.
     arguments : :class:`collections.abc.Mapping`
         Defines the values for :class:`nutils.function.Argument` objects in
         `residual`. If ``target`` is present in ``arguments`` then it is used
         as the initial guess for the iterative procedure.
+    matrixfree : :class:`int`
+        If positive, solve the linear systems without assembling the jacobian,
+        by evaluating its products with vectors as directional derivatives of
+        the residual. The jacobian is then assembled only every ``matrixfree``
+        iterations to serve as preconditioner. Defaults to zero, which
+        assembles the jacobian in every iteration.
+    refresh : Callable[[float, float, int], bool]
+        Callable that defines the jacobian refresh logic of modified Newton
+        iterations, which reuse the jacobian of an earlier iteration along with
+        its factorization. The callable takes three arguments: the residual
+        norms before and after the current update, and the number of updates
+        since the jacobian was assembled; and returns a boolean flag that marks
+        whether the jacobian should be reassembled. While the jacobian is
+        reused, line search steps evaluate only the residual. Defaults to None,
+        which assembles the jacobian in every iteration.
 
     Yields
     ------
@@ -280,7 +382,7 @@ def newton(target, residual, *, jacobian = None, lhs0 = None, relax0: float = 1.
     if isinstance(target, str) and ',' not in target and ':' not in target:
         return newton([target], [residual], jacobian=None if jacobian is None else [jacobian],
             relax0=relax0, constrain={} if constrain is None else {target: constrain}, linesearch=linesearch,
-            failrelax=failrelax, arguments=arguments if lhs0 is None else {**arguments, target: lhs0}, **kwargs)[target]
+            failrelax=failrelax, arguments=arguments if lhs0 is None else {**arguments, target: lhs0}, matrixfree=matrixfree, refresh=refresh, **kwargs)[target]
     if lhs0 is not None:
         raise ValueError('lhs0 argument is invalid for a non-string target; define the initial guess via arguments instead')
     target, residual = _target_helper(target, residual)
@@ -288,15 +390,17 @@ def newton(target, residual, *, jacobian = None, lhs0 = None, relax0: float = 1.
     solveargs.setdefault('rtol', 1e-3)
     if kwargs:
         raise TypeError('unexpected keyword arguments: {}'.format(', '.join(kwargs)))
+    if matrixfree and refresh:
+        raise ValueError('matrixfree and refresh arguments are mutually exclusive')
     return _with_solve(_newton(target, residual, None if jacobian is None else tuple(jacobian),
         types.frozendict((k, types.arraydata(v)) for k, v in (constrain or {}).items()),
         types.frozendict((k, types.arraydata(v)) for k, v in (arguments or {}).items()),
-        linesearch, relax0, failrelax, types.frozendict(solveargs)))
+        linesearch, relax0, failrelax, matrixfree, refresh, types.frozendict(solveargs)))
 
 
 class _newton(cache.Recursion, length=1):
 
-    def __init__(self, target, residual, jacobian, constrain, arguments, linesearch, relax0: float, failrelax: float, solveargs):
+    def __init__(self, target, residual, jacobian, constrain, arguments, linesearch, relax0: float, failrelax: float, matrixfree: int, refresh, solveargs):
         super().__init__()
         self.target = target
         self.residual = residual
@@ -306,10 +410,46 @@ class _newton(cache.Recursion, length=1):
         self.relax0 = relax0
         self.linesearch = linesearch
         self.failrelax = failrelax
+        self.matrixfree = matrixfree
+        self.refresh = refresh
         self.solveargs = solveargs
-
-    def _eval(self, lhs, mask):
-        return _integrate_blocks(self.residual, self.jacobian, arguments=lhs, mask=mask)
+        self.assemble = matrix.Assembler()
+
+    @functools.cached_property
+    def directional(self):
+        return _directional(self.residual, self.target)
+
+    def _eval(self, lhs, mask, reuse=None):
+        # Residual and jacobian, of which the assembly is skipped in favour of
+        # the jacobian to reuse if given, or that of the preconditioner in
+        # matrix free mode.
+        if reuse is None:
+            res, jac = _integrate_blocks(self.residual, self.jacobian, arguments=lhs, mask=mask, assemble=self.assemble)
+        else:
+            res, = _integrate_vectors(self.residual, arguments=lhs, mask=mask)
+            jac = reuse
+        return res, self._operator(lhs, mask, jac)
+
+    def _eval_jacobian(self, lhs, mask, reuse=None):
+        # Jacobian only, for points of which the residual is already known.
+        if reuse is None:
+            reuse = _integrate_jacobian(self.jacobian, arguments=lhs, mask=mask, assemble=self.assemble)
+        return self._operator(lhs, mask, reuse)
+
+    def _eval_directional(self, lhs, mask, dlhs):
+        # Residual and its derivative in direction dlhs from a single kernel
+        # that does not form the jacobian.
+        return _integrate_vectors(self.residual, self.directional, arguments=_direction_arguments(self.target, lhs, mask, dlhs), mask=mask)
+
+    def _operator(self, lhs, mask, jac):
+        # In matrix free mode, wrap the assembled jacobian (or the one of an
+        # earlier iteration) as a preconditioner of the exact linearization.
+        if not self.matrixfree:
+            return jac
+        if isinstance(jac, matrix.LinearOperator):
+            jac = jac.matrix
+        matvec = functools.partial(_directional_eval, self.directional, self.target, {t: v.copy() for t, v in lhs.items()}, mask)
+        return matrix.LinearOperator(matvec, jac.shape, jac.dtype, jac)
 
     def resume(self, history):
         mask, vmask = _invert(self.constrain, self.target)
@@ -323,14 +463,18 @@ class _newton(cache.Recursion, length=1):
             res, jac = self._eval(lhs, mask)
             relax = self.relax0
             yield lhs, types.attributes(resnorm=numpy.linalg.norm(res), relax=relax)
-        while True:
+        age = 0  # number of updates since the jacobian was assembled
+        for iiter in itertools.count(1):
             dlhs = -jac.solve_leniently(res, **self.solveargs)  # compute new search vector
             res0 = res
             dres = jac@dlhs  # == -res if dlhs was solved to infinite precision
             vlhs[vmask] += relax * dlhs
-            res, jac = self._eval(lhs, mask)
+            reuse = jac if self.refresh or self.matrixfree and iiter % self.matrixfree else None
+            res, jac = self._eval(lhs, mask, reuse)
             if self.linesearch:
                 scale, accept = self.linesearch(res0, relax*dres, res, relax*(jac@dlhs))
+                if not accept and not self.refresh:
+                    jac = None  # trial steps evaluate the directional derivative instead
                 while not accept:  # line search
                     assert scale < 1
                     oldrelax = relax
@@ -338,10 +482,23 @@ class _newton(cache.Recursion, length=1):
                     if relax <= self.failrelax:
                         raise SolverError('stuck in local minimum')
                     vlhs[vmask] += (relax - oldrelax) * dlhs
-                    res, jac = self._eval(lhs, mask)
-                    scale, accept = self.linesearch(res0, relax*dres, res, relax*(jac@dlhs))
+                    if jac is None:
+                        res, dres1 = self._eval_directional(lhs, mask, dlhs)
+                    else:
+                        res, jac = self._eval(lhs, mask, reuse)
+                        dres1 = jac@dlhs
+                    scale, accept = self.linesearch(res0, relax*dres, res, relax*dres1)
+                if jac is None:
+                    jac = self._eval_jacobian(lhs, mask, reuse)
                 log.info('update accepted at relaxation', round(relax, 5))
                 relax = min(relax * scale, 1)
+            if self.refresh:
+                age += 1
+                if self.refresh(numpy.linalg.norm(res0), numpy.linalg.norm(res), age):
+                    jac = _integrate_jacobian(self.jacobian, arguments=lhs, mask=mask, assemble=self.assemble)
+                    age = 0
+                else:
+                    log.info('reusing jacobian of {} updates ago'.format(age))
             yield lhs, types.attributes(resnorm=numpy.linalg.norm(res), relax=relax)
 
 
@@ -418,9 +575,10 @@ class _minimize(cache.Recursion, length=1, version=3):
         self.rampdown = rampdown
         self.failrelax = failrelax
         self.solveargs = solveargs
+        self.assemble = matrix.Assembler()
 
     def _eval(self, lhs, mask):
-        return _integrate_blocks(self.energy, self.residual, self.jacobian, arguments=lhs, mask=mask)
+        return _integrate_blocks(self.energy, self.residual, self.jacobian, arguments=lhs, mask=mask, assemble=self.assemble)
 
     def resume(self, history):
         mask, vmask = _invert(self.constrain, self.target)
@@ -541,9 +699,10 @@ class _pseudotime(cache.Recursion, length=1):
         self.dtype = _determine_dtype(target, residual+inertia, self.lhs0, self.constrain)
         self.timestep = timestep
         self.solveargs = solveargs
+        self.assemble = matrix.Assembler()
 
     def _eval(self, lhs, mask, timestep):
-        return _integrate_blocks(self.residuals, self.jacobians, arguments=dict({self.timesteptarget: timestep}, **lhs), mask=mask)
+        return _integrate_blocks(self.residuals, self.jacobians, arguments=dict({self.timesteptarget: timestep}, **lhs), mask=mask, assemble=self.assemble)
 
     def resume(self, history):
         mask, vmask = _invert(self.constrain, self.target)
@@ -738,7 +897,8 @@ def _optimize(target, functional: evaluable.asarray, constrain, arguments, tol:
     dtype = _determine_dtype(target, (functional,), lhs0, constrain)
     mask, vmask = _invert(constrain, target)
     lhs, vlhs = _redict(lhs0, target, dtype)
-    val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask)
+    assemble = matrix.Assembler()
+    val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask, assemble=assemble)
     if droptol is not None:
         supp = jac.rowsupp(droptol)
         res = res[supp]
@@ -766,7 +926,7 @@ def _optimize(target, functional: evaluable.asarray, constrain, arguments, tol:
                     relax0 = 0
                 vlhs[vmask] += (relax - relax0) * dlhs
                 relax0 = relax  # currently applied relaxation
-                val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask)
+                val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask, assemble=assemble)
                 resnorm = numpy.linalg.norm(res)
                 scale, accept = linesearch(res0, relax*dres, res, relax*(jac@dlhs))
                 relax = min(relax * scale, 1)
@@ -857,7 +1017,7 @@ def _invert(cons, targets):
     return tuple(mask), vmask
 
 
-def _integrate_blocks(*blocks, arguments, mask):
+def _integrate_blocks(*blocks, arguments, mask, assemble=None):
     '''helper function for blockwise integration'''
 
     *scalars, residuals, jacobians = blocks
@@ -866,9 +1026,85 @@ def _integrate_blocks(*blocks, arguments, mask):
     data = iter(evaluable.eval_sparse((*scalars, *residuals, *jacobians), **arguments))
     nrg = [sparse.toarray(next(data)) for _ in range(len(scalars))]
     res = [sparse.take(next(data), [m]) for m in mask]
-    jac = [[sparse.take(next(data), [mi, mj]) for mj in mask] for mi in mask]
+    jac = _assemble_blocks(data, mask, assemble)
+    assert not list(data)
+    return nrg + [sparse.toarray(sparse.block(res)), jac]
+
+
+def _integrate_jacobian(jacobians, *, arguments, mask, assemble=None):
+    '''helper function for blockwise integration of the jacobian only'''
+
+    assert len(jacobians) == len(mask)**2
+    data = iter(evaluable.eval_sparse(jacobians, **arguments))
+    jac = _assemble_blocks(data, mask, assemble)
+    assert not list(data)
+    return jac
+
+
+def _assemble_blocks(data, mask, assemble):
+    '''assemble matrix from an iterator of sparse jacobian blocks'''
+
+    jac = sparse.block([[sparse.take(next(data), [mi, mj]) for mj in mask] for mi in mask])
+    jac = assemble(jac) if assemble else matrix.fromsparse(jac, inplace=True)
+    if len(mask) > 1:
+        jac = matrix.BlockMatrix(jac, [m.sum() for m in mask])
+    return jac
+
+
+def _integrate_vectors(*vectors, arguments, mask):
+    '''helper function for blockwise integration of vectors only'''
+
+    assert all(len(v) == len(mask) for v in vectors)
+    data = iter(evaluable.eval_sparse(tuple(f for v in vectors for f in v), **arguments))
+    vecs = [sparse.toarray(sparse.block([sparse.take(next(data), [m]) for m in mask])) for v in vectors]
     assert not list(data)
-    return nrg + [sparse.toarray(sparse.block(res)), matrix.fromsparse(sparse.block(jac), inplace=True)]
+    return vecs
+
+
+def _directional(residual, target):
+    '''directional derivatives of residuals in the directions of arguments _direction_<target>'''
+
+    # Forward mode: differentiate res(lhs + eps direction) to scalar eps at
+    # eps=0, which avoids forming the element jacobians.
+    argobjs = _argobjs(residual)
+    eps = evaluable.Argument('_direction', (), argobjs[target[0]].dtype)
+    replace = {t: argobjs[t] + eps * evaluable.Argument('_direction_' + t, argobjs[t].shape, argobjs[t].dtype) for t in target}
+    zero = {eps.name: evaluable.zeros((), eps.dtype)}
+    return tuple(evaluable.replace_arguments(evaluable.derivative(evaluable.replace_arguments(res, replace), eps), zero).simplified for res in residual)
+
+
+def _diagonal(jacobians, mask):
+    '''diagonals of the square blocks of a blockwise jacobian'''
+
+    diagonals = []
+    for i, m in enumerate(mask):
+        diagonal = jacobians[i*len(mask)+i]
+        for axis in range(m.ndim):
+            diagonal = evaluable.takediag(diagonal, axis, m.ndim)
+        diagonals.append(diagonal.simplified)
+    return tuple(diagonals)
+
+
+def _directional_eval(directional, targets, arguments, mask, x):
+    '''evaluate directional derivatives for a direction vector of free dofs'''
+
+    dres, = _integrate_vectors(directional, arguments=_direction_arguments(targets, arguments, mask, x), mask=mask)
+    return dres
+
+
+def _direction_arguments(targets, arguments, mask, x):
+    '''extend arguments with _direction_<target> for a direction vector of free dofs'''
+
+    arguments = dict(arguments)
+    offset = 0
+    for target, m in zip(targets, mask):
+        direction = numpy.zeros(m.shape, dtype=arguments[target].dtype)
+        n = offset + m.sum()
+        direction[m] = x[offset:n]
+        arguments['_direction_' + target] = direction
+        offset = n
+    assert offset == len(x)
+    return arguments
 
 
 def _argobjs(funcs):
@@ -126,7 +126,7 @@ def dedup(data, inplace=False):
     if keep.all():
         return data
     elif inplace:
-        buf = numpy.empty(chunksize // data.dtype.itemsize or 1, dtype=data.dtype)
+        buf = numpy.empty(min(chunksize // data.dtype.itemsize, len(data)) or 1, dtype=data.dtype)
         n, = numpy.hstack([True, keep, True]).nonzero()
         for i in range(0, len(n)-1, len(buf)):
             s = numpy.diff(n[i:i+len(buf)+1])
@@ -148,6 +148,38 @@ def dedup(data, inplace=False):
         return dedup
 
 
+def unique(data):
+    '''Unique indices and inverse.
+
+    Unique returns the sorted, deduplicated indices of a sparse object, as
+    obtained by :func:`dedup`, along with an integer array that maps every entry
+    of the input to its position in the deduplicated object. Unlike ``dedup``
+    the input is left untouched, such that the mapping can be used to sum values
+    of any sparse object with the same indices into the deduplicated positions
+    without sorting, for instance by :func:`numpy.bincount`.
+
+    >>> from nutils.sparse import dtype, unique
+    >>> from numpy import array
+    >>> A = array([((0,1),.1), ((1,0),.2), ((0,1),.3)], dtype=dtype([2,2]))
+    >>> index, inverse = unique(A)
+    >>> index
+    array([(0, 1), (1, 0)],
+          dtype=[((2, 'i0'), 'u1'), ((2, 'i1'), 'u1')])
+    >>> inverse
+    array([0, 1, 0])
+    '''
+
+    index = numpy.ascontiguousarray(data['index'])
+    inverse = numpy.empty(len(index), dtype=int)
+    if not len(index):
+        return index, inverse
+    order = index.view(numpy.void).argsort(kind='stable')
+    index = index[order]
+    keep = numpy.hstack([True, index[1:] != index[:-1]])
+    inverse[order] = keep.cumsum() - 1
+    return index[keep], inverse
+
+
 def prune(data, inplace=False, mask=None):
     '''Prune zero values.
 
@@ -170,7 +202,7 @@ def prune(data, inplace=False, mask=None):
     if mask.all():
         return data
     elif inplace:
-        buf = numpy.empty(chunksize // data.dtype.itemsize or 1, dtype=data.dtype)
+        buf = numpy.empty(min(chunksize // data.dtype.itemsize, len(data)) or 1, dtype=data.dtype)
         nz, = mask.nonzero()
         for i in range(0, len(nz), len(buf)):
             s = nz[i:i+len(buf)]
@@ -342,6 +374,65 @@ def fromarray(data):
         index['i'+str(i)] = numpy.arange(sh).reshape([-1]+[1]*(data.ndim-i-1))
     return retval
 
+
+def fromchunks(chunks, shape, vtype=numpy.float64, bufsize=None):
+    '''Assemble sparse object from chunks of coordinate data.
+
+    Every chunk is a tuple of one index array per dimension of ``shape``
+    followed by an array of values, where the index arrays broadcast against
+    the values. The ``chunks`` sequence is iterated twice and left unchanged.
+
+    If ``bufsize`` is specified and the chunks hold more than ``bufsize``
+    bytes of entries, the sparse object is assembled in a buffer that holds
+    the deduplicated entries copied so far plus a slab of ``bufsize`` bytes
+    of new entries. Whenever the slab is full, it is deduplicated and merged
+    into the sorted entries that precede it. The returned sparse object is
+    then deduplicated, and therefore sorted, while the memory of the assembly
+    is bounded by the size of the result plus one slab, rather than by the
+    total size of all chunks. Smaller sparse objects are returned with the
+    entries in the order of the chunks.
+
+    >>> from nutils.sparse import fromchunks
+    >>> from numpy import array
+    >>> fromchunks([(array([0, 0]), array([1, 1]), array([.1, .3])), (array([1]), array([0]), array([.2]))], [2, 2], bufsize=20)
+    array([((0, 1),  0.4), ((1, 0),  0.2)],
+          dtype=[('index', [((2, 'i0'), 'u1'), ((2, 'i1'), 'u1')]), ('value', '<f8')])
+    '''
+
+    sparsetype = dtype(shape, vtype)
+    total = sum(numpy.size(values) for *indices, values in chunks)
+    if bufsize and len(shape) and total * sparsetype.itemsize > bufsize:
+        nslab = max(bufsize // sparsetype.itemsize, 1)
+    else:
+        nslab = total
+    data = numpy.empty(nslab, dtype=sparsetype)
+    n = 0  # number of entries in data
+    ndedup = 0  # number of leading entries of data that are deduplicated
+    for *indices, values in chunks:
+        values = numpy.asarray(values)
+        indices = [numpy.broadcast_to(index, values.shape) for index in indices]
+        # Copy the chunk in slices along the first axis, such that a slice
+        # does not exceed the remainder of the current slab.
+        rowsize = values.size // len(values) if values.ndim and len(values) else 1
+        i = 0
+        while i < (len(values) if values.ndim else 1):
+            if n - ndedup >= nslab:
+                n = ndedup = _merge(data, ndedup, n)
+            j = i + max((nslab - (n - ndedup)) // rowsize, 1)
+            s = slice(i, j) if values.ndim else ...
+            size = values[s].size
+            if n + size > len(data):
+                grown = numpy.empty(n + max(size, nslab), dtype=sparsetype)
+                grown[:n] = data[:n]
+                data = grown
+            _copy(data[n:n+size], indices, values, s)
+            n += size
+            i = j
+    if nslab < total:
+        n = _merge(data, ndedup, n)
+    return _resize(data, n)
+
+
 # internal methods
 
 
@@ -353,6 +444,37 @@ def _uint(n):
     return numpy.dtype('>u'+str(1 if n <= 256 else 2 if n <= 256**2 else 4 if n <= 256**4 else 8))
 
 
+def _copy(data, indices, values, s):
+    data = data.reshape(values[s].shape)
+    data['value'] = values[s]
+    for idim, index in enumerate(indices):
+        data['index']['i'+str(idim)] = index[s]
+
+
+def _merge(data, ndedup, n):
+    # Deduplicate the entries data[ndedup:n] and merge them into the sorted,
+    # deduplicated entries data[:ndedup]. Returns the number of entries.
+    slab = dedup(data[ndedup:n], inplace=True)
+    if not ndedup:
+        return len(slab)
+    index = data['index'][:ndedup]
+    pos = numpy.searchsorted(index, slab['index'])
+    match = pos < ndedup
+    match[match] = index[pos[match]] == slab['index'][match]
+    data['value'][pos[match]] += slab['value'][match]
+    new = slab[~match]  # copy
+    pos = pos[~match]
+    del slab, index
+    # Shift the entries of data[:ndedup] to make room for the new entries,
+    # starting at the end such that no entry is overwritten before it moves.
+    step = max(chunksize // data.dtype.itemsize, 1)
+    for i in reversed(range(0, ndedup, step)):
+        src = numpy.arange(i, min(i+step, ndedup))
+        data[src + numpy.searchsorted(pos, src, side='right')] = data[src]
+    data[pos + numpy.arange(len(pos))] = new
+    return ndedup + len(new)
+
+
 def _resize(data, n):
     if data.base is not None:
         return data[:n]
@@ -14,7 +14,7 @@ out in element loops. For lower level operations topologies can be used as
 :mod:`nutils.element` iterators.
 """
 
-from . import element, function, evaluable, _util as util, parallel, numeric, cache, transform, transformseq, warnings, types, points, sparse
+from . import element, function, evaluable, _util as util, parallel, numeric, cache, transform, transformseq, warnings, types, points, sparse, matrix
 from ._util import single_or_multiple
 from functools import cached_property
 from .elementseq import References
@@ -515,7 +515,9 @@ class Topology:
                 transforms = self.transforms
             except:
                 raise TypeError('topology supports only refinement by element indices') from None
-            refine = [transforms.index_with_tail(item)[0] for item in refine]
+            refine, tails = transforms.index_with_tail_many(refine)
+            if numpy.less(refine, 0).any():
+                raise ValueError('refine contains transforms that are not in the topology')
         refine = numpy.asarray(refine)
         if refine.dtype != int:
             raise ValueError(f'expected an array of dtype int, got {refine.dtype}')
@@ -558,6 +560,75 @@ class Topology:
         else:
             raise ValueError
 
+    def prolongation(self, basis: function.Basis, fine: 'Topology', finebasis: function.Basis, tol: float = 1e-10) -> matrix.Matrix:
+        '''Return the prolongation operator from a basis to a refined basis.
+
+        The prolongation is the sparse matrix ``P`` that maps the coefficients of
+        ``basis`` to those of ``finebasis`` such that ``basis @ c`` and
+        ``finebasis @ (P @ c)`` are the same function. This requires that
+        ``fine`` is a refinement of this topology, such as :attr:`refined`, and
+        that ``finebasis`` spans the space of ``basis``. The restriction of
+        ``finebasis`` to any element must be linearly independent, which
+        excludes hierarchical bases. Prolongations of successive refinements
+        define the levels of the multigrid preconditioner of
+        :meth:`nutils.matrix.Matrix.solve`.
+
+        Parameters
+        ----------
+        basis : :class:`nutils.function.Basis`
+            The coarse basis, defined on this topology.
+        fine : :class:`Topology`
+            The refined topology.
+        finebasis : :class:`nutils.function.Basis`
+            The fine basis, defined on ``fine``.
+        tol : :class:`float`
+            Relative tolerance for the elementwise representation of ``basis`` in
+            ``finebasis``.
+
+        Returns
+        -------
+        :class:`nutils.matrix.Matrix`
+            The prolongation of shape ``(len(finebasis), len(basis))``.
+        '''
+
+        transforms = self.transforms
+        solve = {}
+        rows = []
+        cols = []
+        values = []
+        icoarses, tails = transforms.index_with_tail_many(fine.transforms)
+        if numpy.less(icoarses, 0).any():
+            raise ValueError('fine topology is not a refinement of this topology')
+        for ifine, (icoarse, tail) in enumerate(zip(icoarses, tails)):
+            coeffs = basis.get_coefficients(icoarse)
+            for item in tail:
+                coeffs = item.transform_poly(coeffs)
+            finecoeffs = finebasis.get_coefficients(ifine)
+            degree = poly.degree(fine.ndims, coeffs.shape[-1])
+            finedegree = poly.degree(fine.ndims, finecoeffs.shape[-1])
+            if degree > finedegree:
+                raise ValueError('degree of basis exceeds degree of finebasis')
+            elif degree < finedegree:
+                coeffs = poly.change_degree(coeffs, fine.ndims, finedegree)
+            key = finecoeffs.shape, finecoeffs.tobytes()
+            if key not in solve:
+                if numpy.linalg.matrix_rank(finecoeffs) < len(finecoeffs):
+                    raise ValueError('finebasis is linearly dependent in element {}'.format(ifine))
+                solve[key] = numpy.linalg.pinv(finecoeffs.T)
+            local = solve[key] @ coeffs.T  # coefficients of coarse functions in fine functions
+            if not numpy.allclose(finecoeffs.T @ local, coeffs.T, rtol=0, atol=tol * numpy.abs(coeffs).max()):
+                raise ValueError('finebasis does not span basis in element {}'.format(ifine))
+            local[numpy.abs(local) <= tol * numpy.abs(local).max()] = 0
+            finedofs, coarsedofs = numpy.nonzero(local)
+            rows.append(finebasis.get_dofs(ifine)[finedofs])
+            cols.append(basis.get_dofs(icoarse)[coarsedofs])
+            values.append(local[finedofs, coarsedofs])
+        rows = numpy.concatenate(rows)
+        cols = numpy.concatenate(cols)
+        # coefficients of dofs shared between elements are equal, keep the first
+        _, first = numpy.unique(rows * basis.ndofs + cols, return_index=True)
+        return matrix.assemble(numpy.concatenate(values)[first], (rows[first], cols[first]), shape=(finebasis.ndofs, basis.ndofs))
+
     def refine_count(self, count: int) -> 'Topology':
         '''Return the topology refined `count` times.
 
@@ -1456,10 +1527,10 @@ class TransformChainsTopology(Topology):
     def __and__(self, other):
         if not isinstance(other, TransformChainsTopology) or other.space != self.space:
             return super().__and__(other)
-        keep_self = numpy.array(list(map(other.transforms.contains_with_tail, self.transforms)), dtype=bool)
+        keep_self = numpy.greater_equal(other.transforms.index_with_tail_many(self.transforms)[0], 0)
         if keep_self.all():
             return self
-        keep_other = numpy.array(list(map(self.transforms.contains_with_tail, other.transforms)), dtype=bool)
+        keep_other = numpy.greater_equal(self.transforms.index_with_tail_many(other.transforms)[0], 0)
         if keep_other.all():
             return other
         ind_self = types.frozenarray(keep_self.nonzero()[0], copy=False)
@@ -1487,15 +1558,8 @@ class TransformChainsTopology(Topology):
 
     @cached_property
     def border_transforms(self):
-        indices = set()
-        for btrans in self.boundary.transforms:
-            try:
-                ielem, tail = self.transforms.index_with_tail(btrans)
-            except ValueError:
-                pass
-            else:
-                indices.add(ielem)
-        return self.transforms[numpy.array(sorted(indices), dtype=int)]
+        indices, tails = self.transforms.index_with_tail_many(self.boundary.transforms)
+        return self.transforms[numpy.unique(indices[numpy.greater_equal(indices, 0)])]
 
     @property
     def _index_coords(self):
@@ -1575,9 +1639,11 @@ class TransformChainsTopology(Topology):
             log.info('collecting leveltopo elements')
             lowered_levelset = {}
             ielem_arg = evaluable.InRange(evaluable.Argument('_ielem', (), int), evaluable.constant(len(leveltopo)))
+            ielems, tails = self.transforms.index_with_tail_many(leveltopo.transforms)
+            if numpy.less(ielems, 0).any():
+                raise ValueError('leveltopo is not a refinement of this topology')
             bins = [set() for ielem in range(len(self))]
-            for trans in leveltopo.transforms:
-                ielem, tail = self.transforms.index_with_tail(trans)
+            for ielem, tail in zip(ielems, tails):
                 bins[ielem].add(tail)
             fcache = cache.WrapperCache()
             with log.iter.percentage('trimming', self.references, self.transforms, bins) as items:
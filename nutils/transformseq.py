@@ -246,6 +246,56 @@ class Transforms(types.Singleton):
         else:
             return True
 
+    def index_with_tail_many(self, transforms):
+        '''Return the indices and tails of a sequence of transforms.
+
+        Bulk version of :meth:`index_with_tail`. Rather than raising a
+        :class:`ValueError`, transforms that are not found in this sequence are
+        marked with index ``-1`` and tail ``None``. This implementation calls
+        :meth:`index_with_tail` for every transform; sequences that can match
+        transforms in bulk override it.
+
+        Parameters
+        ----------
+        transforms : sequence of :class:`tuple` of :class:`nutils.transform.TransformItem` objects
+            The transforms to find up to a possibly empty tail.
+
+        Returns
+        -------
+        indices : :class:`numpy.ndarray` of :class:`int`
+            The indices of ``transforms`` without tail in this sequence, or
+            ``-1`` if not found.
+        tails : :class:`tuple`
+            The tails of ``transforms``, or ``None`` if not found.
+
+        Example
+        -------
+
+        >>> from nutils.transform import Index, SimplexChild
+        >>> transforms = PlainTransforms(((Index(1, 0),), (Index(1, 1),)), 1, 1)
+        >>> indices, tails = transforms.index_with_tail_many([(Index(1, 1), SimplexChild(1, 0)), (Index(1, 2),)])
+        >>> indices
+        array([ 1, -1])
+        >>> tails
+        ((SimplexChild([0]+[.5]*x0),), None)
+        '''
+
+        transforms = tuple(transforms)
+        indices = numpy.full(len(transforms), -1, dtype=int)
+        tails = [None] * len(transforms)
+        for i, trans in enumerate(transforms):
+            try:
+                indices[i], tails[i] = self.index_with_tail(trans)
+            except ValueError:
+                pass
+        return indices, tuple(tails)
+
+    @property
+    def _heads(self):
+        # The ids of the first items of all transforms in this sequence, or
+        # `None` if these are not known without iterating the sequence.
+        return None
+
     def refined(self, references):
         '''Return the sequence of refined transforms given ``references``.
 
@@ -306,6 +356,81 @@ class Transforms(types.Singleton):
 
         yield self
 
+    def affine(self, index, target=None):
+        '''Return the index in ``target`` and the composed affine map of a transform.
+
+        The affine map is that of the tail relative to ``target``, or of the
+        entire transform if ``target`` is ``None``. Results are stored in a
+        table per target that is filled as elements are visited, such that
+        repeated evaluations do not walk the transform chain.
+
+        Parameters
+        ----------
+        index : :class:`int`
+            The index of the transform in this sequence.
+        target : :class:`Transforms`, optional
+            The sequence that contains a head of the transform.
+
+        Returns
+        -------
+        tindex : :class:`int`
+            The index of the head in ``target``, or zero if ``target`` is
+            ``None``.
+        linear : :class:`numpy.ndarray`
+            The linear part of the affine map, a read-only array of shape
+            ``(todims, fromdims)``, with ``todims`` the dimension of
+            ``target``.
+        offset : :class:`numpy.ndarray`
+            The offset of the affine map, a read-only array of shape
+            ``(todims,)``.
+        '''
+
+        return self._affine_table(target)[index]
+
+    def affines(self, indices, target=None):
+        '''Return the indices in ``target`` and the composed affine maps of transforms.
+
+        Vectorized form of :meth:`affine`, which gathers the maps of an array of
+        indices from the table of ``target``.
+
+        Parameters
+        ----------
+        indices : :class:`numpy.ndarray` of :class:`int`
+            The indices of the transforms in this sequence.
+        target : :class:`Transforms`, optional
+            The sequence that contains the heads of the transforms.
+
+        Returns
+        -------
+        tindices : :class:`numpy.ndarray`
+            The indices of the heads in ``target``, of the same shape as
+            ``indices``.
+        linear : :class:`numpy.ndarray`
+            The linear parts of the affine maps, of shape ``indices.shape +
+            (todims, fromdims)``.
+        offset : :class:`numpy.ndarray`
+            The offsets of the affine maps, of shape ``indices.shape +
+            (todims,)``.
+        '''
+
+        return self._affine_table(target).gather(numpy.asarray(indices))
+
+    def _affine_table(self, target):
+        # The tables of the few most recently used targets are retained, each
+        # of which holds the maps of the transforms visited so far.
+        tables = self._affine_tables
+        table = tables.pop(target, None)
+        if table is None:
+            table = _AffineTable(self, target)
+            if len(tables) >= _maxaffinetables:
+                del tables[next(iter(tables))]
+        tables[target] = table  # (re)insert as the most recently used
+        return table
+
+    @cached_property
+    def _affine_tables(self):
+        return {}
+
 
 class EmptyTransforms(Transforms):
     '''An empty sequence.'''
@@ -332,6 +457,12 @@ class EmptyTransforms(Transforms):
 
     __contains__ = contains
 
+    def index_with_tail_many(self, transforms):
+        transforms = tuple(transforms)
+        return numpy.full(len(transforms), -1, dtype=int), (None,) * len(transforms)
+
+    _heads = frozenset()
+
 
 class PlainTransforms(Transforms):
     '''A general purpose implementation of :class:`Transforms`.
@@ -358,11 +489,7 @@ class PlainTransforms(Transforms):
         if not (transforms_fromdims <= {fromdims}):
             raise ValueError('expected transforms with fromdims={}, but got {}'.format(fromdims, transforms_fromdims))
         self._transforms = transforms
-        self._sorted = numpy.empty([len(self._transforms)], dtype=object)
-        for i, trans in enumerate(self._transforms):
-            self._sorted[i] = tuple(map(id, trans))
-        self._indices = numpy.argsort(self._sorted)
-        self._sorted = self._sorted[self._indices]
+        self._prefixes = _PrefixIndex(transforms)
         super().__init__(todims, fromdims)
 
     def __iter__(self):
@@ -377,16 +504,32 @@ class PlainTransforms(Transforms):
         return len(self._transforms)
 
     def index_with_tail(self, trans):
-        trans, orig_trans = transform.promote(trans, self.fromdims), trans
-        transid_array = numpy.empty((), dtype=object)
-        transid_array[()] = transid = tuple(map(id, trans))
-        i = numpy.searchsorted(self._sorted, transid_array, side='right') - 1
-        if i < 0:
-            raise ValueError('{!r} not in sequence of transforms'.format(orig_trans))
-        match = self._sorted[i]
-        if transid[:len(match)] != match:
-            raise ValueError('{!r} not in sequence of transforms'.format(orig_trans))
-        return self._indices[i], trans[len(match):]
+        promoted = transform.promote(trans, self.fromdims)
+        match = self._prefixes.find(promoted)
+        if match is None:
+            raise ValueError('{!r} not in sequence of transforms'.format(trans))
+        index, n = match
+        return index, promoted[n:]
+
+    def index_with_tail_many(self, transforms):
+        indices = []
+        tails = []
+        find = self._prefixes.find
+        for trans in transforms:
+            promoted = transform.promote(trans, self.fromdims)
+            match = find(promoted)
+            if match is None:
+                indices.append(-1)
+                tails.append(None)
+            else:
+                index, n = match
+                indices.append(index)
+                tails.append(promoted[n:])
+        return numpy.array(indices, dtype=int), tuple(tails)
+
+    @property
+    def _heads(self):
+        return self._prefixes.heads
 
 
 class IndexTransforms(Transforms):
@@ -424,6 +567,12 @@ class IndexTransforms(Transforms):
             return root.index - self._offset, trans[1:]
         raise ValueError
 
+    def index_with_tail_many(self, transforms):
+        transforms = tuple(transforms)
+        indices = numpy.fromiter((trans[0].index if isinstance(trans[0], transform.Index) and trans[0].fromdims == self.fromdims else self._offset - 1 for trans in transforms), dtype=int, count=len(transforms)) - self._offset
+        indices[(indices < 0) | (indices >= self._length)] = -1
+        return indices, tuple(trans[1:] if index >= 0 else None for trans, index in zip(transforms, indices))
+
 
 class Axis(types.Singleton):
     '''Base class for axes of :class:`~nutils.topology.StructuredTopology`.'''
@@ -576,33 +725,87 @@ class StructuredTransforms(Transforms):
         if len(trans) < 1 + len(self._axes) + self._nrefine + len(self._etransforms):
             raise ValueError
 
-        root, indices, tail = trans[0], trans[1:1+len(self._axes)], transform.uppermost(trans[1+len(self._axes):])
+        root, indices = trans[0], trans[1:1+len(self._axes)]
         if root != self._root:
             raise ValueError
 
         if not all(isinstance(index, transform.Index) and index.todims == len(self._axes) for index in indices):
             raise ValueError
-        indices = numpy.array([index.index for index in indices], dtype=int)
-
-        # Match child transforms.
-        for item in tail[:self._nrefine]:
-            try:
-                indices = indices*2 + self._cindices[item]
-            except KeyError:
-                raise ValueError
+        offsets, tail = self._match_remainder(trans[1+len(self._axes):])
+        indices = numpy.array([index.index for index in indices], dtype=int) * 2**self._nrefine + offsets
 
         # Check index boundaries and flatten.
         flatindex = 0
         for index, axis in zip(indices, self._axes):
             flatindex = flatindex*len(axis) + axis.unmap(index)
 
-        # Promote the remainder and match the edge transforms.
+        return flatindex, tail
+
+    def index_with_tail_many(self, transforms):
+        transforms = tuple(transforms)
+        naxes = len(self._axes)
+        minlen = 1 + naxes + self._nrefine + len(self._etransforms)
+
+        # Select the transforms with a matching root and index items, and match
+        # the remainders once per distinct remainder.
+        matches = {}
+        selection = []
+        indices = []
+        offsets = []
+        tails = [None] * len(transforms)
+        for i, trans in enumerate(transforms):
+            if len(trans) < minlen or trans[0] != self._root or not all(isinstance(index, transform.Index) and index.todims == naxes for index in trans[1:1+naxes]):
+                continue
+            remainder = trans[1+naxes:]
+            match = matches.get(remainder, False)
+            if match is False:
+                try:
+                    match = self._match_remainder(remainder)
+                except ValueError:
+                    match = None
+                matches[remainder] = match
+            if match is not None:
+                selection.append(i)
+                indices.append([index.index for index in trans[1:1+naxes]])
+                offsets.append(match[0])
+                tails[i] = match[1]
+        selection = numpy.array(selection, dtype=int)
+        indices = numpy.array(indices, dtype=int).reshape(len(selection), naxes) * 2**self._nrefine + numpy.array(offsets, dtype=int).reshape(len(selection), naxes)
+
+        # Check index boundaries and flatten.
+        valid = numpy.ones(len(selection), dtype=bool)
+        flatindices = numpy.zeros(len(selection), dtype=int)
+        for index, axis in zip(indices.T, self._axes):
+            ielem = index - axis.i
+            if axis.mod:
+                ielem %= axis.mod
+            valid &= (ielem >= 0) & (ielem < len(axis))
+            flatindices = flatindices*len(axis) + ielem
+
+        result = numpy.full(len(transforms), -1, dtype=int)
+        result[selection[valid]] = flatindices[valid]
+        for i in selection[~valid]:
+            tails[i] = None
+        return result, tuple(tails)
+
+    def _match_remainder(self, remainder):
+        # Return the index offsets of the child transforms and the tail that
+        # remains after the edge transforms, or raise a ValueError.
+        tail = transform.uppermost(remainder)
+        offsets = numpy.zeros(len(self._axes), dtype=int)
+        for item in tail[:self._nrefine]:
+            try:
+                offsets = offsets*2 + self._cindices[item]
+            except KeyError:
+                raise ValueError
         tail = transform.promote(tail[self._nrefine:], self.fromdims)
         if tail[:len(self._etransforms)] != self._etransforms:
             raise ValueError
-        tail = tail[len(self._etransforms):]
+        return offsets, tail[len(self._etransforms):]
 
-        return flatindex, tail
+    @property
+    def _heads(self):
+        return frozenset([id(self._root)])
 
 
 class MaskedTransforms(Transforms):
@@ -643,6 +846,17 @@ class MaskedTransforms(Transforms):
         else:
             return int(index), tail
 
+    def index_with_tail_many(self, transforms):
+        parent_indices, tails = self._parent.index_with_tail_many(transforms)
+        indices = numpy.searchsorted(self._indices, parent_indices)
+        found = numpy.less(indices, len(self._indices))
+        found[found] = numpy.equal(self._indices[indices[found]], parent_indices[found])
+        return numpy.where(found, indices, -1), tuple(tail if isfound else None for tail, isfound in zip(tails, found))
+
+    @property
+    def _heads(self):
+        return self._parent._heads
+
 
 class ReorderedTransforms(Transforms):
     '''A reordered :class:`Transforms` object.
@@ -682,6 +896,15 @@ class ReorderedTransforms(Transforms):
         parent_index, tail = self._parent.index_with_tail(trans)
         return int(self._rindices[parent_index]), tail
 
+    def index_with_tail_many(self, transforms):
+        parent_indices, tails = self._parent.index_with_tail_many(transforms)
+        found = numpy.greater_equal(parent_indices, 0)
+        return numpy.where(found, numpy.take(self._rindices, parent_indices), -1), tails
+
+    @property
+    def _heads(self):
+        return self._parent._heads
+
 
 class DerivedTransforms(Transforms):
     '''A sequence of derived transforms.
@@ -739,16 +962,46 @@ class DerivedTransforms(Transforms):
         iderived = index - self._offsets[iparent]
         return self._parent[iparent] + (self._derived_transforms(self._parent_references[iparent])[iderived],)
 
-    def index_with_tail(self, trans):
-        iparent, tail = self._parent.index_with_tail(trans)
-        if not tail:
-            raise ValueError
+    @cached_property
+    def _derived_prefixes(self):
+        return {}
+
+    def _find_derived(self, iparent, tail):
+        reference = self._parent_references[iparent]
+        try:
+            prefixes = self._derived_prefixes[reference]
+        except KeyError:
+            prefixes = self._derived_prefixes[reference] = _PrefixIndex(tuple((dtrans,) for dtrans in self._derived_transforms(reference)))
         if self.fromdims == self._parent.fromdims:
             tail = transform.uppermost(tail)
         else:
             tail = transform.canonical(tail)
-        iderived = self._derived_transforms(self._parent_references[iparent]).index(tail[0])
-        return self._offsets[iparent]+iderived, tail[1:]
+        match = prefixes.find(tail[:1])
+        if match is None:
+            raise ValueError
+        return int(self._offsets[iparent]) + match[0], tail[1:]
+
+    def index_with_tail(self, trans):
+        iparent, tail = self._parent.index_with_tail(trans)
+        if not tail:
+            raise ValueError
+        return self._find_derived(iparent, tail)
+
+    def index_with_tail_many(self, transforms):
+        parent_indices, parent_tails = self._parent.index_with_tail_many(transforms)
+        indices = numpy.full(len(parent_indices), -1, dtype=int)
+        tails = [None] * len(parent_indices)
+        for i, (iparent, tail) in enumerate(zip(parent_indices, parent_tails)):
+            if tail:
+                try:
+                    indices[i], tails[i] = self._find_derived(iparent, tail)
+                except ValueError:
+                    pass
+        return indices, tuple(tails)
+
+    @property
+    def _heads(self):
+        return self._parent._heads
 
 
 class UniformDerivedTransforms(Transforms):
@@ -797,16 +1050,41 @@ class UniformDerivedTransforms(Transforms):
         iparent, iderived = divmod(numeric.normdim(len(self), index), len(self._derived_transforms))
         return self._parent[iparent] + (self._derived_transforms[iderived],)
 
-    def index_with_tail(self, trans):
-        iparent, tail = self._parent.index_with_tail(trans)
-        if not tail:
-            raise ValueError
+    @cached_property
+    def _derived_prefixes(self):
+        return _PrefixIndex(tuple((dtrans,) for dtrans in self._derived_transforms))
+
+    def _find_derived(self, iparent, tail):
         if self.fromdims == self._parent.fromdims:
             tail = transform.uppermost(tail)
         else:
             tail = transform.canonical(tail)
-        iderived = self._derived_transforms.index(tail[0])
-        return iparent*len(self._derived_transforms) + iderived, tail[1:]
+        match = self._derived_prefixes.find(tail[:1])
+        if match is None:
+            raise ValueError
+        return int(iparent)*len(self._derived_transforms) + match[0], tail[1:]
+
+    def index_with_tail(self, trans):
+        iparent, tail = self._parent.index_with_tail(trans)
+        if not tail:
+            raise ValueError
+        return self._find_derived(iparent, tail)
+
+    def index_with_tail_many(self, transforms):
+        parent_indices, parent_tails = self._parent.index_with_tail_many(transforms)
+        indices = numpy.full(len(parent_indices), -1, dtype=int)
+        tails = [None] * len(parent_indices)
+        for i, (iparent, tail) in enumerate(zip(parent_indices, parent_tails)):
+            if tail:
+                try:
+                    indices[i], tails[i] = self._find_derived(iparent, tail)
+                except ValueError:
+                    pass
+        return indices, tuple(tails)
+
+    @property
+    def _heads(self):
+        return self._parent._heads
 
 
 class ChainedTransforms(Transforms):
@@ -864,17 +1142,54 @@ class ChainedTransforms(Transforms):
     def __iter__(self):
         return itertools.chain.from_iterable(self._items)
 
+    @cached_property
+    def _candidates(self):
+        # Map the id of the first item of a transform to the positions of the
+        # items that may contain it, plus the positions of the items for which
+        # this is not known upfront.
+        byhead = {}
+        unknown = []
+        for i, item in enumerate(self._items):
+            heads = item._heads
+            if heads is None:
+                unknown.append(i)
+            else:
+                for head in heads:
+                    byhead.setdefault(head, []).append(i)
+        return {head: tuple(sorted(positions + unknown)) for head, positions in byhead.items()}, tuple(unknown)
+
     def index_with_tail(self, trans):
-        offset = 0
-        for item in self._items:
+        byhead, unknown = self._candidates
+        for i in byhead.get(id(trans[0]), unknown) if trans else unknown:
             try:
-                index, tail = item.index_with_tail(trans)
-                return index + offset, tail
+                index, tail = self._items[i].index_with_tail(trans)
             except ValueError:
                 pass
-            offset += len(item)
+            else:
+                return index + int(self._offsets[i]), tail
         raise ValueError
 
+    def index_with_tail_many(self, transforms):
+        transforms = tuple(transforms)
+        indices = numpy.full(len(transforms), -1, dtype=int)
+        tails = [None] * len(transforms)
+        remaining = numpy.arange(len(transforms))
+        for item, offset in zip(self._items, self._offsets):
+            if not len(remaining):
+                break
+            item_indices, item_tails = item.index_with_tail_many([transforms[i] for i in remaining])
+            found = numpy.greater_equal(item_indices, 0)
+            indices[remaining[found]] = item_indices[found] + offset
+            for i, tail in zip(remaining[found], itertools.compress(item_tails, found)):
+                tails[i] = tail
+            remaining = remaining[~found]
+        return indices, tuple(tails)
+
+    @property
+    def _heads(self):
+        heads = [item._heads for item in self._items]
+        return None if None in heads else frozenset().union(*heads)
+
     def refined(self, references):
         return chain((item.refined(references[start:stop]) for item, start, stop in zip(self._items, self._offsets[:-1], self._offsets[1:])), self.todims, self.fromdims)
 
@@ -916,4 +1231,139 @@ def chain(items, todims, fromdims):
         return ChainedTransforms(unchained)
 
 
+class _PrefixIndex:
+    '''Positions of transform chains, matched against the head of a query chain.
+
+    The chains are stored in a :class:`dict` keyed by the ids of their items,
+    one key length per distinct chain length, such that a lookup costs one
+    hash per distinct length rather than a search over all chains. The ids are
+    stable as long as ``chains`` is alive, which this object guarantees by
+    keeping a reference.
+    '''
+
+    def __init__(self, chains):
+        self.chains = chains
+        self.positions = {}
+        for i, chain in enumerate(chains):
+            self.positions[tuple(map(id, chain))] = i
+        self.lengths = tuple(sorted(set(map(len, chains))))
+        self.heads = frozenset(id(chain[0]) for chain in chains if chain)
+
+    def find(self, chain):
+        '''Return the position and length of the stored head of ``chain``, or ``None``.'''
+
+        ids = tuple(map(id, chain))
+        for n in self.lengths:
+            if n > len(ids):
+                break
+            i = self.positions.get(ids[:n])
+            if i is not None:
+                return i, n
+        return None
+
+
+_maxaffinetables = 4
+_affineblock = 64
+
+
+class _AffineTable:
+    '''Target indices and affine maps of the visited elements, computed on first access.
+
+    The maps are stored compactly, in the order in which elements are first
+    visited, in arrays that grow in blocks, such that the memory scales with
+    the number of visited elements rather than with the length of the source.'''
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        self.slots = {}  # element index -> row in the arrays below
+        self.indices = numpy.empty(0, dtype=int)
+        self.tindex = numpy.empty(0, dtype=int)
+        self.linear = numpy.empty((0, source.todims if target is None else target.fromdims, source.fromdims))
+        self.offset = numpy.empty(self.linear.shape[:2])
+        self._sorted = None
+
+    def __getitem__(self, index):
+        index = numeric.normdim(len(self.source), index.__index__())
+        slot = self.slots.get(index)
+        if slot is None:
+            chain = self.source[index]
+            tindex, tail = (0, chain) if self.target is None else self.target.index_with_tail(chain)
+            linear, offset = _compose(tail, self.source.fromdims)
+            slot = self.store([index], [tindex], linear[numpy.newaxis], offset[numpy.newaxis])
+        return int(self.tindex[slot]), _readonly(self.linear[slot]), _readonly(self.offset[slot])
+
+    def gather(self, indices):
+        indices = numpy.where(indices < 0, indices + len(self.source), indices)
+        if indices.size and not (0 <= indices.min() and indices.max() < len(self.source)):
+            raise IndexError('index out of bounds')
+        keys, slots = self.lookup()
+        pos = numpy.searchsorted(keys, indices)
+        missing = pos == len(keys)
+        missing[~missing] = keys[pos[~missing]] != indices[~missing]
+        if missing.any():
+            self.fill(numpy.unique(indices[missing]))
+            keys, slots = self.lookup()
+            pos = numpy.searchsorted(keys, indices)
+        slot = slots[pos]
+        return self.tindex[slot], self.linear[slot], self.offset[slot]
+
+    def lookup(self):
+        # The visited element indices in ascending order and their rows.
+        if self._sorted is None:
+            slots = numpy.argsort(self.indices[:len(self.slots)])
+            self._sorted = self.indices[slots], slots
+        return self._sorted
+
+    def fill(self, indices):
+        # Compute the maps of the unvisited, unique `indices`, composing the
+        # map of every distinct tail once.
+        chains = [self.source[index] for index in indices]
+        if self.target is None:
+            tindex, tails = numpy.zeros(len(chains), dtype=int), chains
+        else:
+            tindex, tails = self.target.index_with_tail_many(chains)
+            if (tindex < 0).any():
+                raise ValueError
+        maps = {}
+        inverse = numpy.array([maps.setdefault(tail, len(maps)) for tail in tails], dtype=int)
+        linear = numpy.empty((len(maps), *self.linear.shape[1:]))
+        offset = numpy.empty((len(maps), *self.offset.shape[1:]))
+        for i, tail in enumerate(maps):
+            linear[i], offset[i] = _compose(tail, self.source.fromdims)
+        self.store(indices, tindex, linear[inverse], offset[inverse])
+
+    def store(self, indices, tindex, linear, offset):
+        # Append the maps of unvisited elements, returning the first row.
+        n = len(self.slots)
+        if n + len(indices) > len(self.indices):
+            size = max(n + len(indices), 2 * len(self.indices), _affineblock)
+            for name in 'indices', 'tindex', 'linear', 'offset':
+                array = getattr(self, name)
+                grown = numpy.empty((size, *array.shape[1:]), dtype=array.dtype)
+                grown[:n] = array[:n]
+                setattr(self, name, grown)
+        self.indices[n:n+len(indices)] = indices
+        self.tindex[n:n+len(indices)] = tindex
+        self.linear[n:n+len(indices)] = linear
+        self.offset[n:n+len(indices)] = offset
+        self.slots.update(zip(map(int, indices), range(n, n+len(indices))))
+        self._sorted = None
+        return n
+
+
+def _compose(chain, fromdims):
+    linear = numpy.eye(fromdims)
+    offset = numpy.zeros(fromdims)
+    for item in reversed(chain):
+        linear = item.linear @ linear
+        offset = item.linear @ offset + item.offset
+    return linear, offset
+
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+
 # vim:sw=4:sts=4:et
@@ -5,6 +5,7 @@ Module with general purpose types.
 import inspect
 import functools
 import hashlib
+import zlib
 import numbers
 import collections.abc
 import itertools
@@ -134,9 +135,8 @@ def nutils_hash(data):
     elif t is types.MethodType:
         h.update(nutils_hash(data.__self__))
         h.update(nutils_hash(data.__name__))
-    elif t is numpy.ndarray:
-        h.update('{}{}\0'.format(','.join(map(str, data.shape)), data.dtype.str).encode())
-        h.update(data.tobytes())
+    elif isinstance(data, numpy.ndarray):
+        return _nutils_hash_ndarray(data)
     elif dataclasses.is_dataclass(t):
         # Note: we cannot use dataclasses.asdict here as its built-in recursion
         # makes nested dataclass instances indistinguishable from dictionaries.
@@ -305,11 +305,16 @@ class DataClassMeta(abc.ABCMeta):
     def __call__(cls, *args, **kwargs):
         bound = cls.__signature__.bind(*args, **kwargs)
         bound.apply_defaults()
-        if (self := cls.__cache.get(bound.args)) is None:
+        self = cls.__cache.get(bound.args)
+        hit = self is not None
+        if not hit:
             self = object.__new__(cls)
             self.__dict__.update(bound.arguments)
             self.__post_init__()
             cls.__cache[bound.args] = self
+        table = cls.__interntable__()
+        if table is not None:
+            table.touch(self, hit)
         return self
 
 
@@ -339,6 +344,10 @@ class DataClass(metaclass=DataClassMeta):
     Plain(a=1, b='test')
     '''
 
+    @staticmethod
+    def __interntable__():
+        '''Return the :class:`InternTable` of new instances, or ``None``.'''
+
     def __post_init__(self):
         '''Post initialization.
 
@@ -365,14 +374,134 @@ class DataClass(metaclass=DataClassMeta):
         return type(self).__name__ + '(' + ', '.join(f'{name}={getattr(self,name)!r}' for name in self.__signature__.parameters) + ')'
 
 
+class InternTable:
+    '''Size bounded table of recently constructed :class:`DataClass` instances.
+
+    Constructing a :class:`DataClass` with the same arguments as a live
+    instance returns that instance, including everything it memoized. Since
+    instances are only weakly referenced for this purpose, the sharing ends
+    when the last reference to an instance is dropped. Returning an
+    :class:`InternTable` from the ``__interntable__`` static method of a
+    :class:`DataClass` keeps the ``maxsize`` most recently constructed or
+    reused instances alive, so that equal instances constructed at a later
+    time are shared as well. Least recently used instances are evicted first.
+
+    Args
+    ----
+    maxsize : :class:`int`
+        The maximum number of instances to keep alive. Zero disables the table
+        except for the statistics.
+
+    Example
+    -------
+    >>> table = InternTable(maxsize=2)
+    >>> class Plain(DataClass):
+    ...   __interntable__ = staticmethod(lambda: table)
+    ...   a: int
+    >>> a = Plain(1)
+    >>> del a
+    >>> Plain(1) is Plain(1)
+    True
+    >>> table.stats
+    'hit rate 67% (2/3 constructions), 1 alive, 0 evicted'
+    '''
+
+    def __init__(self, maxsize: int):
+        if not isinstance(maxsize, int) or maxsize < 0:
+            raise ValueError('maxsize requires a non-negative integer argument')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def touch(self, obj, hit: bool):
+        '''Mark ``obj`` as most recently used.'''
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        key = id(obj) # stable as long as obj is kept alive by this table
+        if key in self._items:
+            self._items.move_to_end(key)
+        elif self.maxsize:
+            self._items[key] = obj
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        '''Release all instances and reset the statistics.'''
+
+        self._items.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def stats(self):
+        count = self.hits + self.misses
+        return 'not used' if not count \
+            else 'hit rate {:.0f}% ({}/{} constructions), {} alive, {} evicted'.format(100*self.hits/count, self.hits, count, len(self._items), self.evictions)
+
+
+class _buffer:
+    '''read-only byte buffer with content based equality and hashing.
+
+    The buffer wraps either a :class:`bytes` object or an immutable,
+    C-contiguous array, without copying. The hash is a non-cryptographic
+    checksum that is computed once. The nutils hash equals that of the
+    corresponding :class:`bytes` object, and pickling converts the buffer to
+    :class:`bytes`.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.view = memoryview(data) if type(data) is bytes else memoryview(data).cast('B')
+        self._hash = hash((self.view.nbytes, zlib.crc32(self.view)))
+
+    def __len__(self):
+        return self.view.nbytes
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not _buffer:
+            return NotImplemented
+        if self._hash != other._hash or self.view.nbytes != other.view.nbytes:
+            return False
+        if type(self.data) is bytes and type(other.data) is bytes:
+            return self.data == other.data
+        dtype = numpy.uint64 if self.view.nbytes % 8 == 0 else numpy.uint8
+        return numpy.array_equal(numpy.frombuffer(self.view, dtype), numpy.frombuffer(other.view, dtype))
+
+    @cached_property
+    def __nutils_hash__(self):
+        h = hashlib.sha1(b'bytes\0')
+        h.update(hashlib.sha1(self.view).digest())
+        return h.digest()
+
+    def __reduce__(self):
+        return _buffer, (self.view.tobytes(),)
+
+
 class arraydata(Singleton):
     '''hashable array container.
 
     The container can be used for fast equality checks and for dictionary keys.
-    Data is copied at construction and canonicalized by casting it to the
-    platform's primary data representation (e.g. int64 i/o int32). It can be
-    retrieved via :func:`numpy.asarray`. Additionally the ``arraydata`` object
-    provides direct access to the array's shape, dtype and bytes.
+    Data is canonicalized by casting it to the platform's primary data
+    representation (e.g. int64 i/o int32) and copied at construction, unless
+    it is an immutable, C-contiguous array of canonical dtype, e.g. a
+    :func:`frozenarray` or a read-only memory map, which is wrapped as is. It
+    can be retrieved via :func:`numpy.asarray`. Additionally the
+    ``arraydata`` object provides direct access to the array's shape, dtype and
+    bytes, and to a read-only :class:`memoryview` of its memory via ``view``,
+    which unlike ``bytes`` does not copy the data.
 
     Example
     -------
@@ -389,23 +518,33 @@ class arraydata(Singleton):
             return arg
         array = numpy.asarray(arg)
         dtype = dict(b=bool, u=int, i=int, f=float, c=complex)[array.dtype.kind]
-        return super().__new__(cls, dtype, array.shape, array.astype(dtype, copy=False).tobytes())
+        if array.dtype == dtype and array.size and array.flags.c_contiguous and not any(base.flags.writeable for base in _array_bases(array)):
+            data = array
+        else:
+            data = array.astype(dtype, copy=False).tobytes()
+        return super().__new__(cls, dtype, array.shape, _buffer(data))
 
     def reshape(self, *shape):
         if numpy.prod(shape) != numpy.prod(self.shape):
             raise ValueError(f'cannot reshape arraydata of shape {self.shape} into shape {shape}')
-        return super().__new__(self.__class__, self.dtype, shape, self.bytes)
+        return super().__new__(self.__class__, self.dtype, shape, self._buffer)
 
-    def __init__(self, dtype, shape, bytes):
+    def __init__(self, dtype, shape, buffer):
         self.dtype = dtype
         self.shape = shape
-        self.bytes = bytes
+        self._buffer = buffer
+        self.view = buffer.view
         self.ndim = len(shape)
         # Note: we define __array_interface__ rather that __array_struct__ to
         # achieve that asarray(self) has its base attribute set equal to self,
-        # rather than self.bytes, so that lru_cache recognizes successive asarrays
+        # rather than self.view, so that lru_cache recognizes successive asarrays
         # to be equal via their common weak referenceable base.
-        self.__array_interface__ = numpy.frombuffer(bytes, dtype).reshape(shape).__array_interface__
+        self.__array_interface__ = numpy.frombuffer(buffer.view, dtype).reshape(shape).__array_interface__
+
+    @cached_property
+    def bytes(self):
+        data = self._buffer.data
+        return data if type(data) is bytes else self.view.tobytes()
 
 
 class frozendict(collections.abc.Mapping):
@@ -659,6 +798,15 @@ def lru_cache(func):
     return wrapped
 
 
+@lru_cache
+def _nutils_hash_ndarray(data):
+    # Immutable arrays are hashed once per buffer, all others on every call.
+    h = hashlib.sha1(b'ndarray\0')
+    h.update('{}{}\0'.format(','.join(map(str, data.shape)), data.dtype.str).encode())
+    h.update(data if data.flags.c_contiguous and data.dtype.kind in 'biufc' else data.tobytes())
+    return h.digest()
+
+
 class attributes:
     '''
     Dictionary-like container with attributes instead of keys, instantiated using
@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import numpy
+from nutils import distributed, parallel, mesh, function, sparse, testing
+
+canfork = hasattr(os, 'fork')
+
+
+class serial(testing.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.comm = distributed.PipeCommunicator(0, {})
+
+    def test_localrange(self):
+        self.assertEqual(distributed.localrange(self.comm, 5), range(5))
+
+    def test_offsets(self):
+        self.assertAllEqual(distributed._offsets(10, 3), [0, 3, 6, 10])
+        self.assertAllEqual(distributed._offsets(2, 3), [0, 0, 1, 2])
+
+    def test_assemble_invalid(self):
+        with self.assertRaises(ValueError):
+            distributed.assemble(self.comm, numpy.zeros(0, dtype=sparse.dtype((2, 2, 2))))
+
+
+@unittest.skipIf(sys.platform == 'darwin', 'fork is unreliable (in combination with matplotlib)')
+@unittest.skipIf(not canfork, 'fork is not available on this system')
+class pipes(testing.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enter_context(parallel.maxprocs(3))
+        topo, geom = mesh.rectilinear([7, 4])
+        self.sample = topo.sample('gauss', 2)
+        basis = topo.basis('std', degree=1)
+        self.vector = basis
+        self.matrix = function.outer(basis.grad(geom)).sum(-1) + function.outer(basis)
+        self.desired_vector, self.desired_matrix = self.sample.integrate([self.vector, self.matrix])
+
+    def test_communicator(self):
+        with distributed.pipes(3) as comm:
+            if comm.size != 3:
+                raise Exception('invalid size')
+            received = distributed._alltoall(comm, [(comm.rank, i) for i in range(comm.size)])
+            if received != [(i, comm.rank) for i in range(comm.size)]:
+                raise Exception('invalid exchange')
+
+    def test_eof(self):
+        with self.assertRaises(EOFError), distributed.pipes(2) as comm:
+            if comm.rank == 1:
+                raise Exception
+            comm.recv(source=1)
+
+    def test_assemble(self):
+        with distributed.pipes(3) as comm:
+            sample = distributed.localsample(comm, self.sample)
+            vector, matrix = sample.integrate_sparse([self.vector, self.matrix])
+            rows = distributed.localrange(comm, len(self.desired_vector))
+            numpy.testing.assert_allclose(distributed.assemble(comm, vector), self.desired_vector[rows.start:rows.stop])
+            A = distributed.assemble(comm, matrix)
+            self.assertEqual(A.rows, rows)
+            numpy.testing.assert_allclose(A.block.export('dense'), self.desired_matrix.export('dense')[rows.start:rows.stop])
+            x = numpy.arange(rows.start, rows.stop, dtype=float)
+            numpy.testing.assert_allclose(A @ x, (self.desired_matrix @ numpy.arange(A.shape[1], dtype=float))[rows.start:rows.stop])
+            gathered = A.gather()
+            if comm.rank == 0:
+                numpy.testing.assert_allclose(gathered.export('dense'), self.desired_matrix.export('dense'))
+            else:
+                self.assertIsNone(gathered)
+
+    def test_transpose(self):
+        with distributed.pipes(3) as comm:
+            sample = distributed.localsample(comm, self.sample)
+            A = distributed.assemble(comm, sample.integrate_sparse(self.matrix))
+            x = numpy.arange(A.shape[1], dtype=float)
+            cols = distributed.localrange(comm, A.shape[0])
+            numpy.testing.assert_allclose(A.T @ x[cols.start:cols.stop], (self.desired_matrix.T @ x)[cols.start:cols.stop])
+
+    def test_submatrix(self):
+        with distributed.pipes(3) as comm:
+            sample = distributed.localsample(comm, self.sample)
+            A = distributed.assemble(comm, sample.integrate_sparse(self.matrix))
+            keep = numpy.arange(A.shape[0]) % 3 != 1
+            B = A.submatrix(keep[A.rows.start:A.rows.stop], keep[A.rows.start:A.rows.stop])
+            self.assertEqual(B.shape, (keep.sum(), keep.sum()))
+            gathered = B.gather()
+            if comm.rank == 0:
+                numpy.testing.assert_allclose(gathered.export('dense'), self.desired_matrix.export('dense')[numpy.ix_(keep, keep)])
+
+    def test_solve(self):
+        rhs = numpy.arange(len(self.desired_vector), dtype=float)
+        cons = numpy.full(len(rhs), numpy.nan)
+        cons[:3] = 1
+        for solver in 'cg', 'bicgstab':
+            for precon in None, 'diag':
+                for constrain in None, cons:
+                    with self.subTest(solver=solver, precon=precon, constrained=constrain is not None):
+                        desired = self.desired_matrix.solve(rhs, constrain=constrain)
+                        with distributed.pipes(3) as comm:
+                            sample = distributed.localsample(comm, self.sample)
+                            A = distributed.assemble(comm, sample.integrate_sparse(self.matrix))
+                            rows = slice(A.rows.start, A.rows.stop)
+                            lhs = A.solve(rhs[rows], constrain=None if constrain is None else constrain[rows], solver=solver, precon=precon, atol=1e-10)
+                            numpy.testing.assert_allclose(lhs, desired[rows], atol=1e-8)
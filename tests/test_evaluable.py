@@ -1,4 +1,4 @@
-from nutils import evaluable, sparse, numeric, _util as util, types, sample
+from nutils import evaluable, sparse, numeric, _util as util, types, sample, cache, parallel, mesh
 from nutils.testing import TestCase, parametrize
 import nutils_poly as poly
 import numpy
@@ -9,9 +9,15 @@ import warnings as _builtin_warnings
 import collections
 import sys
 import unittest
+import unittest.mock
+import tempfile
+import importlib.util
+import os
 import functools
 import operator
 import logging
+import json
+import treelog
 
 
 @parametrize
@@ -618,9 +624,152 @@ class compile(TestCase):
     def test_stats(self):
         a = evaluable.Argument('a', (), int)
         f = evaluable.compile(a, stats='log')
-        with self.assertLogs('nutils', logging.INFO) as cm:
+        with self.assertLogs('nutils', logging.INFO) as cm, unittest.mock.patch('tracemalloc.start', side_effect=AssertionError('tracing')):
             f(a=1)
             self.assertTrue(cm.output[0].startswith('INFO:nutils:total time:'))
+            self.assertNotIn('peak', cm.output[0])
+
+    def test_stats_profile(self):
+        i = evaluable.loop_index('i', 20)
+        a = evaluable.Argument('a', (evaluable.constant(20),), float)
+        sin = evaluable.Sin(evaluable.Take(a, i))
+        f = evaluable.loop_sum(evaluable.InsertAxis(sin, evaluable.constant(2)), i)
+        for backend in 'fork', 'thread':
+            with self.subTest(backend), parallel.maxprocs(3), parallel.backend(backend), tempfile.TemporaryDirectory() as outdir:
+                compiled = evaluable.compile(f, stats='profile', simplify=False)
+                with treelog.set(treelog.DataLog(outdir)):
+                    self.assertAllAlmostEqual(compiled(a=numpy.arange(20.)), [numpy.sin(numpy.arange(20.)).sum()]*2)
+                with open(os.path.join(outdir, 'stats.json')) as fjson:
+                    records = json.load(fjson)
+                self.assertEqual(records[0]['type'], 'Tuple')
+                self.assertEqual(records[1]['type'], 'LoopSum')
+                self.assertEqual(records[1]['nbytes'], 16)
+                sin_record, = [record for record in records if record['type'] == 'Sin']
+                self.assertEqual(sin_record['ncalls'], 20)
+                self.assertEqual(sin_record['nbytes'], 20 * 8)
+                with open(os.path.join(outdir, 'stats.folded')) as ffolded:
+                    stacks = dict(line.rsplit(' ', 1) for line in ffolded.read().splitlines())
+                insertaxis_record, = [record for record in records if record['type'] == 'InsertAxis']
+                self.assertIn(f'Tuple#0;LoopSum#1;InsertAxis#{insertaxis_record["index"]};Sin#{sin_record["index"]}', stacks)
+
+    def test_parallel_loopsum(self):
+        i = evaluable.loop_index('i', 20)
+        a = evaluable.Argument('a', (evaluable.constant(20),), float)
+        f = evaluable.loop_sum(evaluable.InsertAxis(evaluable.Take(a, i), evaluable.constant(2)) * evaluable.constant(numpy.array([1., 2.])), i)
+        for backend in 'fork', 'thread':
+            with self.subTest(backend), parallel.maxprocs(3), parallel.backend(backend):
+                compiled = evaluable.compile(f)
+                self.assertAllEqual(compiled(a=numpy.arange(20.)), [190., 380.])
+                self.assertAllEqual(compiled(a=numpy.ones(20)), [20., 40.])
+
+    def test_persistent_cache(self):
+        a = evaluable.Argument('a', (evaluable.constant(3),), float)
+        i = evaluable.loop_index('i', 3)
+        f = evaluable.loop_sum(evaluable.Take(a, i) * evaluable.Take(evaluable.constant(numpy.array([1., 2., 3.])), i), i)
+        with tempfile.TemporaryDirectory() as tmpdir, cache.enable(tmpdir):
+            evaluable.compile.cache_clear()
+            self.assertEqual(evaluable.compile(f)(a=numpy.array([1., 1., 1.])), 6.)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            evaluable.compile.cache_clear()
+            with unittest.mock.patch.object(evaluable.Evaluable, '_compile', side_effect=AssertionError('cache miss')):
+                self.assertEqual(evaluable.compile(f)(a=numpy.array([1., 2., 3.])), 14.)
+        evaluable.compile.cache_clear()
+
+    def test_shared_intermediates(self):
+        a = evaluable.Argument('a', (), float)
+        i = evaluable.loop_index('i', 3)
+        c = evaluable.constant(numpy.array([1., 2., 3.]))
+        g = evaluable.Sin(evaluable.loop_sum(evaluable.Take(c, i) * evaluable.Take(c, i), i))
+        shared = evaluable._SharedIntermediates()
+        with unittest.mock.patch.object(evaluable, '_shared_intermediates', shared):
+            f, h = evaluable.compile((g * a, g + a))(a=2.)
+            self.assertEqual(shared.hits, 0)
+            self.assertAlmostEqual(evaluable.compile(g + a)(a=2.), numpy.sin(14.) + 2.)
+            self.assertEqual(shared.hits, 1)
+        self.assertAlmostEqual(f, numpy.sin(14.) * 2.)
+        self.assertAlmostEqual(h, numpy.sin(14.) + 2.)
+
+    def test_batched_loops(self):
+        i = evaluable.loop_index('i', 7)
+        a = evaluable.Argument('a', (evaluable.constant(2),), float)
+        c = evaluable.constant(numpy.arange(14.).reshape(2, 7))
+        f = evaluable.loop_sum(evaluable.Sin(evaluable.Take(c, i) * a), i)
+        g = evaluable.loop_concatenate(evaluable.Exp(evaluable.Take(c, i) * a), i)
+        x = numpy.sin(numpy.arange(14.).reshape(2, 7) * [[.1], [.2]])
+        y = numpy.exp(numpy.arange(14.).reshape(2, 7) * [[.1], [.2]])
+        for batchsize in 2, 7, 10:
+            with self.subTest(batchsize), evaluable.batchsize(batchsize):
+                values = evaluable.compile((f, g))(a=numpy.array([.1, .2]))
+                self.assertAllAlmostEqual(values[0], x.sum(1))
+                self.assertAllAlmostEqual(values[1], y.T.ravel())
+
+    def test_batched_transforms(self):
+        topo, geom = mesh.unitsquare(2, 'triangle')
+        source = topo.refined.transforms
+        i = evaluable.loop_index('i', len(source))
+        coords = evaluable.constant(numpy.array([[.2, .3], [.5, .1]]))
+        funcs = evaluable.TransformIndex(topo.transforms, source, i), evaluable.TransformLinear(None, source, i), evaluable.TransformCoords(topo.transforms, source, i, coords)
+        funcs = tuple(evaluable.loop_concatenate(evaluable.InsertAxis(f, evaluable.constant(1)), i) for f in funcs)
+        desired = evaluable.compile(funcs)()
+        with evaluable.batchsize(3):
+            actual = evaluable.compile(funcs)()
+        for a, d in zip(actual, desired):
+            self.assertAllAlmostEqual(a, d)
+
+    def test_module(self):
+        a = evaluable.Argument('a', (evaluable.constant(3),), float)
+        i = evaluable.loop_index('i', 3)
+        c = evaluable.constant(numpy.array([1., 2., 3.]))
+        g = evaluable.Sin(evaluable.loop_sum(evaluable.Take(c, i) * evaluable.Take(c, i), i))
+        f = evaluable.loop_sum(evaluable.Take(a, i) * evaluable.Take(c, i), i) * g, (a * evaluable.constant(numpy.float64(2.)), g)
+        compiled = evaluable.compile(f)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'kernel.py')
+            evaluable.compile_module(f, path)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['kernel.npz', 'kernel.py'])
+            spec = importlib.util.spec_from_file_location('kernel', path)
+            kernel = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(kernel)
+        for value in numpy.array([1., 1., 1.]), numpy.array([1., 2., 3.]):
+            actual = kernel.compiled(a=value, b=None)
+            desired = compiled(a=value)
+            self.assertAllAlmostEqual(actual[0], desired[0])
+            self.assertAllAlmostEqual(actual[1][0], desired[1][0])
+            self.assertAllAlmostEqual(actual[1][1], desired[1][1])
+
+    def test_module_transforms(self):
+        topo, geom = mesh.unitsquare(2, 'triangle')
+        source = topo.refined.transforms
+        i = evaluable.loop_index('i', len(source))
+        coords = evaluable.constant(numpy.array([[.2, .3], [.5, .1]]))
+        funcs = evaluable.TransformIndex(topo.transforms, source, i), evaluable.TransformCoords(topo.transforms, source, i, coords)
+        funcs = tuple(evaluable.loop_concatenate(evaluable.InsertAxis(f, evaluable.constant(1)), i) for f in funcs)
+        desired = evaluable.compile(funcs)()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'kernel.py')
+            evaluable.compile_module(funcs, path, stats='log')
+            spec = importlib.util.spec_from_file_location('kernel', path)
+            kernel = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(kernel)
+        with self.assertLogs('nutils', logging.INFO):
+            actual = kernel.compiled()
+        for a, d in zip(actual, desired):
+            self.assertAllAlmostEqual(a, d)
+
+    def test_module_invalid(self):
+        class Local(evaluable.Array):
+            arg: evaluable.Array
+            dtype = float
+            shape = ()
+            @property
+            def dependencies(self):
+                return self.arg,
+            @staticmethod
+            def evalf(arg):
+                return arg
+        f = Local(evaluable.Argument('a', (), float))
+        with tempfile.TemporaryDirectory() as tmpdir, self.assertRaises(ValueError):
+            evaluable.compile_module(f, os.path.join(tmpdir, 'kernel.py'), simplify=False)
 
 
 class intbounds(TestCase):
@@ -1088,6 +1237,20 @@ class memory(TestCase):
         A = weakref.ref(A)
         self.assertCollected(A)
 
+    def test_interned(self):
+        # NOTE: The list of numbers must be unique in the entire test suite. If
+        # not, a test leaking this specific array will cause this test to fail.
+        build = lambda: evaluable.constant([1., 2., 3., 100., 515.]) * evaluable.Argument('interned', (evaluable.constant(5),), float)
+        with evaluable.interntable(16):
+            A = build()
+            simplified = A.simplified
+            A = weakref.ref(A)
+            gc.collect()
+            self.assertIs(build(), A())
+            self.assertIs(build().simplified, simplified)
+            del simplified
+        self.assertCollected(A)
+
     def test_replace(self):
         class MyException(Exception):
             pass
@@ -133,6 +133,8 @@ class backend(testing.TestCase):
         sparse = matrix.assemble(numpy.array([1e-10, 0, 1, 1]), numpy.array([[0, 0, 2, 2], [0, 1, 1, 2]]), shape=(3, 3))
         self.assertEqual(tuple(sparse.rowsupp(tol=1e-5)), (False, False, True))
         self.assertEqual(tuple(sparse.rowsupp(tol=0)), (True, False, True))
+        sparse = matrix.assemble(numpy.array([1, 1e-10]), numpy.array([[1, 1], [0, 2]]), shape=(3, 3))
+        self.assertEqual(tuple(sparse.rowsupp(tol=1e-5)), (False, True, False))
 
     def test_solve(self):
         rhs = numpy.arange(self.matrix.shape[0])
@@ -167,6 +169,109 @@ class backend(testing.TestCase):
                     res = numpy.linalg.norm(self.matrix @ lhs - rhs)
                     self.assertLess(res, args.get('atol', 1e-10))
 
+    def test_solve_samepattern(self):
+        rhs = numpy.arange(self.matrix.shape[0])
+        scaled = self.matrix * 2
+        for args in self.solve_args:
+            with self.subTest(args.get('solver', 'direct')):
+                for mat, scale in (self.matrix, 1), (scaled, 2), (self.matrix, 1):
+                    lhs = mat.solve(rhs, **args)
+                    res = numpy.linalg.norm(self.matrix @ lhs * scale - rhs)
+                    self.assertLess(res, args.get('atol', 1e-10))
+
+    def test_multigrid(self):
+        if self.complex:
+            self.skipTest('complex test matrix is not elliptic')
+        rhs = numpy.arange(self.matrix.shape[0])
+        prolongation = []
+        for n in self.n, self.n//2:  # linear interpolation from every other dof
+            P = numpy.zeros((n, n//2))
+            P[1::2] = numpy.eye(n//2)
+            P[:-1:2] += numpy.eye(n//2) / 2
+            P[2::2] += numpy.eye(n//2)[:-1] / 2
+            prolongation.append(matrix.fromsparse(sparse.prune(sparse.fromarray(P), inplace=True), inplace=True))
+        for name, preconargs in ('jacobi', {}), ('spectral', dict(damping=None)), ('chebyshev', dict(smoother='chebyshev')):
+            with self.subTest(name):
+                lhs = self.matrix.solve(rhs, atol=1e-10, precon='multigrid', preconargs=dict(prolongation=prolongation, **preconargs))
+                res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+                self.assertLess(res, 1e-10)
+        with self.subTest('constrained'):
+            cons = numpy.full(self.n, numpy.nan)
+            cons[[0, -1]] = 1
+            free = numpy.isnan(cons)
+            lhs = self.matrix.solve(rhs, constrain=cons, atol=1e-10, precon='multigrid', preconargs=dict(prolongation=prolongation))
+            res = numpy.linalg.norm((self.matrix @ lhs - rhs)[free])
+            self.assertLess(res, 1e-10)
+        with self.subTest('constrained-restricted'):
+            restricted = [prolongation[0].submatrix(free, numpy.ones(self.n//2, dtype=bool)), *prolongation[1:]]
+            lhs = self.matrix.solve(rhs, constrain=cons, atol=1e-10, precon='multigrid', preconargs=dict(prolongation=restricted))
+            res = numpy.linalg.norm((self.matrix @ lhs - rhs)[free])
+            self.assertLess(res, 1e-10)
+
+    def test_amg(self):
+        if self.complex:
+            self.skipTest('complex test matrix is not elliptic')
+        rhs = numpy.arange(self.matrix.shape[0])
+        for name, preconargs in ('scalar', {}), ('block', dict(nodes=numpy.arange(self.n)//2, nullspace=numpy.ones((self.n, 1)))):
+            with self.subTest(name):
+                lhs = self.matrix.solve(rhs, rtol=1e-10, precon='amg', preconargs=dict(maxcoarse=10, **preconargs))
+                res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+                self.assertLessEqual(res, 1e-10 * numpy.linalg.norm(rhs))
+        with self.subTest('cache'):
+            precon = self.matrix.getprecon('amg', nodes=numpy.arange(self.n)//2)
+            self.assertIs(self.matrix.getprecon('amg', nodes=numpy.arange(self.n)//2), precon)
+            self.assertIsNot(self.matrix.getprecon('amg', nodes=numpy.arange(self.n)//4), precon)
+
+    def test_blockmatrix(self):
+        m = self.n // 4
+        B = numpy.eye(m, self.n, 1) - numpy.eye(m, self.n, 2)
+        exact = numpy.block([[self.exact, B.T], [B, numpy.zeros((m, m))]])
+        blockmatrix = matrix.BlockMatrix(matrix.fromsparse(sparse.prune(sparse.fromarray(exact), inplace=True), inplace=True), [self.n, m])
+        numpy.testing.assert_equal(actual=blockmatrix.block(1, 0).export('dense'), desired=B)
+        self.assertEqual((2 * blockmatrix - blockmatrix).blocks, (self.n, m))
+        self.assertEqual(blockmatrix.submatrix(numpy.arange(self.n+m) != 1, numpy.arange(self.n+m) != 1).blocks, (self.n-1, m))
+        self.assertNotIsInstance(blockmatrix.submatrix(numpy.arange(self.n+m) != 1, numpy.arange(self.n+m) != self.n), matrix.BlockMatrix)
+        with self.subTest('pickle'):
+            unpickled = pickle.loads(pickle.dumps(blockmatrix))
+            self.assertIsInstance(unpickled, matrix.BlockMatrix)
+            self.assertEqual(unpickled.blocks, (self.n, m))
+            numpy.testing.assert_equal(actual=unpickled.export('dense'), desired=exact)
+        rhs = numpy.arange(self.n+m)
+        for precon in 'blockdiag', 'blocktriangular':
+            with self.subTest(precon):
+                lhs = blockmatrix.solve(rhs, rtol=1e-10, precon=precon)
+                res = numpy.linalg.norm(exact @ lhs - rhs)
+                self.assertLessEqual(res, 1e-10 * numpy.linalg.norm(rhs))
+        with self.subTest('schur'):
+            schur = -B @ numpy.linalg.solve(self.exact, B.T)
+            precon = blockmatrix.getprecon('blocktriangular', schur=matrix.fromsparse(sparse.prune(sparse.fromarray(schur), inplace=True), inplace=True))
+            d = exact @ precon(rhs) - rhs  # with the exact schur complement (A P^-1 - I)^2 = 0
+            numpy.testing.assert_allclose(exact @ precon(d), d, atol=1e-10 * numpy.linalg.norm(d))
+
+    def test_linearoperator(self):
+        operator = matrix.LinearOperator(self.matrix.__matmul__, self.matrix.shape, self.matrix.dtype, 2 * self.matrix)
+        rhs = numpy.arange(self.n)
+        numpy.testing.assert_allclose(operator @ numpy.stack([rhs, -rhs], axis=1), self.exact @ numpy.stack([rhs, -rhs], axis=1))
+        self.assertIs(operator.getprecon('direct'), operator.matrix.getprecon('direct'))
+        lhs = operator.solve(rhs, rtol=1e-10)
+        self.assertLessEqual(numpy.linalg.norm(self.exact @ lhs - rhs), 1e-10 * numpy.linalg.norm(rhs))
+        cons = numpy.full(self.n, numpy.nan)
+        cons[[0, -1]] = 1
+        lhs = operator.solve(rhs, constrain=cons, rtol=1e-10)
+        self.assertEqual(lhs[0], 1)
+        self.assertLessEqual(numpy.linalg.norm((self.exact @ lhs - rhs)[1:-1]), 1e-10 * numpy.linalg.norm(rhs))
+        operator = matrix.LinearOperator(self.matrix.__matmul__, self.matrix.shape, self.matrix.dtype, self.matrix, self.matrix.T.__matmul__)
+        numpy.testing.assert_allclose(operator.T @ rhs, self.exact.T @ rhs)
+        numpy.testing.assert_allclose((2 * operator + operator).T @ rhs, 3 * self.exact.T @ rhs)
+        numpy.testing.assert_allclose(operator.submatrix([1, 2], [2, 3]).T @ numpy.array([1, 2]), self.exact[1:3,2:4].T @ [1, 2])
+        with self.assertRaises(NotImplementedError):
+            matrix.LinearOperator(self.matrix.__matmul__, self.matrix.shape, self.matrix.dtype).T
+        for args in self.solve_args:
+            with self.subTest(args.get('solver', 'direct')):
+                lhs = operator.solve(rhs, **args)
+                res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+                self.assertLess(res, args.get('atol', 1e-10))
+
     def test_constraints(self):
         cons = numpy.empty(self.matrix.shape[0])
         cons[:] = numpy.nan
@@ -186,6 +291,8 @@ class backend(testing.TestCase):
         array = self.matrix.submatrix(rows, cols).export('dense')
         self.assertEqual(array.shape, (2, 3))
         numpy.testing.assert_equal(actual=array, desired=self.exact[numpy.ix_(rows, cols)])
+        array = (2 * self.matrix).submatrix(rows, cols).export('dense')  # same pattern and masks
+        numpy.testing.assert_equal(actual=array, desired=2 * self.exact[numpy.ix_(rows, cols)])
 
     def test_submatrix_specialcases(self):
         mat = matrix.assemble(numpy.array([1, 2, 3, 4]), numpy.array([[0, 0, 2, 2], [0, 2, 0, 2]]), (3, 3))
@@ -209,6 +316,40 @@ class backend(testing.TestCase):
     def test_diagonal(self):
         self.assertAllEqual(self.matrix.diagonal(), numpy.diag(self.exact))
 
+    def test_assembler(self):
+        data = sparse.fromarray(self.exact)
+        data = numpy.concatenate([data, data[::-1]])  # duplicates in reverse order
+        assemble = matrix.Assembler()
+        numpy.testing.assert_equal(assemble(data).export('dense'), 2 * self.exact)
+        data['value'] *= -1
+        numpy.testing.assert_equal(assemble(data).export('dense'), -2 * self.exact)
+        with self.subTest('new pattern'):
+            data = data[:len(data)//2]
+            numpy.testing.assert_equal(assemble(data).export('dense'), -self.exact)
+
+    def test_assembler_solve(self):
+        data = sparse.fromarray(self.exact)
+        assemble = matrix.Assembler()
+        A = assemble(data)
+        data['value'] *= 2
+        B = assemble(data)
+        self.assertIs(A._symbolic, B._symbolic)
+        self.assertIsNot(A._symbolic, matrix.fromsparse(data)._symbolic)
+        rhs = numpy.arange(A.shape[0], dtype=float)
+        lhsA = A.solve(rhs, solver='direct')
+        lhsB = B.solve(rhs, solver='direct')
+        numpy.testing.assert_allclose(lhsB * 2, lhsA)
+        # Solve with A after the shared analysis was refactorized for B.
+        numpy.testing.assert_allclose(A.solve(-rhs, solver='direct'), -lhsA)
+        cons = numpy.full(A.shape[0], numpy.nan)
+        cons[[0, -1]] = 1
+        free = numpy.isnan(cons)
+        self.assertIs(A.submatrix(free, free)._symbolic, B.submatrix(free, free)._symbolic)
+        self.assertIsNot(A.submatrix(free, free)._symbolic, A.submatrix(~free, ~free)._symbolic)
+        for M in A, B, A:
+            lhs = M.solve(rhs, constrain=cons, solver='direct')
+            numpy.testing.assert_allclose((M @ lhs - rhs)[free], 0, atol=1e-10 * numpy.linalg.norm(rhs))
+
 
 backend('numpy',
         backend='numpy',
@@ -220,7 +361,8 @@ backend('numpy:complex',
         backend='numpy',
         complex=True,
         solve_args=[{},
-                    dict(solver='direct', atol=1e-8)])
+                    dict(solver='direct', atol=1e-8),
+                    dict(atol=1e-5, precon='diag')])
 
 backend('scipy',
         backend='scipy',
@@ -236,7 +378,8 @@ backend('scipy:complex',
         backend='scipy',
         complex=True,
         solve_args=[{},
-                    dict(solver='direct', atol=1e-8)])
+                    dict(solver='direct', atol=1e-8),
+                    dict(atol=1e-5, precon='diag')])
 
 backend('mkl',
         backend='mkl',
@@ -252,4 +395,5 @@ backend('mkl:complex',
         complex=True,
         solve_args=[{},
                     dict(solver='direct', atol=1e-8),
-                    dict(solver='direct', symmetric=True, atol=1e-8)])
+                    dict(solver='direct', symmetric=True, atol=1e-8),
+                    dict(atol=1e-5, precon='diag')])
@@ -2,6 +2,7 @@ import unittest
 import os
 import multiprocessing
 import time
+import threading
 import sys
 import warnings as _builtin_warnings
 from nutils import parallel, testing, warnings
@@ -57,6 +58,35 @@ class Test(testing.TestCase):
         self.assertEqual(min(a), 0)
         self.assertEqual(max(a), 2 if canfork else 0)
 
+    def test_range_guided(self):
+        r = parallel.range(32)
+        starts = []
+        for ithread in range(4):
+            thread = threading.Thread(target=lambda: starts.append(next(r)))
+            thread.start()
+            thread.join()
+        # Every thread claims a chunk of 1/(2*3) of the remaining indices.
+        self.assertEqual(starts, [0, 5, 9, 12])
+        self.assertEqual(list(r), list(range(15, 32)))
+
+    def test_range_chunks(self):
+        r = parallel.range(100)
+        starts = []
+        def claim():
+            starts.append(next(r, None))
+        while starts[-1:] != [None]:
+            # Every new thread claims a new chunk.
+            thread = threading.Thread(target=claim)
+            thread.start()
+            thread.join()
+        starts.pop()
+        sizes = [stop - start for start, stop in zip(starts, starts[1:] + [100])]
+        # Every claim takes 1/(2*3) of the remaining indices, at least one.
+        self.assertEqual(sizes, [max((100 - start) // 6, 1) for start in starts])
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual(sizes[0], 16)
+        self.assertEqual(sizes[-1], 1)
+
     def test_ctxrange(self):
         a = parallel.shzeros([32], dtype=int)
         with parallel.ctxrange('test', len(a)) as r:
@@ -64,3 +94,41 @@ class Test(testing.TestCase):
                 a[i] = 1
                 time.sleep(.01)
         self.assertEqual(a.tolist(), [1]*len(a))
+
+    def test_backend(self):
+        self.assertEqual(parallel.backend.current, 'fork')
+        with parallel.backend('thread'):
+            self.assertEqual(parallel.backend.current, 'thread')
+        with self.assertRaises(ValueError):
+            with parallel.backend('spam'):
+                pass
+
+    def test_distribute_fork(self):
+        a = parallel.shzeros([32], dtype=int)
+        @parallel.distribute('test', len(a))
+        def worker(r):
+            for i in r:
+                a[i] += 1
+                time.sleep(.01)
+        self.assertEqual(a.tolist(), [1]*len(a))
+
+    def test_distribute_thread(self):
+        a = parallel.shzeros([32], dtype=int)
+        threads = set()
+        with parallel.backend('thread'):
+            @parallel.distribute('test', len(a))
+            def worker(r):
+                for i in r:
+                    threads.add(threading.get_ident())
+                    a[i] += 1
+                    time.sleep(.01)
+        self.assertEqual(a.tolist(), [1]*len(a))
+        self.assertEqual(len(threads), 3)
+
+    def test_distribute_thread_failure(self):
+        with parallel.backend('thread'), self.assertRaises(ZeroDivisionError):
+            @parallel.distribute('test', 4)
+            def worker(r):
+                for i in r:
+                    if i == 3:
+                        1/0
@@ -1,4 +1,4 @@
-from nutils import solver, mesh, function, cache, types, evaluable, sparse
+from nutils import solver, mesh, function, cache, types, evaluable, sparse, matrix
 from nutils.expression_v2 import Namespace
 from nutils.testing import TestCase, parametrize
 import numpy
@@ -78,20 +78,43 @@ class laplace(TestCase):
         self.cons = domain.boundary['left'].project(0, onto=basis, geometry=geom, ischeme='gauss2')
         dofs = function.Argument('dofs', [len(basis)])
         u = basis.dot(dofs)
-        self.residual = domain.integral((basis.grad(geom) * u.grad(geom)).sum(-1)*function.J(geom), degree=2) \
-            + domain.boundary['top'].integral(basis*function.J(geom), degree=2)
+        self.load = domain.boundary['top'].integral(basis*function.J(geom), degree=2)
+        self.residual = domain.integral((basis.grad(geom) * u.grad(geom)).sum(-1)*function.J(geom), degree=2) + self.load
 
     def test_res(self):
-        for name in 'direct', 'newton':
+        for name in 'direct', 'lhs0', 'matrixfree', 'newton':
             with self.subTest(name):
                 if name == 'direct':
                     lhs = solver.solve_linear('dofs', residual=self.residual, constrain=self.cons)
+                elif name == 'lhs0':
+                    lhs = solver.solve_linear('dofs', residual=self.residual, constrain=self.cons, lhs0=numpy.ones(len(self.cons)))
+                elif name == 'matrixfree':
+                    lhs = solver.solve_linear('dofs', residual=self.residual, constrain=self.cons, matrixfree=True)
                 else:
                     lhs = solver.newton('dofs', residual=self.residual, constrain=self.cons).solve(tol=1e-10, maxiter=1)
                 res = self.residual.eval(arguments=dict(dofs=lhs))
                 resnorm = numpy.linalg.norm(res[~self.cons.where])
                 self.assertLess(resnorm, 1e-13)
 
+    def test_batch(self):
+        residual = self.residual + function.Argument('f', ()) * self.load
+        batch = [dict(f=numpy.array(f)) for f in (0., 1., 2.)]
+        for matrixfree in False, True:
+            with self.subTest(matrixfree=matrixfree):
+                lhs = solver.solve_linear('dofs', residual=residual, constrain=self.cons, arguments=batch, matrixfree=matrixfree)
+                self.assertEqual(len(lhs), len(batch))
+                for lhs_, arguments in zip(lhs, batch):
+                    self.assertAllAlmostEqual(lhs_, solver.solve_linear('dofs', residual=residual, constrain=self.cons, arguments=arguments))
+        with self.subTest('constraints'):
+            constrain = [self.cons + f for f in (0., 1., 2.)]
+            lhs = solver.solve_linear('dofs', residual=residual, constrain=constrain, arguments=batch)
+            for lhs_, cons, arguments in zip(lhs, constrain, batch):
+                self.assertAllAlmostEqual(lhs_, solver.solve_linear('dofs', residual=residual, constrain=cons, arguments=arguments))
+        with self.subTest('varying jacobian'), self.assertRaises(solver.SolverError):
+            solver.solve_linear('dofs', residual=residual * function.Argument('f', ()), constrain=self.cons, arguments=batch)
+        with self.subTest('varying constraints'), self.assertRaises(solver.SolverError):
+            solver.solve_linear('dofs', residual=residual, constrain=[self.cons, self.cons, numpy.where(numpy.isnan(self.cons), 0, numpy.nan)], arguments=batch)
+
 
 class laplace_field(TestCase):
 
@@ -107,10 +130,12 @@ class laplace_field(TestCase):
             + domain.boundary['top'].integral(v*function.J(geom), degree=2)
 
     def test_res(self):
-        args = solver.solve_linear('u:v', residual=self.residual, constrain=self.cons)
-        res = self.residual.derivative('v').eval(**args)
-        resnorm = numpy.linalg.norm(res[numpy.isnan(self.cons['u'])])
-        self.assertLess(resnorm, 1e-13)
+        for matrixfree in False, True:
+            with self.subTest(matrixfree=matrixfree):
+                args = solver.solve_linear('u:v', residual=self.residual, constrain=self.cons, matrixfree=matrixfree)
+                res = self.residual.derivative('v').eval(**args)
+                resnorm = numpy.linalg.norm(res[numpy.isnan(self.cons['u'])])
+                self.assertLess(resnorm, 1e-13)
 
 
 @parametrize
@@ -184,6 +209,28 @@ class navierstokes(TestCase):
     def test_newton_cache(self):
         _test_solve_cache(self, lambda: solver.newton(self.dofs, residual=self.residual, constrain=self.cons))
 
+    def test_newton_ratebased(self):
+        self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, refresh=solver.RateBased()).solve(tol=self.tol, maxiter=10))
+
+    def test_newton_matrixfree(self):
+        for matrixfree in 1, 3:
+            with self.subTest(matrixfree=matrixfree):
+                self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, matrixfree=matrixfree).solve(tol=self.tol, maxiter=6))
+
+    def test_newton_matrixfree_product(self):
+        newton = solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, matrixfree=1)._wrapped
+        mask, vmask = solver._invert(newton.constrain, newton.target)
+        lhs, vlhs = solver._redict(newton.lhs0, newton.target, newton.dtype)
+        res, jac = newton._eval(lhs, mask)
+        self.assertIsInstance(jac, matrix.LinearOperator)
+        v = numpy.random.RandomState(0).uniform(size=jac.shape[1])
+        numpy.testing.assert_allclose(jac @ v, jac.matrix @ v, rtol=1e-10, atol=1e-10 * numpy.linalg.norm(jac.matrix @ v))
+
+    def test_newton_blocktriangular(self):
+        if self.single:
+            self.skipTest('block preconditioners require multiple targets')
+        self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, linprecon='blocktriangular').solve(tol=self.tol, maxiter=6))
+
     def test_pseudotime(self):
         self.assert_resnorm(solver.pseudotime(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, inertia=self.inertia, timestep=1).solve(tol=self.tol, maxiter=12))
 
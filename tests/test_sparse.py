@@ -291,6 +291,19 @@ class matrix(unittest.TestCase):
                           ((2, 0), 60), ((2, 1), 0), ((2, 2), 0), ((2, 3), 0), ((2, 4), 10),
                           ((3, 0), 0), ((3, 1), 0), ((3, 2), 0), ((3, 3), 0), ((3, 4), 20)])
 
+    def test_fromchunks(self):
+        for bufsize in None, 1, 8 * self.data.dtype.itemsize, 1000:
+            with self.subTest(bufsize=bufsize):
+                chunks = [(data['index']['i0'], data['index']['i1'], data['value']) for data in (self.data[:4], self.data[4:5], self.data[5:])]
+                retval = sparse.fromchunks(chunks, (4, 5), int, bufsize)
+                self.assertEqual(len(chunks), 3)
+                self.assertEqual(retval.dtype, self.data.dtype)
+                self.assertEqual(sparse.toarray(retval).tolist(), self.full.tolist())
+                if bufsize and bufsize < self.data.nbytes:
+                    self.assertEqual(retval.tolist(), sparse.dedup(self.data.copy()).tolist())
+                else:
+                    self.assertEqual(retval.tolist(), self.data.tolist())
+
     def test_add_int(self):
         other = numpy.array([
             ((0, 1), -40),
@@ -848,6 +848,41 @@ for etype in _refined_refs:
                 refined(etype=etype, ref0=ref0, ref1=ref1, ref2=ref2)
 
 
+@parametrize
+class prolongation(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        if self.etype == 'square':
+            self.domain, self.geom = mesh.rectilinear([3, 2], periodic=self.periodic)
+        else:
+            self.domain, self.geom = mesh.unitsquare(2, self.etype)
+        self.fine = self.domain.refine(self.nrefine)
+
+    def test_prolongation(self):
+        basis = self.domain.basis(self.btype, degree=self.degree)
+        finebasis = self.fine.basis(self.btype, degree=self.degree)
+        P = self.domain.prolongation(basis, self.fine, finebasis)
+        self.assertEqual(P.shape, (len(finebasis), len(basis)))
+        coeffs = numpy.random.RandomState(0).uniform(size=len(basis))
+        error = self.fine.integral((basis @ coeffs - finebasis @ (P @ coeffs))**2 * function.J(self.geom), degree=2*self.degree).eval()
+        self.assertLess(error, 1e-20)
+
+    def test_notnested(self):
+        basis = self.domain.basis(self.btype, degree=self.degree+1)
+        finebasis = self.fine.basis(self.btype, degree=self.degree)
+        with self.assertRaises(ValueError):
+            self.domain.prolongation(basis, self.fine, finebasis)
+
+
+for btype, degree in ('std', 1), ('std', 2), ('spline', 2), ('discont', 1):
+    for nrefine in 1, 2:
+        prolongation(etype='square', btype=btype, degree=degree, nrefine=nrefine, periodic=[])
+prolongation(etype='square', btype='spline', degree=2, nrefine=1, periodic=[0])
+prolongation(etype='triangle', btype='std', degree=2, nrefine=1)
+prolongation(etype='mixed', btype='std', degree=1, nrefine=1)
+
+
 @parametrize
 class general(TestCase):
 
@@ -8,6 +8,7 @@ import unittest
 import numpy
 import itertools
 import functools
+import tracemalloc
 
 
 class Common:
@@ -91,11 +92,55 @@ class Common:
                     for shuffle in lambda t: t, nutils.transform.canonical:
                         self.assertEqual(self.seq.index_with_tail(shuffle(trans+(etrans,))), (i, (etrans,)))
 
+    def test_affine(self):
+        coords = numpy.random.RandomState(0).uniform(size=(3, self.checkfromdims))
+        for i, trans in enumerate(self.check):
+            for cached in False, True:
+                with self.subTest(i=i, cached=cached):
+                    tindex, linear, offset = self.seq.affine(i)
+                    self.assertEqual(tindex, 0)
+                    self.assertAllAlmostEqual(coords @ linear.T + offset, transform.apply(trans, coords))
+            tindex, linear, offset = self.seq.affine(i, self.seq)
+            self.assertEqual(tindex, i)
+            self.assertAllAlmostEqual(linear, numpy.eye(self.checkfromdims))
+            self.assertAllAlmostEqual(offset, numpy.zeros(self.checkfromdims))
+
+    def test_affines(self):
+        indices = numpy.arange(len(self.check))[::-1].reshape(-1, 1).repeat(2, axis=1)
+        for target in None, self.seq:
+            with self.subTest(target=target):
+                tindices, linear, offset = self.seq.affines(indices, target)
+                self.assertEqual(linear.shape, (*indices.shape, self.checkfromdims if target else self.checktodims, self.checkfromdims))
+                for i in numpy.ndindex(*indices.shape):
+                    desired = self.seq.affine(indices[i], target)
+                    self.assertEqual(tindices[i], desired[0])
+                    self.assertAllAlmostEqual(linear[i], desired[1])
+                    self.assertAllAlmostEqual(offset[i], desired[2])
+
     def test_index_with_tail_missing(self):
         for trans in self.checkmissing:
             with self.assertRaises(ValueError):
                 self.seq.index_with_tail(trans)
 
+    def test_index_with_tail_many(self):
+        transforms = []
+        expected = []
+        for i, (trans, ref) in enumerate(zip(self.check, self.checkrefs)):
+            transforms.append(trans)
+            expected.append((i, ()))
+            for ctrans in ref.child_transforms:
+                transforms.append(trans+(ctrans,))
+                expected.append((i, (ctrans,)))
+        for trans in self.checkmissing:
+            transforms.append(trans)
+            expected.append((-1, None))
+        indices, tails = self.seq.index_with_tail_many(transforms[::-1])
+        self.assertEqual(indices.tolist(), [i for i, tail in expected[::-1]])
+        self.assertEqual(tails, tuple(tail for i, tail in expected[::-1]))
+        fallback = nutils.transformseq.Transforms.index_with_tail_many(self.seq, transforms[::-1])
+        self.assertEqual(fallback[0].tolist(), indices.tolist())
+        self.assertEqual(fallback[1], tails)
+
     def test_index(self):
         for i, trans in enumerate(self.check):
             self.assertEqual(self.seq.index(trans), i)
@@ -390,6 +435,26 @@ class IndexTransforms(TestCase, Common, Edges):
         self.checkfromdims = 2
 
 
+class AffineTable(TestCase):
+
+    def test_memory(self):
+        # The tables of a long sequence hold only the visited transforms.
+        seq = nutils.transformseq.StructuredTransforms(x1, (nutils.transformseq.DimAxis(0, 10**6, 0, False),), 0)
+        tracemalloc.start()
+        try:
+            for target in None, seq:
+                tindex, linear, offset = seq.affine(3, target)
+                tindices, linears, offsets = seq.affines(numpy.array([5, 10**6-1, 3]), target)
+            size, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 10**5)
+        self.assertEqual(tindex, 3)
+        self.assertEqual(tindices.tolist(), [5, 10**6-1, 3])
+        self.assertAllAlmostEqual(offsets, numpy.zeros((3, 1)))
+        self.assertAllAlmostEqual(linears, numpy.ones((3, 1, 1)))
+
+
 class exceptions(TestCase):
 
     def test_invalid_dimensions(self):
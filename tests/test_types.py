@@ -586,6 +586,35 @@ class arraydata(TestCase):
         self.assertNotEqual(hash(a), hash(c))  # shapes differ
         self.assertNotEqual(a, c)
 
+    def test_nocopy(self):
+        array = nutils.types.frozenarray(numpy.arange(6.).reshape(2, 3))
+        a = nutils.types.arraydata(array)
+        self.assertTrue(numpy.shares_memory(numpy.asarray(a), array))
+        self.assertTrue(numpy.shares_memory(numpy.frombuffer(a.view), array))
+        self.assertEqual(a.bytes, array.tobytes())
+        self.assertIs(type(a.bytes), bytes)
+        self.assertIs(a, nutils.types.arraydata(numpy.arange(6.).reshape(2, 3)))
+        self.assertEqual(nutils.types.nutils_hash(a).hex(), 'b47e7edd33983b4d1345de2020c2bc9524a07a41')
+
+    def test_copy(self):
+        array = numpy.arange(6.)
+        a = nutils.types.arraydata(array)
+        self.assertFalse(numpy.shares_memory(numpy.asarray(a), array))
+        array[0] = 1
+        self.assertAllEqual(numpy.asarray(a), numpy.arange(6.))
+        self.assertEqual(a.bytes, numpy.arange(6.).tobytes())
+        self.assertIs(type(a.bytes), bytes)
+
+    def test_memmap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'array.npy')
+            numpy.save(path, numpy.arange(6.))
+            array = numpy.load(path, mmap_mode='r')
+            a = nutils.types.arraydata(array)
+            self.assertTrue(numpy.shares_memory(numpy.asarray(a), array))
+            self.assertAllEqual(numpy.asarray(pickle.loads(pickle.dumps(a))), numpy.arange(6.))
+            del a, array
+
 
 class lru_cache(TestCase):
 